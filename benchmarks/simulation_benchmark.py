@@ -0,0 +1,385 @@
+"""
+Performance benchmarks for the simulation and rendering paths of red_green_playground.py.
+
+Each case builds a deterministic, parameterized scene (barrier count, video length, physics
+substeps per frame, distractor probability and maxActive, render resolution) and times one of:
+- simulation          run_simulation_with_visualization (target only)
+- key_distractors     simulate_key_distractor, once per key distractor
+- random_distractors  generate_random_distractors
+- render              get_high_res_obs_array
+
+For every case it reports wall time (median and min over --repeat runs), the median relative to
+the reference workload (see below), peak memory of Python and NumPy allocations (tracemalloc, measured in a
+separate untimed run) and frames per second.
+
+Usage:
+    python benchmarks/simulation_benchmark.py                         # quick suite, print a table
+    python benchmarks/simulation_benchmark.py --suite full --output results.json
+    python benchmarks/simulation_benchmark.py --save-baseline benchmarks/baseline.json   # refresh the stored baseline
+    python benchmarks/simulation_benchmark.py --baseline benchmarks/baseline.json --threshold 0.15
+
+With --baseline, exits with status 1 if any case is more than --threshold (fractional) slower
+than the baseline. Absolute times do not carry over between machines, so a fixed reference
+workload (plain pymunk stepping and NumPy drawing, no code from the app) is timed before and after
+the cases, and the gate compares each case's median relative to the reference median of the same
+run. This absorbs most of the difference in machine speed, but not all of it: the environment
+(host, Python, numpy, pymunk) is recorded in the baseline and a warning is printed when it
+differs. Regenerate the baseline with --save-baseline on the machine that runs the gate, and
+raise --repeat there if short cases are noisy.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np
+import pymunk
+
+import red_green_playground as rg
+
+# The app logs every simulation at INFO; keep that out of the timings (warnings and errors still show)
+rg.logger.setLevel(logging.WARNING)
+
+WORLD_WIDTH = 20
+WORLD_HEIGHT = 20
+BALL_SPEED = 3.6
+FPS = 30
+
+DEFAULT_PARAMS = {
+    'barriers': 4,
+    'video_length': 10,
+    'substeps': 10,
+    'distractor_probability': 0.0,
+    'max_active': 5,
+    'key_distractors': 0,
+    'res_multiplier': 4,
+    'sensor_detection': 'frame',
+    'seed': 0,
+}
+
+# Each suite entry is (benchmark, {param: [values]}); the grid of values is expanded into cases
+SUITES = {
+    'quick': [
+        ('simulation', {'barriers': [4], 'video_length': [10], 'substeps': [10]}),
+        ('key_distractors', {'key_distractors': [4]}),
+        ('random_distractors', {'distractor_probability': [0.1], 'max_active': [5]}),
+        ('render', {'res_multiplier': [4]}),
+    ],
+    'full': [
+        ('simulation', {'barriers': [0, 4, 16, 32], 'video_length': [10, 30], 'substeps': [10, 100]}),
+        ('simulation', {'substeps': [2, 10, 100], 'sensor_detection': ['frame', 'substep']}),
+        ('key_distractors', {'key_distractors': [1, 8], 'barriers': [4, 16], 'substeps': [10, 100]}),
+        ('random_distractors', {'distractor_probability': [0.05, 0.2], 'max_active': [5, 20], 'barriers': [4, 16]}),
+        ('render', {'res_multiplier': [1, 4, 8], 'video_length': [10, 30]}),
+    ],
+}
+
+
+def make_scene(params):
+    """
+    Deterministic scene for the given parameters: a 1x1 target in the bottom-left corner, barriers
+    scattered over a grid of cells (never on the target's start cell), two occluders and two small
+    sensors along the walls. Returns (entities, simulationParams list, distractorParams).
+    """
+    rng = np.random.default_rng(params['seed'])
+    entities = [{'id': 'target', 'type': 'target', 'x': 1, 'y': 1, 'width': 1, 'height': 1, 'direction': 0.7}]
+
+    cells_per_side = 6
+    cell = WORLD_WIDTH / cells_per_side
+    cells = [(i, j) for i in range(cells_per_side) for j in range(cells_per_side) if (i, j) != (0, 0)]
+    if params['barriers'] > len(cells):
+        raise ValueError(f"At most {len(cells)} barriers are supported")
+    for n, k in enumerate(rng.choice(len(cells), size=params['barriers'], replace=False)):
+        i, j = cells[k]
+        width, height = rng.uniform(0.5, 1.5, size=2)
+        x = i * cell + 0.6 + rng.uniform(0, cell - 1.2 - width)
+        y = j * cell + 0.6 + rng.uniform(0, cell - 1.2 - height)
+        entities.append({'id': f'barrier{n}', 'type': 'barrier', 'x': x, 'y': y, 'width': width, 'height': height})
+
+    entities.append({'id': 'occluder0', 'type': 'occluder', 'x': 8, 'y': 8, 'width': 4, 'height': 3})
+    entities.append({'id': 'occluder1', 'type': 'occluder', 'x': 2, 'y': 14, 'width': 3, 'height': 2})
+    entities.append({'id': 'red', 'type': 'red_sensor', 'x': 0, 'y': WORLD_HEIGHT - 0.3, 'width': 1.5, 'height': 0.3})
+    entities.append({'id': 'green', 'type': 'green_sensor', 'x': WORLD_WIDTH - 1.5, 'y': 0, 'width': 1.5, 'height': 0.3})
+
+    # Same parameterisation as the frontend: the timestep makes the ball cover ballSpeed units per second
+    substeps = params['substeps']
+    simulationParams = [params['video_length'], BALL_SPEED, FPS, substeps, params['res_multiplier'],
+                        BALL_SPEED / (FPS * substeps), WORLD_WIDTH, WORLD_HEIGHT]
+
+    distractorParams = {
+        'keyDistractors': [
+            {'startFrame': int(s), 'x': float(x), 'y': float(y), 'direction': float(d),
+             'duration': params['video_length'], 'speed': BALL_SPEED}
+            for s, x, y, d in zip(rng.integers(0, FPS, size=params['key_distractors']),
+                                  rng.uniform(2, WORLD_WIDTH - 2, size=params['key_distractors']),
+                                  np.full(params['key_distractors'], 0.6),
+                                  rng.uniform(0.3, np.pi - 0.3, size=params['key_distractors']))
+        ],
+        'randomDistractorParams': {
+            'probability': params['distractor_probability'], 'seed': params['seed'], 'duration': 2,
+            'maxActive': params['max_active'], 'startDelay': 0.333,
+        },
+    }
+    return entities, simulationParams, distractorParams
+
+
+def _world_args(sim_data, simulationParams):
+    """Positional arguments shared by the distractor functions, as run_simulation_with_visualization passes them"""
+    videoLength, ballSpeed, fps, physicsStepsPerFrame, res_multiplier, timestep, worldWidth, worldHeight = simulationParams
+    return (sim_data, worldWidth, worldHeight, timestep, physicsStepsPerFrame, fps, ballSpeed,
+            sim_data['elasticity'], sim_data['friction'])
+
+
+def _distractor_frames(tracks):
+    return sum(len(track['step_data']) for track in tracks)
+
+
+def prepare_case(bench, params):
+    """Returns a zero-argument function running the measured work once and returning the number of frames it produced"""
+    entities, simulationParams, distractorParams = make_scene(params)
+
+    if bench == 'simulation':
+        def run():
+            return rg.run_simulation_with_visualization(entities, simulationParams,
+                                                        sensor_detection=params['sensor_detection'])['num_frames']
+        return run
+
+    # The remaining benchmarks start from an already simulated target
+    sim_data = rg.run_simulation_with_visualization(entities, simulationParams)
+    sim_data, worldWidth, worldHeight, timestep, substeps, fps, ballSpeed, elasticity, friction = _world_args(sim_data, simulationParams)
+
+    if bench == 'key_distractors':
+        def run():
+            space = pymunk.Space()
+            tracks = [rg.simulate_key_distractor(d, sim_data, worldWidth, worldHeight, timestep, substeps, fps,
+                                                 ballSpeed, elasticity, friction, space)
+                      for d in distractorParams['keyDistractors']]
+            return _distractor_frames(tracks)
+        return run
+
+    if bench == 'random_distractors':
+        def run():
+            tracks = rg.generate_random_distractors(distractorParams['randomDistractorParams'], sim_data, worldWidth,
+                                                    worldHeight, timestep, substeps, fps, ballSpeed, elasticity,
+                                                    friction, pymunk.Space())
+            return _distractor_frames(tracks)
+        return run
+
+    if bench == 'render':
+        def run():
+            return len(rg.get_high_res_obs_array(sim_data, sim_data['interval'], worldWidth, worldHeight))
+        return run
+
+    raise ValueError(f"Unknown benchmark '{bench}'")
+
+
+def case_name(bench, params):
+    changed = ','.join(f"{key}={params[key]}" for key in DEFAULT_PARAMS if key != 'seed' and params[key] != DEFAULT_PARAMS[key])
+    return f"{bench}[{changed}]"
+
+
+def expand_suite(suite):
+    cases = []
+    for bench, grid in SUITES[suite]:
+        keys = list(grid)
+        for values in itertools.product(*(grid[key] for key in keys)):
+            params = dict(DEFAULT_PARAMS, **dict(zip(keys, values)))
+            name = case_name(bench, params)
+            if name not in (c[0] for c in cases):  # grids may overlap
+                cases.append((name, bench, params))
+    return cases
+
+
+REFERENCE_REPEAT = 10
+
+
+def _reference_workload():
+    """Fixed work resembling the measured paths without touching the app: step a bouncing ball and fill frames"""
+    space = pymunk.Space()
+    walls = [pymunk.Segment(space.static_body, a, b, 0.1) for a, b in
+             [((0, 0), (WORLD_WIDTH, 0)), ((WORLD_WIDTH, 0), (WORLD_WIDTH, WORLD_HEIGHT)),
+              ((WORLD_WIDTH, WORLD_HEIGHT), (0, WORLD_HEIGHT)), ((0, WORLD_HEIGHT), (0, 0))]]
+    for wall in walls:
+        wall.elasticity = 1
+    body = pymunk.Body(1, pymunk.moment_for_circle(1, 0, 0.5))
+    body.position = (1, 1)
+    body.velocity = (BALL_SPEED * 0.7, BALL_SPEED)
+    ball = pymunk.Circle(body, 0.5)
+    ball.elasticity = 1
+    space.add(body, ball, *walls)
+    frame = np.zeros((WORLD_HEIGHT * 20, WORLD_WIDTH * 20, 3), dtype=np.uint8)
+    for _ in range(300):
+        for _ in range(10):
+            space.step(1 / (FPS * 10))
+        x, y = (int(v * 20) for v in body.position)
+        frame[:] = 255
+        frame[max(y - 10, 0):y + 10, max(x - 10, 0):x + 10] = (0, 255, 0)
+
+
+def time_reference(repeat):
+    """Wall times of repeat runs of the reference workload, after one untimed run"""
+    _reference_workload()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _reference_workload()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_case(bench, params, repeat, warmup):
+    run = prepare_case(bench, params)
+    for _ in range(warmup):
+        run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frames = run()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    median = statistics.median(times)
+    return {
+        'wall_median_s': median,
+        'wall_min_s': min(times),
+        'peak_mb': peak / 2**20,
+        'frames': frames,
+        'fps': frames / median if median > 0 else float('inf'),
+    }
+
+
+def environment():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=REPO_ROOT).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pymunk': pymunk.version,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'git_revision': revision,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+ENVIRONMENT_KEYS = ('host', 'python', 'numpy', 'pymunk', 'platform', 'processor')
+
+
+def environment_mismatch(report, baseline):
+    """Environment fields that differ between this run and the baseline, as 'key: baseline -> current'"""
+    current, recorded = report['environment'], baseline.get('environment', {})
+    return [f"{key}: {recorded.get(key)} -> {current.get(key)}" for key in ENVIRONMENT_KEYS
+            if recorded.get(key) != current.get(key)]
+
+
+def compare(results, baseline, threshold):
+    """
+    Annotates results with the change against baseline; returns the names of regressed cases.
+    Cases are compared on their time relative to the reference workload, so the gate tolerates a
+    faster or slower machine; baseline cases recorded without one fall back to absolute median times.
+    """
+    base = {r['name']: r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        if r['name'] not in base:
+            continue
+        if 'relative' in base[r['name']]:
+            change = r['relative'] / base[r['name']]['relative'] - 1
+        else:
+            change = r['wall_median_s'] / base[r['name']]['wall_median_s'] - 1
+        r['baseline_change'] = change
+        if change > threshold:
+            regressions.append(r['name'])
+    return regressions
+
+
+def print_table(results):
+    width = max(len(r['name']) for r in results)
+    has_baseline = any('baseline_change' in r for r in results)
+    header = f"{'case':<{width}}  {'median':>9}  {'min':>9}  {'med/ref':>8}  {'peak MB':>8}  {'frames':>7}  {'fps':>9}"
+    print(header + ('  vs baseline' if has_baseline else ''))
+    print('-' * (len(header) + (13 if has_baseline else 0)))
+    for r in results:
+        line = (f"{r['name']:<{width}}  {r['wall_median_s']:>8.3f}s  {r['wall_min_s']:>8.3f}s  "
+                f"{r['relative']:>8.3f}  {r['peak_mb']:>8.1f}  {r['frames']:>7}  {r['fps']:>9.1f}")
+        if 'baseline_change' in r:
+            line += f"  {r['baseline_change']:>+10.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation and rendering paths")
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    parser.add_argument('--filter', help="Only run cases whose name matches this regular expression")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per case")
+    parser.add_argument('--warmup', type=int, default=1, help="Untimed runs per case before timing")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    parser.add_argument('--baseline', help="Compare against results previously written with --output/--save-baseline")
+    parser.add_argument('--threshold', type=float, default=0.15, help="Allowed slowdown against the baseline (0.15 = 15%%)")
+    parser.add_argument('--save-baseline', help="Write results to this file for later --baseline comparisons")
+    args = parser.parse_args()
+
+    cases = expand_suite(args.suite)
+    if args.filter:
+        cases = [c for c in cases if re.search(args.filter, c[0])]
+    if not cases:
+        sys.exit("No benchmark cases selected")
+
+    print("Running reference workload ...", file=sys.stderr, flush=True)
+    reference_times = time_reference(REFERENCE_REPEAT)
+    results = []
+    for name, bench, params in cases:
+        print(f"Running {name} ...", file=sys.stderr, flush=True)
+        results.append(dict(name=name, benchmark=bench, params=params, **run_case(bench, params, args.repeat, args.warmup)))
+    # Timed on both sides of the cases so a slow spell at either end does not skew every ratio
+    reference_s = statistics.median(reference_times + time_reference(REFERENCE_REPEAT))
+    for r in results:
+        r['relative'] = r['wall_median_s'] / reference_s
+
+    report = {'environment': environment(), 'suite': args.suite, 'repeat': args.repeat,
+              'reference_s': reference_s, 'results': results}
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for mismatch in environment_mismatch(report, baseline):
+            print(f"warning: baseline environment differs ({mismatch}); regenerate it with --save-baseline "
+                  f"on this machine", file=sys.stderr)
+        if not all('relative' in r for r in baseline['results']):
+            print("warning: baseline has no reference times; comparing absolute wall times", file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold)
+
+    print_table(results)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    if regressions:
+        print(f"\nFAIL: {len(regressions)} case(s) more than {args.threshold:.0%} slower than baseline:")
+        for name in regressions:
+            print(f"  {name}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Startup benchmark for red_green_playground.py.
+
+Measures, in fresh interpreters (so nothing is already imported):
+- import time of the app module and the slowest modules it pulls in (python -X importtime)
+- time to first response: interpreter start -> app imported -> first /simulate answered
+
+Usage:
+    python benchmarks/startup_benchmark.py [--runs 5] [--top 15] [--max-startup 1.0] [--json out.json]
+
+Exits with status 1 if the median time to first response exceeds --max-startup seconds,
+so it can be used as a regression check.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_MODULE = "red_green_playground"
+
+# Small scene: target ball, a barrier, an occluder and the two sensors, one second of simulation
+FIRST_REQUEST = {
+    "entities": [
+        {"id": "target", "type": "target", "x": 3, "y": 3, "width": 1, "height": 1, "direction": 0.7},
+        {"id": "barrier", "type": "barrier", "x": 8, "y": 4, "width": 2, "height": 1.5},
+        {"id": "occluder", "type": "occluder", "x": 8, "y": 8, "width": 4, "height": 3},
+        {"id": "red", "type": "red_sensor", "x": 0, "y": 17, "width": 5, "height": 3},
+        {"id": "green", "type": "green_sensor", "x": 15, "y": 0, "width": 5, "height": 2},
+    ],
+    "simulationParams": {
+        "videoLength": 1, "ballSpeed": 3.6, "fps": 30, "physicsStepsPerFrame": 10,
+        "res_multiplier": 4, "timestep": 0.012, "worldWidth": 20, "worldHeight": 20,
+    },
+}
+
+# Runs in a fresh interpreter; reports wall times relative to interpreter start
+FIRST_RESPONSE_SCRIPT = r"""
+import json, os, sys, time
+start = float(sys.argv[1])
+sys.path.insert(0, sys.argv[2])
+import red_green_playground
+imported = time.time()
+client = red_green_playground.app.test_client()
+response = client.post("/simulate", data=sys.argv[3], content_type="application/json")
+answered = time.time()
+assert response.status_code == 200, response.status_code
+print(json.dumps({"import": imported - start, "first_response": answered - start,
+                  "request": answered - imported}))
+"""
+
+
+def measure_first_response(runs):
+    results = []
+    body = json.dumps(FIRST_REQUEST)
+    for _ in range(runs):
+        start = time.time()
+        proc = subprocess.run(
+            [sys.executable, "-c", FIRST_RESPONSE_SCRIPT, repr(start), REPO_ROOT, body],
+            capture_output=True, text=True, cwd=REPO_ROOT,
+        )
+        if proc.returncode != 0:
+            sys.exit(f"First-response run failed:\n{proc.stderr}")
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def measure_import_times(top):
+    """Cumulative import time per top-level module, parsed from python -X importtime"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {APP_MODULE}"],
+        capture_output=True, text=True, cwd=REPO_ROOT,
+    )
+    if proc.returncode != 0:
+        sys.exit(f"Import failed:\n{proc.stderr}")
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nesting is shown as two extra spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, name.strip(), int(cumulative) / 1e6))
+    # Children are printed before their parent: walk back from the app's own line to collect
+    # what it imports directly (interpreter startup modules such as site come before it)
+    modules = {}
+    app_index = max(i for i, (depth, name, _) in enumerate(entries) if name == APP_MODULE and depth == 0)
+    modules[APP_MODULE] = entries[app_index][2]
+    for depth, name, seconds in reversed(entries[:app_index]):
+        if depth == 0:
+            break
+        if depth == 1:
+            modules[name] = seconds
+    total = modules.get(APP_MODULE, 0.0)
+    slowest = sorted(((n, t) for n, t in modules.items() if n != APP_MODULE), key=lambda x: -x[1])[:top]
+    return total, slowest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure red_green_playground import time and time to first response")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to start for the first-response timing")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imported modules to list")
+    parser.add_argument("--max-startup", type=float, default=1.0, help="Fail if median time to first response exceeds this (seconds)")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    total, slowest = measure_import_times(args.top)
+    print(f"Import {APP_MODULE}: {total:.3f}s (cumulative, -X importtime)")
+    for name, seconds in slowest:
+        print(f"  {name:<40} {seconds:.3f}s")
+
+    runs = measure_first_response(args.runs)
+    medians = {key: statistics.median(r[key] for r in runs) for key in ("import", "first_response", "request")}
+    print(f"\nFirst response over {args.runs} cold starts (median):")
+    print(f"  interpreter start -> app imported : {medians['import']:.3f}s")
+    print(f"  first /simulate request           : {medians['request']:.3f}s")
+    print(f"  interpreter start -> first response: {medians['first_response']:.3f}s")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"import_total": total, "imports": dict(slowest), "runs": runs, "median": medians}, f, indent=2)
+
+    if medians["first_response"] > args.max_startup:
+        print(f"\nFAIL: time to first response {medians['first_response']:.3f}s exceeds {args.max_startup:.3f}s")
+        sys.exit(1)
+    print(f"\nOK: time to first response within {args.max_startup:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,116 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
+from werkzeug.utils import secure_filename
 import os
 import subprocess
 import tempfile
-import requests
+import mimetypes
+import gzip
+import io
+import json
+import math
+import hashlib
+import pickle
+import threading
+import time
+import re
+import uuid
+import functools
+import csv
+import warnings
+import contextlib
+import logging
+import cProfile
+import pstats
+import marshal
+import itertools
+import multiprocessing
+from collections import deque, OrderedDict
+from concurrent.futures import CancelledError, FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 
 # PHYSICS SIM
 
-import pymunk
-from flask import Flask, request, jsonify
-
 import numpy as np
 import pymunk
-from tqdm import tqdm
-import matplotlib.pyplot as plt
-import numpy as np
-from scipy.stats import vonmises
-import matplotlib
-import matplotlib.animation as animation
-import matplotlib.pyplot as plt
-import os
-import copy
-import json
 
-GLOBAL_SIM_DATA = None
+# matplotlib and requests are slow to import and only needed by a few code paths (get_anim,
+# upstream asset fetches), so they are imported on first use to keep worker cold starts fast.
+# See benchmarks/startup_benchmark.py.
+
+def _requests():
+    """The requests module, imported on first upstream fetch"""
+    import requests
+    return requests
+
+# Per-session simulation store: memory budget for stored results, and the cookie naming a client's session
+SIM_STORE_MAX_BYTES = int(os.environ.get('SIM_STORE_MAX_BYTES', 256 * 1024 * 1024))
+SESSION_COOKIE = 'rg_session'
+
+# Engines available to run_simulation_with_visualization for the target trajectory
+SIMULATION_ENGINES = ('pymunk', 'analytic')
+# Upper bound on perturbed copies per /simulate_monte_carlo request
+MONTE_CARLO_MAX_SAMPLES = int(os.environ.get('MONTE_CARLO_MAX_SAMPLES', 100000))
+
+# Upper bound on candidate scenes per /search_stimuli request
+SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', 1000000))
+
+# When the red/green sensors are checked: once per frame, or swept over every physics step
+SENSOR_DETECTION_MODES = ('frame', 'substep')
+
+# Worker threads running interactive /simulate jobs (see SimulationJobs)
+SIM_JOB_WORKERS = int(os.environ.get('SIM_JOB_WORKERS', os.cpu_count() or 1))
+# Size of the process pool shared by /simulate_batch and /search_stimuli (override with SIM_BATCH_MAX_WORKERS)
+# Default number of worker processes used by /simulate_batch (override with SIM_BATCH_MAX_WORKERS)
+SIM_BATCH_MAX_WORKERS = int(os.environ.get('SIM_BATCH_MAX_WORKERS', os.cpu_count() or 1))
+
+# Simulation result cache: in-memory LRU size, and an optional directory for the on-disk tier
+SIM_CACHE_MAX_ENTRIES = int(os.environ.get('SIM_CACHE_MAX_ENTRIES', 128))
+SIM_CACHE_DIR = os.environ.get('SIM_CACHE_DIR')
+# Bump when simulation output changes so stale on-disk entries are not served
+SIM_CACHE_VERSION = 2
+
+# Target state is checkpointed every CHECKPOINT_INTERVAL_FRAMES frames, so edited scenes can resume
+# from the last frame the edit cannot have affected instead of frame 0
+CHECKPOINT_INTERVAL_FRAMES = int(os.environ.get('CHECKPOINT_INTERVAL_FRAMES', 30))
+
+# Compact columnar binary container for sim_data (see encode_sim_data_binary)
+SIM_BINARY_MIMETYPE = 'application/x-rgsim'
+SIM_BINARY_MAGIC = b'RGSIM\x00\x01\n'
+TARGET_COLUMNS = ('x', 'y', 'vx', 'vy', 'speed', 'dir')
+DISTRACTOR_COLUMNS = ('x', 'y', 'vx', 'vy')
+DISTRACTOR_GROUPS = ('key_distractors', 'random_distractors')
+
+# Target frames per record emitted by /simulate_stream
+SIM_STREAM_CHUNK_FRAMES = 30
+
+# FFmpeg executable, and the directory /render_mp4 stores videos in when asked to keep them
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+RENDER_OUTPUT_DIR = os.environ.get('RENDER_OUTPUT_DIR')
+# Encoder settings /render_mp4 accepts from clients (x264 and x265 share presets and the CRF scale)
+MP4_CODECS = ('libx264', 'libx265')
+MP4_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow')
+MP4_CRF_RANGE = (0, 51)
+
+# WebM -> MP4 transcode jobs: concurrent ffmpeg processes, queued jobs allowed, and seconds
+# a finished job (and its files) is kept before cleanup
+TRANSCODE_MAX_CONCURRENT = int(os.environ.get('TRANSCODE_MAX_CONCURRENT', 1))
+TRANSCODE_MAX_PENDING = int(os.environ.get('TRANSCODE_MAX_PENDING', 16))
+TRANSCODE_JOB_TTL = float(os.environ.get('TRANSCODE_JOB_TTL', 600))
+
+# Read-through cache for site_static_assets. ASSET_BASE_URL may also be a local directory
+# standing in for the bucket. Cached assets are revalidated upstream after ASSET_CACHE_MAX_AGE seconds.
+ASSET_BASE_URL = os.environ.get('ASSET_BASE_URL', 'https://redgreenplayground.s3.us-east-2.amazonaws.com/site_static_assets')
+ASSET_CACHE_DIR = os.environ.get('ASSET_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'red_green_asset_cache'))
+ASSET_CACHE_MAX_BYTES = int(os.environ.get('ASSET_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+ASSET_CACHE_MAX_AGE = float(os.environ.get('ASSET_CACHE_MAX_AGE', 300))
+ASSET_CACHE_LOCK_STRIPES = 64
+
+# Per-trial metrics aggregation: the diameters published under varying_diameters/ (as on the diameter
+# pages), metrics where higher is better (the rest are errors, lower is better), and fetch concurrency
+METRICS_DIAMETERS = [str(d) for d in range(10, 101)]
+METRICS_HIGHER_BETTER = {'discrete_mutual_information', 'red_green_ordering', 'decision_prob_correlation',
+                         'green_given_decision_correlation'}
+METRICS_FETCH_WORKERS = int(os.environ.get('METRICS_FETCH_WORKERS', 16))
 
 # Define the path to the React build folder relative to this file
 build_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "build")
@@ -30,7 +118,322 @@ assets_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
 # Note: site_static_assets are now served from AWS S3, not locally
 
 # Flask app initialization
-app = Flask(__name__, static_folder=os.path.join(build_path, "static"))
+# Static files (including build/static) are served by STATIC_INDEX below rather than Flask's static route
+app = Flask(__name__, static_folder=None)
+
+# Static file serving: extensions worth compressing, and how long browsers may cache
+# non-hashed files (hashed build/static files are cached for a year)
+COMPRESSIBLE_EXTENSIONS = {'.js', '.css', '.html', '.json', '.svg', '.txt', '.map', '.ico', '.xml', '.webmanifest'}
+# Missing paths with these extensions (or under static/) get a 404; other paths are React Router routes
+STATIC_ASSET_EXTENSIONS = COMPRESSIBLE_EXTENSIONS | {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp4', '.webm',
+                                                     '.woff', '.woff2', '.ttf', '.eot', '.csv'}
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 3600))
+
+# Logging: level and format ('text' or 'json', one object per line) of the server log
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+
+# Opt-in request profiling (?profile=1 or X-Profile: 1) and how many profiles to keep
+ENABLE_PROFILING = os.environ.get('ENABLE_PROFILING', '').lower() in ('1', 'true', 'yes')
+PROFILE_BUFFER_SIZE = int(os.environ.get('PROFILE_BUFFER_SIZE', 20))
+
+# Histogram buckets (seconds) for request and pipeline stage latencies
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger('red_green_playground')
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Log lines with the fields passed through extra={...}: 'time LEVEL message key=value ...',
+    or with json_lines=True one JSON object per line.
+    """
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+    def __init__(self, json_lines=False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        fields = {k: v for k, v in vars(record).items() if k not in self.RESERVED}
+        timestamp = self.formatTime(record, '%Y-%m-%dT%H:%M:%S')
+        message = record.getMessage()
+        if record.exc_info:
+            fields['exc_info'] = self.formatException(record.exc_info)
+        if self.json_lines:
+            return json.dumps({'time': timestamp, 'level': record.levelname, 'message': message, **fields}, default=str)
+        line = f"{timestamp} {record.levelname} {message}"
+        if fields:
+            line += ' ' + ' '.join(f"{k}={v}" for k, v in fields.items() if k != 'exc_info')
+        if 'exc_info' in fields:
+            line += '\n' + fields['exc_info']
+        return line
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(json_lines=(fmt == 'json')))
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+configure_logging()
+
+class MetricsRegistry:
+    """
+    Minimal in-process Prometheus-style registry: counters, histograms and callback metrics that are
+    read when scraped. render() produces the text exposition format served by /metrics.
+    Metrics are per process; simulations run in batch worker processes are not counted.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = OrderedDict()
+
+    def _register(self, name, kind, help, **extra):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = {'type': kind, 'help': help, 'values': {}, **extra}
+        return name
+
+    def counter(self, name, help):
+        return self._register(name, 'counter', help)
+
+    def histogram(self, name, help, buckets=METRICS_LATENCY_BUCKETS):
+        return self._register(name, 'histogram', help, buckets=tuple(buckets))
+
+    def callback(self, name, kind, help, fn):
+        """Metric whose value is fn() at scrape time (a number, or a dict of label tuple -> number)"""
+        return self._register(name, kind, help, fn=fn)
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            values = self._metrics[name]['values']
+            values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            metric = self._metrics[name]
+            series = metric['values'].get(key)
+            if series is None:
+                series = metric['values'][key] = {'buckets': [0] * len(metric['buckets']), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(metric['buckets']):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+    def render(self):
+        with self._lock:
+            metrics = [(name, dict(metric, values=dict(metric['values']))) for name, metric in self._metrics.items()]
+        lines = []
+        for name, metric in metrics:
+            values = metric['values']
+            if 'fn' in metric:
+                try:
+                    value = metric['fn']()
+                except Exception as e:
+                    logger.warning("Metric callback failed", extra={'metric': name, 'error': str(e)})
+                    continue
+                values = value if isinstance(value, dict) else {(): value}
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for labels, value in values.items():
+                if metric['type'] != 'histogram':
+                    lines.append(f"{name}{self._format_labels(labels)} {value}")
+                    continue
+                with self._lock:
+                    buckets, total, count = list(value['buckets']), value['sum'], value['count']
+                for bound, bucket_count in zip(metric['buckets'], buckets):
+                    lines.append(f"{name}_bucket{self._format_labels(labels + (('le', repr(float(bound))),))} {bucket_count}")
+                lines.append(f"{name}_bucket{self._format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {total}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+METRICS = MetricsRegistry()
+METRICS.counter('rg_http_requests_total', "HTTP requests by endpoint, method and status")
+METRICS.histogram('rg_http_request_duration_seconds', "Time until the response is returned (before any streamed body) by endpoint")
+METRICS.histogram('rg_stage_duration_seconds', "Time spent per pipeline stage")
+METRICS.counter('rg_simulations_total', "Simulations served by engine and cache result")
+METRICS.counter('rg_simulation_frames_total', "Target frames simulated")
+METRICS.counter('rg_simulation_frames_reused_total', "Target frames copied from a previous result by incremental simulations")
+METRICS.counter('rg_distractors_total', "Distractor tracks simulated by kind")
+METRICS.counter('rg_distractor_frames_total', "Distractor frames simulated by kind")
+METRICS.counter('rg_simulation_jobs_total', "Finished simulation jobs by status (completed, cancelled, error)")
+METRICS.counter('rg_transcode_jobs_total', "Finished WebM to MP4 conversions by status")
+
+# Stage durations of the request being handled by this thread, for ?timings=1 responses
+_request_timings = threading.local()
+
+def record_stage(stage, seconds):
+    """Record a pipeline stage duration in the stage histogram and in the current request's breakdown"""
+    METRICS.observe('rg_stage_duration_seconds', seconds, stage=stage)
+    timings = getattr(_request_timings, 'stages', None)
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextlib.contextmanager
+def timed_stage(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def _server_timing_header(timings):
+    return ', '.join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items())
+
+@app.before_request
+def _start_request_metrics():
+    request.environ['rg.start_time'] = time.perf_counter()
+    _request_timings.stages = {}
+
+@app.after_request
+def _record_request_metrics(response):
+    start = request.environ.get('rg.start_time')
+    endpoint = request.endpoint or 'unmatched'
+    METRICS.inc('rg_http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    if start is not None:
+        METRICS.observe('rg_http_request_duration_seconds', time.perf_counter() - start, endpoint=endpoint)
+    return response
+
+@app.teardown_request
+def _clear_request_timings(exc):
+    _request_timings.stages = None
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint (text exposition format)"""
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+class ProfileStore:
+    """
+    Ring buffer of the last max_profiles request profiles. Each keeps the raw cProfile stats
+    (downloadable as a .prof file readable with pstats / snakeviz) and request metadata.
+    """
+    def __init__(self, max_profiles=20):
+        self._profiles = deque(maxlen=max_profiles)
+        self._lock = threading.Lock()
+
+    def add(self, profiler, endpoint, duration, status):
+        profiler.create_stats()
+        profile = {
+            'id': uuid.uuid4().hex,
+            'endpoint': endpoint,
+            'path': request.full_path.rstrip('?'),
+            'status': status,
+            'duration': duration,
+            'created': time.time(),
+            'stats': profiler.stats,
+        }
+        with self._lock:
+            self._profiles.append(profile)
+        return profile['id']
+
+    def get(self, profile_id):
+        with self._lock:
+            return next((p for p in self._profiles if p['id'] == profile_id), None)
+
+    def list(self):
+        with self._lock:
+            return [self.describe(p) for p in reversed(self._profiles)]
+
+    @staticmethod
+    def describe(profile):
+        return {k: profile[k] for k in ('id', 'endpoint', 'path', 'status', 'duration', 'created')}
+
+    @staticmethod
+    def dump(profile):
+        """The stats in the pstats file format (what cProfile's dump_stats writes)"""
+        return marshal.dumps(profile['stats'])
+
+    @staticmethod
+    def top_functions(profile, sort='tottime', limit=30):
+        """Flat list of the most expensive functions, by own time (tottime) or including callees (cumtime)"""
+        rows = []
+        for (filename, line, function), (primitive_calls, calls, tottime, cumtime, _) in profile['stats'].items():
+            rows.append({
+                'function': pstats.func_std_string((filename, line, function)),
+                'calls': calls,
+                'primitive_calls': primitive_calls,
+                'tottime': tottime,
+                'cumtime': cumtime,
+                'tottime_per_call': tottime / calls if calls else 0.0,
+            })
+        rows.sort(key=lambda row: row[sort], reverse=True)
+        return rows[:limit]
+
+PROFILES = ProfileStore(PROFILE_BUFFER_SIZE)
+
+def _profiling_requested():
+    return ENABLE_PROFILING and (request.args.get('profile') in ('1', 'true') or
+                                 request.headers.get('X-Profile', '').lower() in ('1', 'true'))
+
+def profiled(view):
+    """
+    Profile the decorated view with cProfile when the request asks for it (?profile=1 or X-Profile: 1)
+    and ENABLE_PROFILING is set. The profile id is returned in the X-Profile-Id header.
+    Only the request thread is profiled: work done by transcode workers or ffmpeg is not included.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _profiling_requested():
+            return view(*args, **kwargs)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        finally:
+            profiler.disable()
+        profile_id = PROFILES.add(profiler, request.endpoint, time.perf_counter() - start, response.status_code)
+        response.headers['X-Profile-Id'] = profile_id
+        logger.info("Request profiled", extra={'profile_id': profile_id, 'endpoint': request.endpoint})
+        return response
+    return wrapper
+
+@app.route('/profiles', methods=['GET'])
+def list_profiles():
+    """List the buffered request profiles, newest first"""
+    if not ENABLE_PROFILING:
+        return jsonify({"status": "error", "message": "Profiling is disabled (set ENABLE_PROFILING=1)"}), 404
+    return jsonify({"status": "success", "profiles": PROFILES.list()})
+
+@app.route('/profiles/<profile_id>', methods=['GET'])
+def get_profile_summary(profile_id):
+    """
+    Top functions of a profile.
+    Query parameters: sort ('tottime' (default) or 'cumtime'), limit (default 30)
+    """
+    profile = PROFILES.get(profile_id) if ENABLE_PROFILING else None
+    if profile is None:
+        return jsonify({"status": "error", "message": "Unknown or evicted profile"}), 404
+    sort = request.args.get('sort', 'tottime')
+    if sort not in ('tottime', 'cumtime'):
+        return jsonify({"status": "error", "message": "sort must be 'tottime' or 'cumtime'"}), 400
+    limit = int(request.args.get('limit', 30))
+    return jsonify({"status": "success", "profile": ProfileStore.describe(profile),
+                    "functions": ProfileStore.top_functions(profile, sort, limit)})
+
+@app.route('/profiles/<profile_id>/download', methods=['GET'])
+def download_profile(profile_id):
+    """Download a profile as a .prof file (load with pstats.Stats(path) or snakeviz)"""
+    profile = PROFILES.get(profile_id) if ENABLE_PROFILING else None
+    if profile is None:
+        return jsonify({"status": "error", "message": "Unknown or evicted profile"}), 404
+    return send_file(io.BytesIO(ProfileStore.dump(profile)), mimetype='application/octet-stream',
+                     as_attachment=True, download_name=f"{profile['endpoint']}-{profile_id}.prof")
 
 def get_anim(frames, framerate=30, skip_t = 1):
     """
@@ -40,7 +443,10 @@ def get_anim(frames, framerate=30, skip_t = 1):
     height, width, _ = frames[0].shape
     dpi = 70
     # orig_backend = matplotlib.get_backend()
+    import matplotlib
     matplotlib.use('Agg')  # Switch to headless 'Agg' to inhibit figure rendering.
+    import matplotlib.animation as animation
+    import matplotlib.pyplot as plt
     max_figsize_width = 6
 
     fig, ax = plt.subplots(1, 1, figsize=(max_figsize_width, max_figsize_width*(height/width)))
@@ -63,33 +469,696 @@ def save_to_json(data, filename="data.json"):
     try:
         with open(filename, "w") as json_file:
             json.dump(data, json_file, indent=4)
-        print(f"Data successfully saved to {filename}")
+        logger.info("Data saved to JSON", extra={'filename': filename})
     except Exception as e:
-        print(f"An error occurred while saving to JSON: {e}")
+        logger.error("Error saving to JSON", extra={'filename': filename, 'error': str(e)})
 
 def check_collision_with_ball(x1, y1, r1, x2, y2, r2):
     """Check if two circles collide"""
     dist_sq = (x1 - x2)**2 + (y1 - y2)**2
     return dist_sq < (r1 + r2)**2
 
-def simulate_key_distractor(keyDistractor, sim_data, worldWidth, worldHeight, TIMESTEP, FRAME_INTERVAL, FPS, ballSpeed, elasticity, friction, space):
-    """Simulate a single key distractor"""
-    startFrame = keyDistractor['startFrame']
-    x = keyDistractor['x']  # Bottom-left corner x
-    y = keyDistractor['y']  # Bottom-left corner y
-    direction = keyDistractor['direction']
-    duration = keyDistractor['duration']
-    distractor_speed = keyDistractor.get('speed', ballSpeed)  # Get speed from keyDistractor, default to ballSpeed
-    
-    # Calculate number of frames for this distractor
-    numDistractorFrames = int(duration * FPS)
-    
-    # Create a new pymunk space for this distractor (to avoid interfering with main ball)
-    distractor_space = pymunk.Space()
-    distractor_space.gravity = (0, 0)
-    
-    # Add walls
-    static_body = distractor_space.static_body
+def _circle_rect_toi(x, y, vx, vy, r, x0, y0, x1, y1):
+    """
+    Time of impact of a circle (center x, y, radius r) moving with velocity (vx, vy)
+    against the axis-aligned rectangle [x0, x1] x [y0, y1].
+    Returns (t, nx, ny) with the outward contact normal, or (inf, 0, 0) if they never touch.
+    Only approaching contacts count, so a circle sitting on a face and moving away is ignored.
+    """
+    best_t, best_nx, best_ny = math.inf, 0.0, 0.0
+    eps = 1e-9
+
+    # Faces of the rectangle expanded by r
+    if vx > 0 and x <= x0 - r + eps:
+        t = (x0 - r - x) / vx
+        if y0 <= y + vy * t <= y1 and t < best_t:
+            best_t, best_nx, best_ny = t, -1.0, 0.0
+    elif vx < 0 and x >= x1 + r - eps:
+        t = (x1 + r - x) / vx
+        if y0 <= y + vy * t <= y1 and t < best_t:
+            best_t, best_nx, best_ny = t, 1.0, 0.0
+    if vy > 0 and y <= y0 - r + eps:
+        t = (y0 - r - y) / vy
+        if x0 <= x + vx * t <= x1 and t < best_t:
+            best_t, best_nx, best_ny = t, 0.0, -1.0
+    elif vy < 0 and y >= y1 + r - eps:
+        t = (y1 + r - y) / vy
+        if x0 <= x + vx * t <= x1 and t < best_t:
+            best_t, best_nx, best_ny = t, 0.0, 1.0
+
+    # Rounded corners
+    a = vx * vx + vy * vy
+    if a > 0:
+        for cx, cy in ((x0, y0), (x1, y0), (x0, y1), (x1, y1)):
+            dx, dy = x - cx, y - cy
+            b = dx * vx + dy * vy
+            if b >= 0:
+                continue  # moving away from this corner
+            c = dx * dx + dy * dy - r * r
+            disc = b * b - a * c
+            if disc < 0:
+                continue
+            t = (-b - math.sqrt(disc)) / a
+            if -eps <= t < best_t:
+                t = max(t, 0.0)
+                best_t = t
+                best_nx, best_ny = (x + vx * t - cx) / r, (y + vy * t - cy) / r
+
+    return max(best_t, 0.0), best_nx, best_ny
+
+def _circle_rect_overlap(x, y, r, x0, y0, x1, y1):
+    closest_x = max(x0, min(x, x1))
+    closest_y = max(y0, min(y, y1))
+    return (x - closest_x)**2 + (y - closest_y)**2 <= r * r
+
+def _target_checkpoint(frame, body, radius, analytic_ball, barriers, worldWidth, worldHeight, space, timestep):
+    """
+    State of the target at a frame, enough to resume the simulation from it ({frame, x, y, vx, vy,
+    angle, angular_velocity}, plus time and bounces for the analytic engine).
+    pymunk keeps contact state between steps (for collision_persistence steps), so a pymunk target
+    is only checkpointed while it is far enough from walls and barriers that it has none; returns None otherwise.
+    """
+    x, y = body.position
+    vx, vy = body.velocity
+    checkpoint = {'frame': frame, 'x': x, 'y': y, 'vx': vx, 'vy': vy,
+                  'angle': body.angle, 'angular_velocity': body.angular_velocity}
+    if analytic_ball is not None:
+        checkpoint.update(time=analytic_ball.time, bounces=analytic_ball.bounces)
+        return checkpoint
+    clearance = radius + (space.collision_persistence + 1) * math.hypot(vx, vy) * timestep + 0.01
+    if min(x, y, worldWidth - x, worldHeight - y) <= clearance + 0.01:  # walls are 0.01 thick segments
+        return None
+    for b in barriers:
+        if _circle_rect_overlap(x, y, clearance, b['x'], b['y'], b['x'] + b['width'], b['y'] + b['height']):
+            return None
+    return checkpoint
+
+def sensor_contact(x, y, dx, dy, r, sensors):
+    """
+    First contact of a circle (center x, y, radius r) moving in a straight line by (dx, dy)
+    with any of the sensors, given as a list of (name, (x0, y0, x1, y1)).
+    Returns (fraction of the move in [0, 1], name), or None. Ties go to the earlier sensor.
+    """
+    best = None
+    for name, rect in sensors:
+        x0, y0, x1, y1 = rect
+        # Cheap rejection: the swept circle's bounding box misses the sensor
+        if (min(x, x + dx) > x1 + r or max(x, x + dx) < x0 - r or
+                min(y, y + dy) > y1 + r or max(y, y + dy) < y0 - r):
+            continue
+        if _circle_rect_overlap(x, y, r, *rect):
+            t = 0.0
+        else:
+            t = _circle_rect_toi(x, y, dx, dy, r, *rect)[0]
+        if t <= 1.0 and (best is None or t < best[0]):
+            best = (t, name)
+    return best
+
+class AnalyticBall:
+    """
+    Closed-form trajectory of a frictionless, perfectly elastic circle in zero gravity,
+    bouncing off the four world walls and axis-aligned box barriers.
+    Instead of stepping, advance() jumps from one time of impact to the next and reflects
+    the velocity about the contact normal, so cost scales with the number of bounces.
+    Walls are inset by wall_radius to match the pymunk wall segments.
+    With sensors (a list of (name, (x0, y0, x1, y1))), the ball stops at the first sensor
+    contact and sensor_hit is set to (time since start, name).
+    """
+    MAX_EVENTS_PER_ADVANCE = 10000  # guard against a ball wedged between two surfaces
+
+    def __init__(self, x, y, vx, vy, radius, barriers, worldWidth, worldHeight, wall_radius=0.01, sensors=()):
+        self.x, self.y = float(x), float(y)
+        self.vx, self.vy = float(vx), float(vy)
+        self.radius = radius
+        self.bounces = 0
+        self.time = 0.0
+        self.sensors = list(sensors)
+        self.sensor_hit = None
+        self.x_min = self.y_min = radius + wall_radius
+        self.x_max = worldWidth - radius - wall_radius
+        self.y_max = worldHeight - radius - wall_radius
+        self.boxes = [(b['x'], b['y'], b['x'] + b['width'], b['y'] + b['height']) for b in barriers]
+
+    def next_impact(self):
+        """Return (t, nx, ny) for the next wall or barrier contact, or (inf, 0, 0)"""
+        x, y, vx, vy = self.x, self.y, self.vx, self.vy
+        best_t, best_nx, best_ny = math.inf, 0.0, 0.0
+        if vx < 0:
+            best_t, best_nx, best_ny = max((self.x_min - x) / vx, 0.0), 1.0, 0.0
+        elif vx > 0:
+            best_t, best_nx, best_ny = max((self.x_max - x) / vx, 0.0), -1.0, 0.0
+        if vy < 0:
+            t = max((self.y_min - y) / vy, 0.0)
+            if t < best_t:
+                best_t, best_nx, best_ny = t, 0.0, 1.0
+        elif vy > 0:
+            t = max((self.y_max - y) / vy, 0.0)
+            if t < best_t:
+                best_t, best_nx, best_ny = t, 0.0, -1.0
+        for x0, y0, x1, y1 in self.boxes:
+            t, nx, ny = _circle_rect_toi(x, y, vx, vy, self.radius, x0, y0, x1, y1)
+            if t < best_t:
+                best_t, best_nx, best_ny = t, nx, ny
+        return best_t, best_nx, best_ny
+
+    def advance(self, dt):
+        """Move the ball forward by dt seconds of simulation time, bouncing as needed"""
+        if self.sensor_hit is not None:
+            return  # stopped on a sensor
+        remaining = dt
+        for _ in range(self.MAX_EVENTS_PER_ADVANCE):
+            t, nx, ny = self.next_impact()
+            if self.sensors:
+                # Sensors don't deflect the ball, check the straight stretch up to the next bounce
+                segment = min(t, remaining)
+                contact = sensor_contact(self.x, self.y, self.vx * segment, self.vy * segment, self.radius, self.sensors)
+                if contact is not None:
+                    t_hit = contact[0] * segment
+                    self.x += self.vx * t_hit
+                    self.y += self.vy * t_hit
+                    self.time += dt - remaining + t_hit
+                    self.sensor_hit = (self.time, contact[1])
+                    return
+            if t > remaining:
+                break
+            self.x += self.vx * t
+            self.y += self.vy * t
+            dot = self.vx * nx + self.vy * ny
+            self.vx -= 2 * dot * nx
+            self.vy -= 2 * dot * ny
+            self.bounces += 1
+            remaining -= t
+        self.x += self.vx * remaining
+        self.y += self.vy * remaining
+        self.time += dt
+
+def _circle_rect_toi_batch(x, y, vx, vy, r, x0, y0, x1, y1):
+    """
+    Vectorized _circle_rect_toi for arrays of circles with the same radius.
+    The rectangle bounds may be scalars or per-circle arrays; NaN bounds never collide.
+    Returns arrays (t, nx, ny) with t = inf where there is no contact.
+    """
+    eps = 1e-9
+    best_t = np.full(x.shape, np.inf)
+    best_nx = np.zeros(x.shape)
+    best_ny = np.zeros(x.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Faces of the rectangle expanded by r: (moving towards it, starts outside, face coordinate, normal)
+        for approaching, t, along, lo, hi, nx, ny in (
+                ((vx > 0) & (x <= x0 - r + eps), (x0 - r - x) / vx, 'y', y0, y1, -1.0, 0.0),
+                ((vx < 0) & (x >= x1 + r - eps), (x1 + r - x) / vx, 'y', y0, y1, 1.0, 0.0),
+                ((vy > 0) & (y <= y0 - r + eps), (y0 - r - y) / vy, 'x', x0, x1, 0.0, -1.0),
+                ((vy < 0) & (y >= y1 + r - eps), (y1 + r - y) / vy, 'x', x0, x1, 0.0, 1.0)):
+            at = y + vy * t if along == 'y' else x + vx * t
+            hit = approaching & (at >= lo) & (at <= hi) & (t < best_t)
+            best_t = np.where(hit, t, best_t)
+            best_nx = np.where(hit, nx, best_nx)
+            best_ny = np.where(hit, ny, best_ny)
+
+        # Rounded corners
+        a = vx * vx + vy * vy
+        for cx, cy in ((x0, y0), (x1, y0), (x0, y1), (x1, y1)):
+            dx, dy = x - cx, y - cy
+            b = dx * vx + dy * vy
+            disc = b * b - a * (dx * dx + dy * dy - r * r)
+            t = (-b - np.sqrt(np.maximum(disc, 0.0))) / a
+            hit = (a > 0) & (b < 0) & (disc >= 0) & (t >= -eps) & (t < best_t)
+            t = np.maximum(t, 0.0)
+            best_t = np.where(hit, t, best_t)
+            best_nx = np.where(hit, (x + vx * t - cx) / r, best_nx)
+            best_ny = np.where(hit, (y + vy * t - cy) / r, best_ny)
+    return np.maximum(best_t, 0.0), best_nx, best_ny
+
+def _circle_rect_overlap_batch(x, y, r, x0, y0, x1, y1):
+    closest_x = np.maximum(x0, np.minimum(x, x1))
+    closest_y = np.maximum(y0, np.minimum(y, y1))
+    return (x - closest_x)**2 + (y - closest_y)**2 <= r * r
+
+def _occluded_time_batch(x, y, vx, vy, duration, r, occluders):
+    """
+    Time within [0, duration] that balls moving in a straight line spend fully inside one of the
+    occluder rectangles (x0, y0, x1, y1). Overlapping occluders are not double counted.
+    """
+    starts, ends = [], []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for x0, y0, x1, y1 in occluders:
+            # The center must stay inside the occluder shrunk by r
+            x0, y0, x1, y1 = x0 + r, y0 + r, x1 - r, y1 - r
+            if x0 > x1 or y0 > y1:
+                continue  # smaller than the ball
+            enter, leave = np.zeros(x.shape), np.full(x.shape, np.inf)
+            for p, v, lo, hi in ((x, vx, x0, x1), (y, vy, y0, y1)):
+                t_lo, t_hi = (lo - p) / v, (hi - p) / v
+                inside = (p >= lo) & (p <= hi)
+                enter = np.maximum(enter, np.where(v != 0, np.minimum(t_lo, t_hi), np.where(inside, 0.0, np.inf)))
+                leave = np.minimum(leave, np.where(v != 0, np.maximum(t_lo, t_hi), np.where(inside, np.inf, -np.inf)))
+            enter = np.clip(enter, 0.0, duration)
+            starts.append(enter)
+            ends.append(np.clip(leave, enter, duration))
+    if not starts:
+        return np.zeros(x.shape)
+    # Union of the intervals, merged in order of their start
+    starts, ends = np.stack(starts, axis=1), np.stack(ends, axis=1)
+    order = np.argsort(starts, axis=1)
+    starts, ends = np.take_along_axis(starts, order, 1), np.take_along_axis(ends, order, 1)
+    total = np.zeros(x.shape)
+    cur_start, cur_end = starts[:, 0], ends[:, 0]
+    for k in range(1, starts.shape[1]):
+        separate = starts[:, k] > cur_end
+        total += np.where(separate, cur_end - cur_start, 0.0)
+        cur_start = np.where(separate, starts[:, k], cur_start)
+        cur_end = np.where(separate, ends[:, k], np.maximum(cur_end, ends[:, k]))
+    return total + cur_end - cur_start
+
+def circle_rect_overlap_area(cx, cy, r, x0, y0, x1, y1):
+    """
+    Exact area of the intersection of circles (center cx, cy, radius r) and the rectangle
+    [x0, x1] x [y0, y1]. All arguments broadcast, so many frames (or trials) are computed at once.
+    """
+    cx, cy, r = np.asarray(cx, dtype=np.float64), np.asarray(cy, dtype=np.float64), np.asarray(r, dtype=np.float64)
+    # Relative to the circle center
+    x0, x1, y0, y1 = x0 - cx, x1 - cx, y0 - cy, y1 - cy
+
+    def above(h):
+        """Area of the circle within x0 <= x <= x1 and y >= h, for h >= 0"""
+        s = np.sqrt(np.maximum(r * r - h * h, 0.0))  # half chord at height h
+
+        def integral(x):
+            # Antiderivative of sqrt(r^2 - x^2) - h, with x clipped to the chord
+            x = np.clip(x, -s, s)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                asin = np.where(r > 0, np.arcsin(np.clip(x / r, -1.0, 1.0)), 0.0)
+            return 0.5 * (x * np.sqrt(np.maximum(r * r - x * x, 0.0)) + r * r * asin) - h * x
+        return integral(x1) - integral(x0)
+
+    def above_any(h):
+        # Below -h is the mirror image of above h
+        half = above(np.zeros_like(h))
+        return np.where(h >= 0, above(np.abs(h)), 2 * half - above(np.abs(h)))
+    return np.maximum(above_any(y0) - above_any(y1), 0.0)
+
+def _disjoint_rects(rects):
+    """Split the union of rectangles (x0, y0, x1, y1) into disjoint rectangles"""
+    if len(rects) <= 1:
+        return list(rects)
+    xs = sorted({v for x0, _, x1, _ in rects for v in (x0, x1)})
+    ys = sorted({v for _, y0, _, y1 in rects for v in (y0, y1)})
+    cells = []
+    for ya, yb in zip(ys, ys[1:]):
+        ym = (ya + yb) / 2
+        run = None  # covered cells in a row are merged into one rectangle
+        for xa, xb in zip(xs, xs[1:]):
+            xm = (xa + xb) / 2
+            if any(x0 <= xm <= x1 and y0 <= ym <= y1 for x0, y0, x1, y1 in rects):
+                run = (run[0] if run else xa, xb)
+            elif run:
+                cells.append((run[0], ya, run[1], yb))
+                run = None
+        if run:
+            cells.append((run[0], ya, run[1], yb))
+    return cells
+
+def occluded_area(cx, cy, r, occluders):
+    """
+    Area of circles hidden by the union of occluder rectangles (x0, y0, x1, y1),
+    overlapping occluders are not double counted. cx, cy and r broadcast like circle_rect_overlap_area.
+    """
+    area = np.zeros(np.broadcast(cx, cy, r).shape)
+    for x0, y0, x1, y1 in _disjoint_rects(occluders):
+        area += circle_rect_overlap_area(cx, cy, r, x0, y0, x1, y1)
+    return area
+
+def _frame_runs(mask):
+    """[(first frame, first frame after)] of the runs of True in a per-frame bool array, None if still running"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], mask, [False])).astype(np.int8)))
+    return [{'entry_frame': int(a), 'exit_frame': int(b) if b < len(mask) else None}
+            for a, b in zip(edges[::2], edges[1::2])]
+
+def occlusion_annotations(sim_data, tolerance=1e-9):
+    """
+    How much of the target each occluder hides in every frame of sim_data, computed analytically
+    from step_data (no rendering). Per-frame lists follow the order of the step_data frames.
+
+    Returns {
+      'target_area', 'occluded_area' (per frame, union of the occluders), 'occluded_fraction',
+      'fully_occluded' (per frame), 'frames_fully_occluded',
+      'full_occlusion_events': [{'entry_frame', 'exit_frame'}] runs of fully occluded frames,
+      'occluders': [{'overlap_area' (per frame), 'events', 'full_events'}] one per sim_data['occluders'],
+    }
+    An event's exit_frame is the first frame after the run (None if it lasts to the end).
+    A frame counts as fully occluded when the hidden area is within `tolerance` (relative) of the target area.
+    """
+    frames = sorted(sim_data['step_data'])
+    steps = [sim_data['step_data'][f] for f in frames]
+    r = sim_data['target']['size'] / 2 if 'target' in sim_data else 0.0
+    cx = np.array([step['x'] for step in steps], dtype=np.float64) + r
+    cy = np.array([step['y'] for step in steps], dtype=np.float64) + r
+    target_area = math.pi * r * r
+    full_area = target_area * (1 - tolerance)
+
+    rects = [(o['x'], o['y'], o['x'] + o['width'], o['y'] + o['height']) for o in sim_data['occluders']]
+    per_occluder = []
+    for x0, y0, x1, y1 in rects:
+        area = circle_rect_overlap_area(cx, cy, r, x0, y0, x1, y1)
+        per_occluder.append({
+            'overlap_area': area.tolist(),
+            'events': _frame_runs(area > 0),
+            'full_events': _frame_runs((area >= full_area) & (target_area > 0)),
+        })
+    total = occluded_area(cx, cy, r, rects) if rects else np.zeros(len(frames))
+    fully = (total >= full_area) & (target_area > 0)
+    return {
+        'target_area': target_area,
+        'occluded_area': total.tolist(),
+        'occluded_fraction': (total / target_area if target_area > 0 else total).tolist(),
+        'fully_occluded': fully.tolist(),
+        'frames_fully_occluded': int(fully.sum()),
+        'full_occlusion_events': _frame_runs(fully),
+        'occluders': per_occluder,
+    }
+
+def simulate_ball_batch(x, y, vx, vy, radius, boxes, sensors, worldWidth, worldHeight, t_end, wall_radius=0.01,
+                        max_events=10000, occluders=(), max_bounces=None):
+    """
+    AnalyticBall for many balls at once: every ball starts at (x[i], y[i]) with velocity (vx[i], vy[i])
+    and moves until it touches a sensor or t_end. Each iteration advances all still-running balls
+    to their own next event (bounce, sensor contact or t_end), so the cost scales with the number
+    of bounces rather than with physics steps.
+
+    boxes and sensors are lists of (x0, y0, x1, y1) whose bounds are scalars or per-ball arrays
+    (NaN for "not present in this ball's scene"); sensors are tested in order, so earlier ones win ties.
+    occluders (scalar bounds) are used to add up the time each ball is fully hidden.
+    Balls that bounce more than max_bounces times are stopped early, without a sensor hit.
+    Returns (sensor index or -1, hit time or inf, bounce count, occluded time) arrays.
+    """
+    x, y = np.array(x, dtype=float), np.array(y, dtype=float)
+    vx, vy = np.array(vx, dtype=float), np.array(vy, dtype=float)
+    n = len(x)
+    x_min = y_min = radius + wall_radius
+    x_max, y_max = worldWidth - radius - wall_radius, worldHeight - radius - wall_radius
+
+    def per_ball(bounds):
+        return tuple(np.broadcast_to(np.asarray(b, dtype=float), (n,)) for b in bounds)
+    boxes = [per_ball(box) for box in boxes]
+    sensors = [per_ball(sensor) for sensor in sensors]
+
+    time_now = np.zeros(n)
+    hit_sensor = np.full(n, -1)
+    hit_time = np.full(n, np.inf)
+    bounces = np.zeros(n, dtype=np.int64)
+    occluded = np.zeros(n)
+    active = np.arange(n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(max_events):
+            if len(active) == 0:
+                break
+            ax, ay, avx, avy = x[active], y[active], vx[active], vy[active]
+
+            # Next wall or barrier contact, as in AnalyticBall.next_impact
+            t_wall_x = np.where(avx < 0, (x_min - ax) / avx, np.where(avx > 0, (x_max - ax) / avx, np.inf))
+            t_wall_y = np.where(avy < 0, (y_min - ay) / avy, np.where(avy > 0, (y_max - ay) / avy, np.inf))
+            t_wall_x, t_wall_y = np.maximum(t_wall_x, 0.0), np.maximum(t_wall_y, 0.0)
+            use_x = t_wall_x <= t_wall_y
+            t_imp = np.where(use_x, t_wall_x, t_wall_y)
+            nx = np.where(use_x, -np.sign(avx), 0.0)
+            ny = np.where(use_x, 0.0, -np.sign(avy))
+            for x0, y0, x1, y1 in boxes:
+                t, bnx, bny = _circle_rect_toi_batch(ax, ay, avx, avy, radius, x0[active], y0[active], x1[active], y1[active])
+                closer = t < t_imp
+                t_imp = np.where(closer, t, t_imp)
+                nx = np.where(closer, bnx, nx)
+                ny = np.where(closer, bny, ny)
+
+            # First sensor contact on the straight stretch up to the next bounce (or t_end)
+            segment = np.minimum(t_imp, t_end - time_now[active])
+            t_sensor = np.full(len(active), np.inf)
+            which = np.full(len(active), -1)
+            for k, (x0, y0, x1, y1) in enumerate(sensors):
+                bounds = (x0[active], y0[active], x1[active], y1[active])
+                t = np.where(_circle_rect_overlap_batch(ax, ay, radius, *bounds), 0.0,
+                             _circle_rect_toi_batch(ax, ay, avx, avy, radius, *bounds)[0])
+                closer = (t <= segment) & (t < t_sensor)
+                t_sensor = np.where(closer, t, t_sensor)
+                which = np.where(closer, k, which)
+
+            hit = which >= 0
+            hit_sensor[active[hit]] = which[hit]
+            hit_time[active[hit]] = time_now[active[hit]] + t_sensor[hit]
+            # Balls whose next bounce is past t_end are done, the rest bounce and continue
+            remaining = t_end - time_now[active]
+            bouncing = ~hit & (t_imp <= remaining)
+            if occluders:
+                travelled = np.where(hit, t_sensor, np.where(bouncing, t_imp, remaining))
+                occluded[active] += _occluded_time_batch(ax, ay, avx, avy, travelled, radius, occluders)
+            idx, t = active[bouncing], t_imp[bouncing]
+            x[idx] += vx[idx] * t
+            y[idx] += vy[idx] * t
+            dot = vx[idx] * nx[bouncing] + vy[idx] * ny[bouncing]
+            vx[idx] -= 2 * dot * nx[bouncing]
+            vy[idx] -= 2 * dot * ny[bouncing]
+            time_now[idx] += t
+            bounces[idx] += 1
+            active = idx if max_bounces is None else idx[bounces[idx] <= max_bounces]
+    return hit_sensor, hit_time, bounces, occluded
+
+def monte_carlo_outcomes(entities, simulationParams, samples=1000, seed=0, direction_kappa=None,
+                         position_noise=0.0, speed_noise=0.0, bins=30, return_samples=False):
+    """
+    Outcome probabilities of a scene under noise on the target's initial state, from `samples`
+    perturbed copies run together with simulate_ball_batch (the model of the 'analytic' engine,
+    with continuous sensor detection like sensor_detection='substep').
+
+    direction_kappa: von Mises concentration of the direction noise (None = no direction noise)
+    position_noise: standard deviation of Gaussian noise on the start position (world units)
+    speed_noise: standard deviation of Gaussian noise on the speed, relative to ballSpeed
+    Samples whose noisy start overlaps a barrier are discarded and counted as invalid.
+    Hit times are in seconds of video; the histogram has `bins` bins over the video length.
+    """
+    videoLength, ballSpeed, fps, physicsStepsPerFrame, res_multiplier, timestep, worldWidth, worldHeight = simulationParams
+    numFrames = int(videoLength * fps)
+    frame_time = physicsStepsPerFrame * timestep  # simulation time per frame
+    targets = [e for e in entities if e['type'] == 'target']
+    if not targets:
+        raise ValueError("Scene has no target")
+    target = targets[0]
+    radius = target['width'] / 2
+    rects = {e['type']: (e['x'], e['y'], e['x'] + e['width'], e['y'] + e['height'])
+             for e in entities if e['type'] in ('red_sensor', 'green_sensor')}
+    sensor_names = [name for name in ('red', 'green') if f'{name}_sensor' in rects]
+    sensors = [rects[f'{name}_sensor'] for name in sensor_names]
+    boxes = [(e['x'], e['y'], e['x'] + e['width'], e['y'] + e['height']) for e in entities if e['type'] == 'barrier']
+
+    rng = np.random.default_rng(seed)
+    direction = np.full(samples, float(target['direction']))
+    if direction_kappa is not None:
+        direction = rng.vonmises(direction, direction_kappa)
+    x = np.full(samples, target['x'] + radius)
+    y = np.full(samples, target['y'] + radius)
+    if position_noise:
+        x = np.clip(x + rng.normal(0.0, position_noise, samples), radius, worldWidth - radius)
+        y = np.clip(y + rng.normal(0.0, position_noise, samples), radius, worldHeight - radius)
+    speed = np.ones(samples)  # velocities are normalized, ballSpeed is applied through the timestep
+    if speed_noise:
+        speed = np.maximum(speed + rng.normal(0.0, speed_noise, samples), 0.0)
+
+    valid = np.ones(samples, dtype=bool)
+    for box in boxes:
+        valid &= ~_circle_rect_overlap_batch(x, y, radius - 1e-9, *box)
+
+    t_end = (numFrames - 1) * frame_time
+    hit_sensor, hit_time, _, _ = simulate_ball_batch(x[valid], y[valid], speed[valid] * np.cos(direction[valid]),
+                                                  speed[valid] * np.sin(direction[valid]), radius, boxes, sensors,
+                                                  worldWidth, worldHeight, t_end)
+    hit_seconds = hit_time / frame_time / fps
+    n_valid = int(valid.sum())
+    edges = np.linspace(0.0, videoLength, bins + 1)
+    result = {
+        'samples': samples,
+        'valid': n_valid,
+        'seed': seed,
+        'p_timeout': float(np.mean(hit_sensor == -1)) if n_valid else None,
+        'hit_time_histogram': {'bin_edges': edges.tolist()},
+    }
+    for name in ('red', 'green'):
+        mask = hit_sensor == sensor_names.index(name) if name in sensor_names else np.zeros(n_valid, dtype=bool)
+        result[f'p_{name}'] = float(mask.mean()) if n_valid else None
+        result[f'mean_hit_time_{name}'] = float(hit_seconds[mask].mean()) if mask.any() else None
+        result['hit_time_histogram'][name] = np.histogram(hit_seconds[mask], bins=edges)[0].tolist()
+    if return_samples:
+        names = np.array(sensor_names + ['timeout'])
+        result['sample_outcomes'] = names[hit_sensor].tolist()
+        result['sample_hit_times'] = [None if np.isinf(t) else float(t) for t in hit_seconds]
+    return result
+
+def _window_centrality(values, window):
+    """1 at the middle of [lo, hi], falling to 0 at its edges"""
+    lo, hi = window
+    half = (hi - lo) / 2
+    return 1.0 - np.abs(values - (lo + hi) / 2) / half if half > 0 else np.ones(values.shape)
+
+def _evaluate_stimulus_batch(entities, simulationParams, search, constraints, seed_sequence, size):
+    """
+    Sample `size` candidate scenes from the search space and simulate them together.
+    Returns (list of accepted candidates, number of candidates with a valid start).
+    """
+    videoLength, ballSpeed, fps, physicsStepsPerFrame, res_multiplier, timestep, worldWidth, worldHeight = simulationParams
+    numFrames = int(videoLength * fps)
+    frame_time = physicsStepsPerFrame * timestep
+    rng = np.random.default_rng(seed_sequence)
+
+    target = next(e for e in entities if e['type'] == 'target')
+    radius = target['width'] / 2
+    barriers = [e for e in entities if e['type'] == 'barrier']
+    occluders = [(e['x'], e['y'], e['x'] + e['width'], e['y'] + e['height']) for e in entities if e['type'] == 'occluder']
+    rects = {e['type']: (e['x'], e['y'], e['x'] + e['width'], e['y'] + e['height'])
+             for e in entities if e['type'] in ('red_sensor', 'green_sensor')}
+    sensor_names = [name for name in ('red', 'green') if f'{name}_sensor' in rects]
+    sensors = [rects[f'{name}_sensor'] for name in sensor_names]
+
+    # Sample the search space; unspecified dimensions keep the base scene's values
+    direction = rng.uniform(*search['direction'], size) if search.get('direction') else np.full(size, float(target['direction']))
+    position = search.get('position') or {}
+    x = rng.uniform(*position['x'], size) if position.get('x') else np.full(size, float(target['x']))
+    y = rng.uniform(*position['y'], size) if position.get('y') else np.full(size, float(target['y']))
+    jitter = float(search.get('barrierJitter', 0.0))
+    offsets = rng.uniform(-jitter, jitter, (size, len(barriers), 2)) if jitter else np.zeros((size, len(barriers), 2))
+    boxes = []
+    for k, b in enumerate(barriers):
+        bx = np.clip(b['x'] + offsets[:, k, 0], 0.0, worldWidth - b['width'])
+        by = np.clip(b['y'] + offsets[:, k, 1], 0.0, worldHeight - b['height'])
+        boxes.append((bx, by, bx + b['width'], by + b['height']))
+
+    # Early rejection of impossible starts: outside the world or overlapping a barrier or sensor
+    cx, cy = x + radius, y + radius
+    valid = (cx >= radius) & (cx <= worldWidth - radius) & (cy >= radius) & (cy <= worldHeight - radius)
+    for box in boxes + sensors:
+        valid &= ~_circle_rect_overlap_batch(cx, cy, radius - 1e-9, *box)
+
+    # Only simulate as long as a candidate can still satisfy the constraints
+    outcome = constraints.get('outcome')
+    hit_window = constraints.get('hitFrame')
+    bounce_window = constraints.get('bounces')
+    occluded_window = constraints.get('timeOccluded')
+    last_frame = numFrames - 1
+    if outcome in sensor_names and hit_window:
+        last_frame = min(last_frame, hit_window[1])
+    idx = np.flatnonzero(valid)
+    hit_sensor, hit_time, bounces, occluded = simulate_ball_batch(
+        cx[idx], cy[idx], np.cos(direction[idx]), np.sin(direction[idx]), radius,
+        [tuple(bound[idx] for bound in box) for box in boxes], sensors, worldWidth, worldHeight,
+        last_frame * frame_time, occluders=occluders, max_bounces=bounce_window[1] if bounce_window else None)
+    hit_frame = hit_time / frame_time
+    occluded_seconds = occluded / frame_time / fps
+
+    names = np.array(sensor_names + ['timeout'])
+    outcomes = names[hit_sensor]
+    accepted = np.ones(len(idx), dtype=bool)
+    if outcome is not None:
+        accepted &= outcomes == outcome
+    if hit_window:
+        accepted &= (hit_frame >= hit_window[0]) & (hit_frame <= hit_window[1])
+    if bounce_window:
+        accepted &= (bounces >= bounce_window[0]) & (bounces <= bounce_window[1])
+    if occluded_window:
+        accepted &= (occluded_seconds >= occluded_window[0]) & (occluded_seconds <= occluded_window[1])
+
+    # Score: how centrally the candidate sits inside the requested windows
+    windows = [(values, window) for values, window in ((hit_frame, hit_window), (bounces, bounce_window),
+                                                        (occluded_seconds, occluded_window)) if window]
+    score = (np.mean([_window_centrality(values, window) for values, window in windows], axis=0)
+             if windows else np.zeros(len(idx)))
+
+    candidates = []
+    for j in np.flatnonzero(accepted):
+        i = idx[j]
+        scene_entities = []
+        barrier_index = 0
+        for e in entities:
+            e = dict(e)
+            if e['type'] == 'target':
+                e.update(x=float(x[i]), y=float(y[i]), direction=float(direction[i]))
+            elif e['type'] == 'barrier':
+                e.update(x=float(boxes[barrier_index][0][i]), y=float(boxes[barrier_index][1][i]))
+                barrier_index += 1
+            scene_entities.append(e)
+        candidates.append({
+            'entities': scene_entities,
+            'outcome': str(outcomes[j]),
+            'hit_frame': None if np.isinf(hit_frame[j]) else float(hit_frame[j]),
+            'bounces': int(bounces[j]),
+            'time_occluded': float(occluded_seconds[j]),
+            'score': float(score[j]),
+        })
+    return candidates, len(idx)
+
+def search_stimuli(entities, simulationParams, search, constraints, max_workers=None):
+    """
+    Find scenes near `entities` whose target outcome satisfies `constraints`.
+
+    search: {"candidates": int, "batchSize": int, "seed": int, "topK": int,
+             "direction": [lo, hi] (radians), "position": {"x": [lo, hi], "y": [lo, hi]},
+             "barrierJitter": float (uniform offset of every barrier, world units),
+             "robustness": {"samples": int, "directionKappa": float, ...} (optional)}
+    constraints: {"outcome": "red" | "green" | "timeout", "hitFrame": [lo, hi],
+                  "bounces": [lo, hi], "timeOccluded": [lo, hi] (seconds the ball is fully hidden)}
+
+    Candidates are sampled and simulated in batches with simulate_ball_batch (the analytic engine's
+    model) over a process pool; each batch gets its own child seed, so results do not depend on the
+    number of workers. Accepted candidates are ranked by how centrally they meet the windowed
+    constraints, or, with "robustness", by the probability of the requested outcome under
+    monte_carlo_outcomes noise (evaluated for the best 4 * topK).
+    """
+    total = int(search.get('candidates', 1000))
+    if not 0 < total <= SEARCH_MAX_CANDIDATES:
+        raise ValueError(f"candidates must be between 1 and {SEARCH_MAX_CANDIDATES}")
+    if not any(e['type'] == 'target' for e in entities):
+        raise ValueError("Scene has no target")
+    batch_size = max(1, int(search.get('batchSize', 2000)))
+    top_k = int(search.get('topK', 10))
+    sizes = [min(batch_size, total - start) for start in range(0, total, batch_size)]
+    seeds = np.random.SeedSequence(int(search.get('seed', 0))).spawn(len(sizes))
+    jobs = [(entities, simulationParams, search, constraints, seed_sequence, size) for seed_sequence, size in zip(seeds, sizes)]
+
+    max_workers = min(max_workers or SIM_BATCH_MAX_WORKERS, SIM_BATCH_MAX_WORKERS, len(jobs))
+    if max_workers <= 1:
+        results = [_evaluate_stimulus_batch(*job) for job in jobs]
+    else:
+        results = [None] * len(jobs)
+        for i, future in iter_process_pool(_evaluate_stimulus_batch, jobs, max_workers):
+            results[i] = future.result()
+    candidates = [c for batch, _ in results for c in batch]
+    valid = sum(n for _, n in results)
+    accepted = len(candidates)
+
+    candidates.sort(key=lambda c: -c['score'])
+    robustness = search.get('robustness')
+    outcome = constraints.get('outcome')
+    if robustness and outcome:
+        candidates = candidates[:4 * top_k]
+        for c in candidates:
+            mc = monte_carlo_outcomes(
+                c['entities'], simulationParams, samples=int(robustness.get('samples', 200)),
+                seed=int(robustness.get('seed', 0)), direction_kappa=robustness.get('directionKappa'),
+                position_noise=float(robustness.get('positionNoise', 0.0)),
+                speed_noise=float(robustness.get('speedNoise', 0.0)))
+            c['p_outcome'] = mc[f'p_{outcome}']
+        candidates.sort(key=lambda c: (-(c['p_outcome'] or 0.0), -c['score']))
+    return {
+        'evaluated': total,
+        'valid': valid,
+        'accepted': accepted,
+        'candidates': candidates[:top_k],
+    }
+
+# Distractors share this shape filter group so they never collide with each other
+DISTRACTOR_SHAPE_FILTER = pymunk.ShapeFilter(group=1)
+
+def build_static_world(sim_data, worldWidth, worldHeight, elasticity, friction):
+    """Create a pymunk space holding only the four walls and the barriers from sim_data"""
+    space = pymunk.Space()
+    space.gravity = (0, 0)
+
+    static_body = space.static_body
     walls = [
         pymunk.Segment(static_body, (0, 0), (worldWidth, 0), 0.01),
         pymunk.Segment(static_body, (0, 0), (0, worldHeight), 0.01),
@@ -99,190 +1168,235 @@ def simulate_key_distractor(keyDistractor, sim_data, worldWidth, worldHeight, TI
     for wall in walls:
         wall.elasticity = elasticity
         wall.friction = friction
-        distractor_space.add(wall)
-    
-    # Add barriers from sim_data
+        space.add(wall)
+
     for barrier in sim_data['barriers']:
         body = pymunk.Body(body_type=pymunk.Body.STATIC)
         body.position = (barrier['x'] + barrier['width'] / 2, barrier['y'] + barrier['height'] / 2)
         shape = pymunk.Poly.create_box(body, (barrier['width'], barrier['height']))
         shape.elasticity = elasticity
         shape.friction = friction
-        distractor_space.add(body, shape)
-    
-    # Create distractor ball
+        space.add(body, shape)
+
+    return space
+
+def simulate_distractors(distractors, sim_data, worldWidth, worldHeight, TIMESTEP, FRAME_INTERVAL, FPS, ballSpeed, elasticity, friction):
+    """
+    Simulate many distractors together in one space built once by build_static_world.
+    Each distractor is a dict with startFrame, x, y (bottom-left corner), direction, duration and
+    optional speed. Distractors are only stepped while active and never collide with each other,
+    so each track is the same as simulating it alone. Returns one distractor_data dict per input.
+    """
+    results = [None] * len(distractors)
+    for i, distractor_data in iter_simulate_distractors(distractors, sim_data, worldWidth, worldHeight, TIMESTEP, FRAME_INTERVAL, FPS, ballSpeed, elasticity, friction):
+        results[i] = distractor_data
+    return results
+
+def iter_simulate_distractors(distractors, sim_data, worldWidth, worldHeight, TIMESTEP, FRAME_INTERVAL, FPS, ballSpeed, elasticity, friction):
+    """Same as simulate_distractors, but yields (index, distractor_data) as soon as each track is complete"""
     radius = sim_data['target']['size'] / 2
     mass = 1.0
     moment = pymunk.moment_for_circle(mass, 0, radius)
-    body = pymunk.Body(mass, moment, body_type=pymunk.Body.DYNAMIC)
-    # Convert bottom-left corner to center for pymunk body position
-    body.position = (x + radius, y + radius)
-    # Scale velocity based on distractor speed relative to main ball speed
-    # TIMESTEP is calibrated for ballSpeed, so velocity magnitude should be distractor_speed/ballSpeed
-    velocity_scale = distractor_speed / ballSpeed
-    vx, vy = velocity_scale * np.cos(direction), velocity_scale * np.sin(direction)
-    body.velocity = (vx, vy)
-    shape = pymunk.Circle(body, radius)
-    shape.elasticity = elasticity
-    shape.friction = friction
-    distractor_space.add(body, shape)
-    
-    # Simulate and record positions
-    distractor_data = {
-        'startFrame': startFrame,
-        'duration': duration,
-        'step_data': {}
-    }
-    
-    for frame in range(numDistractorFrames):
-        if frame != 0:
+
+    results = [{'startFrame': d['startFrame'], 'duration': d['duration'], 'step_data': {}} for d in distractors]
+    num_frames = [int(d['duration'] * FPS) for d in distractors]
+
+    # Zero-length tracks are complete right away; the rest are bucketed by the global frame they start at
+    spawns = {}
+    for i, d in enumerate(distractors):
+        if num_frames[i] <= 0:
+            yield i, results[i]
+        else:
+            spawns.setdefault(d['startFrame'], []).append(i)
+    if not spawns:
+        return
+    first_frame = min(spawns)
+    last_frame = max(distractors[i]['startFrame'] + num_frames[i] for bucket in spawns.values() for i in bucket)
+
+    space = build_static_world(sim_data, worldWidth, worldHeight, elasticity, friction)
+    active = []  # (index, body, shape, end_frame)
+
+    for global_frame in range(first_frame, last_frame):
+        check_cancelled()
+        if active:
             for _ in range(FRAME_INTERVAL):
-                distractor_space.step(TIMESTEP)
-        
-        tx, ty = body.position.x - radius, body.position.y - radius
-        global_frame = startFrame + frame
-        
-        # Scale velocity by ballSpeed to reflect actual speed in diameters/second
-        # The physics simulation uses velocities scaled by distractor_speed/ballSpeed,
-        # so multiplying by ballSpeed gives us the actual distractor_speed
-        vx_scaled = body.velocity.x * ballSpeed
-        vy_scaled = body.velocity.y * ballSpeed
-        
-        # No collision stopping for key distractors - they can overlap with the regular ball
-        distractor_data['step_data'][global_frame] = {
-            'x': tx,
-            'y': ty,
-            'vx': vx_scaled,
-            'vy': vy_scaled
-        }
-    
-    return distractor_data
+                space.step(TIMESTEP)
 
-def generate_random_distractors(randomParams, sim_data, worldWidth, worldHeight, TIMESTEP, FRAME_INTERVAL, FPS, ballSpeed, elasticity, friction, space):
-    """Generate and simulate random distractors"""
+        for i in spawns.get(global_frame, []):
+            d = distractors[i]
+            body = pymunk.Body(mass, moment, body_type=pymunk.Body.DYNAMIC)
+            # Convert bottom-left corner to center for pymunk body position
+            body.position = (d['x'] + radius, d['y'] + radius)
+            # Scale velocity based on distractor speed relative to main ball speed
+            # TIMESTEP is calibrated for ballSpeed, so velocity magnitude should be distractor_speed/ballSpeed
+            velocity_scale = d.get('speed', ballSpeed) / ballSpeed
+            body.velocity = (velocity_scale * np.cos(d['direction']), velocity_scale * np.sin(d['direction']))
+            shape = pymunk.Circle(body, radius)
+            shape.elasticity = elasticity
+            shape.friction = friction
+            shape.filter = DISTRACTOR_SHAPE_FILTER
+            space.add(body, shape)
+            active.append((i, body, shape, global_frame + num_frames[i]))
+
+        still_active = []
+        for i, body, shape, end_frame in active:
+            # Scale velocity by ballSpeed to reflect actual speed in diameters/second
+            # The physics simulation uses velocities scaled by distractor_speed/ballSpeed,
+            # so multiplying by ballSpeed gives us the actual distractor_speed
+            # No collision stopping for distractors - they can overlap with the regular ball
+            results[i]['step_data'][global_frame] = {
+                'x': body.position.x - radius,
+                'y': body.position.y - radius,
+                'vx': body.velocity.x * ballSpeed,
+                'vy': body.velocity.y * ballSpeed
+            }
+            if global_frame + 1 >= end_frame:
+                space.remove(body, shape)
+                yield i, results[i]
+            else:
+                still_active.append((i, body, shape, end_frame))
+        active = still_active
+
+def simulate_key_distractor(keyDistractor, sim_data, worldWidth, worldHeight, TIMESTEP, FRAME_INTERVAL, FPS, ballSpeed, elasticity, friction, space):
+    """Simulate a single key distractor"""
+    return simulate_distractors([keyDistractor], sim_data, worldWidth, worldHeight, TIMESTEP, FRAME_INTERVAL, FPS, ballSpeed, elasticity, friction)[0]
+
+def spawn_random_distractors(randomParams, sim_data, worldWidth, worldHeight, FPS, ballSpeed):
+    """
+    Decide where and when random distractors spawn, without simulating them.
+    Returns a list of distractor dicts ready for simulate_distractors.
+
+    Randomness comes from a per-call numpy Generator seeded with randomParams['seed'], so results
+    are reproducible and independent of other requests. Spawn rolls, candidate locations and
+    directions are drawn up front and candidates are tested against barriers, sensors and the
+    target in one vectorized pass; only the maxActive bookkeeping runs frame by frame.
+    """
     probability = randomParams['probability']
     seed = randomParams['seed']
     duration = randomParams['duration']
     maxActive = randomParams.get('maxActive', 5)  # Default to 5 if not specified
     startDelay = randomParams.get('startDelay', 0.333)  # Default to ~10 frames at 30fps (0.333 seconds)
     
-    np.random.seed(seed)
+    rng = np.random.default_rng(seed)
     
     radius = sim_data['target']['size'] / 2
     numFrames = sim_data['num_frames']
     numDistractorFrames = int(duration * FPS)
     
     # Convert start delay from seconds to frames
+    # No random distractors before this time
     startDelayFrames = int(startDelay * FPS)
+    frames = np.arange(startDelayFrames, numFrames)
     
-    random_distractors = []
+    # One spawn roll per frame, only frames that pass it need a location
+    spawn_frames = frames[rng.random(len(frames)) < probability]
+    num_spawns = len(spawn_frames)
+    if num_spawns == 0:
+        return []
     
-    # For each frame, potentially spawn a distractor
-    for frame in range(numFrames):
-        # Skip frames before the start delay - no random distractors before this time
-        if frame < startDelayFrames:
-            continue
-        
-        # Count how many distractors are active at this frame
-        active_count = 0
-        for distractor in random_distractors:
-            start = distractor['startFrame']
-            end = start + len(distractor['step_data'])
-            if start <= frame < end:
-                active_count += 1
+    # Up to max_attempts random candidate positions per spawn, tested all at once
+    max_attempts = 50
+    cand_x = rng.uniform(radius, worldWidth - radius, size=(num_spawns, max_attempts))
+    cand_y = rng.uniform(radius, worldHeight - radius, size=(num_spawns, max_attempts))
+    # Random direction (uniform)
+    directions = rng.uniform(-np.pi, np.pi, size=num_spawns)
+    
+    # Candidates must not intersect barriers or sensors
+    rects = list(sim_data['barriers'])
+    for sensor_key in ('red_sensor', 'green_sensor'):
+        if sensor_key in sim_data:
+            rects.append(sim_data[sensor_key])
+    valid = np.ones((num_spawns, max_attempts), dtype=bool)
+    if rects:
+        rx, ry, rw, rh = np.array([[r['x'], r['y'], r['width'], r['height']] for r in rects]).T
+        overlaps = ((cand_x[..., None] + radius > rx) & (cand_x[..., None] - radius < rx + rw) &
+                    (cand_y[..., None] + radius > ry) & (cand_y[..., None] - radius < ry + rh))
+        valid &= ~overlaps.any(axis=-1)
+    
+    # ... nor the target at the spawn frame (if the target is still present at that frame)
+    step_data = sim_data['step_data']
+    target_xy = np.array([(step_data[f]['x'], step_data[f]['y']) if f in step_data else (np.nan, np.nan)
+                          for f in spawn_frames.tolist()]) + radius
+    dist_sq = (cand_x - target_xy[:, :1])**2 + (cand_y - target_xy[:, 1:])**2
+    valid &= ~(dist_sq < (2 * radius)**2)  # NaN (no target) compares False
+    
+    found = valid.any(axis=1)
+    first_valid = valid.argmax(axis=1)
+    
+    # Every distractor is active for exactly numDistractorFrames frames, so a queue of end frames
+    # is enough to count active distractors
+    active_ends = deque()
+    random_distractors = []
+    for k in np.flatnonzero(found):  # frames with no valid location are skipped
+        frame = int(spawn_frames[k])
+        while active_ends and active_ends[0] <= frame:
+            active_ends.popleft()
         
         # Skip spawning if we've reached the maximum
-        if active_count >= maxActive:
+        if len(active_ends) >= maxActive:
             continue
+        active_ends.append(frame + numDistractorFrames)
         
-        if np.random.random() < probability:
-            # Try to find a valid spawn location
-            max_attempts = 50
-            valid_location = False
-            
-            for _ in range(max_attempts):
-                # Random position
-                spawn_x = np.random.uniform(radius, worldWidth - radius)
-                spawn_y = np.random.uniform(radius, worldHeight - radius)
-                
-                # Check if position is valid (doesn't intersect with barriers, sensors, or target)
-                valid = True
-                
-                # Check barriers
-                for barrier in sim_data['barriers']:
-                    if (spawn_x + radius > barrier['x'] and spawn_x - radius < barrier['x'] + barrier['width'] and
-                        spawn_y + radius > barrier['y'] and spawn_y - radius < barrier['y'] + barrier['height']):
-                        valid = False
-                        break
-                
-                # Check sensors
-                if valid and 'red_sensor' in sim_data:
-                    sensor = sim_data['red_sensor']
-                    if (spawn_x + radius > sensor['x'] and spawn_x - radius < sensor['x'] + sensor['width'] and
-                        spawn_y + radius > sensor['y'] and spawn_y - radius < sensor['y'] + sensor['height']):
-                        valid = False
-                
-                if valid and 'green_sensor' in sim_data:
-                    sensor = sim_data['green_sensor']
-                    if (spawn_x + radius > sensor['x'] and spawn_x - radius < sensor['x'] + sensor['width'] and
-                        spawn_y + radius > sensor['y'] and spawn_y - radius < sensor['y'] + sensor['height']):
-                        valid = False
-                
-                # Check target position at this frame
-                if valid and frame in sim_data['step_data']:
-                    target_data = sim_data['step_data'][frame]
-                    target_x = target_data['x'] + radius
-                    target_y = target_data['y'] + radius
-                    if check_collision_with_ball(spawn_x, spawn_y, radius, target_x, target_y, radius):
-                        valid = False
-                
-                if valid:
-                    valid_location = True
-                    break
-            
-            if not valid_location:
-                continue  # Skip this frame if no valid location found
-            
-            # Random direction (uniform)
-            direction = np.random.uniform(-np.pi, np.pi)
-            
-            # Simulate this random distractor
-            distractor_data = simulate_key_distractor(
-                {
-                    'startFrame': frame,
-                    'x': spawn_x,
-                    'y': spawn_y,
-                    'direction': direction,
-                    'duration': duration,
-                    'speed': ballSpeed  # Random distractors use the same speed as main ball
-                },
-                sim_data,
-                worldWidth,
-                worldHeight,
-                TIMESTEP,
-                FRAME_INTERVAL,
-                FPS,
-                ballSpeed,
-                elasticity,
-                friction,
-                space
-            )
-            
-            random_distractors.append(distractor_data)
-            # print(f"Random distractor spawned at frame {frame}")
+        attempt = first_valid[k]
+        random_distractors.append({
+            'startFrame': frame,
+            'x': float(cand_x[k, attempt]),
+            'y': float(cand_y[k, attempt]),
+            'direction': float(directions[k]),
+            'duration': duration,
+            'speed': ballSpeed  # Random distractors use the same speed as main ball
+        })
     
     return random_distractors
 
+def generate_random_distractors(randomParams, sim_data, worldWidth, worldHeight, TIMESTEP, FRAME_INTERVAL, FPS, ballSpeed, elasticity, friction, space):
+    """Generate and simulate random distractors"""
+    random_distractors = spawn_random_distractors(randomParams, sim_data, worldWidth, worldHeight, FPS, ballSpeed)
+    return simulate_distractors(random_distractors, sim_data, worldWidth, worldHeight, TIMESTEP, FRAME_INTERVAL, FPS, ballSpeed, elasticity, friction)
+
 # Convert entities to Pymunk bodies and run simulation
-def run_simulation_with_visualization(entities, simulationParams, distractorParams=None):
+def run_simulation_with_visualization(entities, simulationParams, distractorParams=None, engine='pymunk', sensor_detection='frame',
+                                      occlusion=False, resume=None):
+    """
+    engine: 'pymunk' steps the physics space physicsStepsPerFrame times per frame,
+            'analytic' computes the target trajectory in closed form with AnalyticBall
+    sensor_detection: 'frame' checks the red/green sensors once per frame, after all substeps.
+            'substep' sweeps the target against the sensors over every physics step (or
+            continuously for the analytic engine), stops the target at the first contact and
+            records the fractional frame of the contact in sim_data['rg_hit_frame_exact'],
+            so touches between frames are neither missed nor delayed and substeps can be lowered.
+    occlusion: add per-frame target occlusion annotations (occlusion_annotations) as sim_data['occlusion']
+    resume: (checkpoint, previous sim_data) from plan_incremental_simulation. Target frames before the
+            checkpoint are copied from the previous result and simulation starts at the checkpoint;
+            the result is the same as simulating from frame 0.
+    The target state is checkpointed into sim_data['checkpoints'] every CHECKPOINT_INTERVAL_FRAMES frames.
+    """
+    for kind, payload in iter_simulation(entities, simulationParams, distractorParams, engine, sensor_detection, occlusion, resume):
+        if kind == 'summary':
+            return payload
+
+def iter_simulation(entities, simulationParams, distractorParams=None, engine='pymunk', sensor_detection='frame', occlusion=False,
+                    resume=None):
+    """
+    Run the simulation incrementally, yielding (kind, payload) events as results become available:
+      ('scene', sim_data)                          once the scene is set up, before any frame
+      ('frame', (frame, step))                     for every target frame
+      ('key_distractor', (index, distractor_data)) as each key distractor track completes
+      ('random_distractor', (index, distractor_data))
+      ('summary', sim_data)                        last, with the complete sim_data
+    Arguments are the same as run_simulation_with_visualization.
+    """
+    if engine not in SIMULATION_ENGINES:
+        raise ValueError(f"Unknown simulation engine '{engine}', expected one of {SIMULATION_ENGINES}")
+    if sensor_detection not in SENSOR_DETECTION_MODES:
+        raise ValueError(f"Unknown sensor detection '{sensor_detection}', expected one of {SENSOR_DETECTION_MODES}")
     videoLength, ballSpeed, fps, physicsStepsPerFrame, res_multiplier, timestep, worldWidth, worldHeight = simulationParams
 
     # Calculate derived values
     numFrames = int(videoLength * fps)
     FRAME_INTERVAL = physicsStepsPerFrame
     TIMESTEP = timestep
-    print(f"TIMESTEP: {TIMESTEP}")
-    print(f"FRAME_INTERVAL: {FRAME_INTERVAL}")
+    logger.debug("Simulation parameters", extra={'timestep': TIMESTEP, 'frame_interval': FRAME_INTERVAL, 'engine': engine})
     FPS = fps
 
     sim_data = {
@@ -308,12 +1422,8 @@ def run_simulation_with_visualization(entities, simulationParams, distractorPara
     sim_data['timesteps_per_frame'] = FRAME_INTERVAL
     sim_data['num_frames'] = numFrames
     sim_data['fps'] = FPS
-    SPACE_SIZE_width = worldWidth * int(1/interval)
-    SPACE_SIZE_height = worldHeight * int(1/interval)
-    pix_x = np.arange(0, worldWidth, interval)
-    pix_y = np.arange(0, worldHeight, interval)
-    y_vals, x_vals = np.meshgrid(pix_x, pix_y, indexing='ij')
-    y_vals = np.flip(y_vals)
+    sim_data['engine'] = engine
+    sim_data['sensor_detection'] = sensor_detection
 
     # Initialize Pymunk space
     space = pymunk.Space()
@@ -389,14 +1499,95 @@ def run_simulation_with_visualization(entities, simulationParams, distractorPara
 
     sim_data['num_barriers'] = len(sim_data['barriers'])
     sim_data['num_occs'] = len(sim_data['occluders'])
+    yield 'scene', sim_data
 
     has_hit_red_green = False
 
+    target_body = target_radius = None
+    for body, shape in body_map.values():
+        if isinstance(shape, pymunk.Circle):
+            target_body, target_radius = body, shape.radius
+
+    # Substep sensor detection sweeps the target against the sensor rectangles; hits are
+    # (sensor color, fractional frame of the first contact)
+    sensors = [(color, (sensor['x'], sensor['y'], sensor['x'] + sensor['width'], sensor['y'] + sensor['height']))
+               for color, sensor in (('red', sim_data.get('red_sensor')), ('green', sim_data.get('green_sensor')))
+               if sensor is not None]
+    track_sensors = sensor_detection == 'substep' and target_body is not None and bool(sensors)
+    sensor_hit = None
+    if track_sensors:
+        sim_data['rg_hit_frame_exact'] = -1
+
+    # The analytic engine tracks the target in closed form; its state is mirrored onto the
+    # (never stepped) pymunk target body so the per-frame recording below is shared by both engines
+    analytic_ball = None
+    if engine == 'analytic' and target_body is not None:
+        analytic_ball = AnalyticBall(target_body.position.x, target_body.position.y, target_body.velocity.x,
+                                     target_body.velocity.y, target_radius, sim_data['barriers'], worldWidth,
+                                     worldHeight, sensors=sensors if track_sensors else ())
+
+    # Resuming: frames before the checkpoint come from the previous result, and the target is
+    # put back into its checkpointed state
+    start_frame = 0
+    sim_data['checkpoints'] = []
+    if resume is not None and target_body is not None:
+        checkpoint, previous = resume
+        start_frame = checkpoint['frame']
+        target_body.position = (checkpoint['x'], checkpoint['y'])
+        target_body.velocity = (checkpoint['vx'], checkpoint['vy'])
+        target_body.angle = checkpoint['angle']
+        target_body.angular_velocity = checkpoint['angular_velocity']
+        if analytic_ball is not None:
+            analytic_ball.x, analytic_ball.y = checkpoint['x'], checkpoint['y']
+            analytic_ball.vx, analytic_ball.vy = checkpoint['vx'], checkpoint['vy']
+            analytic_ball.time, analytic_ball.bounces = checkpoint['time'], checkpoint['bounces']
+        sim_data['checkpoints'] = [c for c in previous['checkpoints'] if c['frame'] < start_frame]
+        for frame in range(start_frame):
+            sim_data['step_data'][frame] = previous['step_data'][frame]
+            yield 'frame', (frame, sim_data['step_data'][frame])
+        METRICS.inc('rg_simulation_frames_reused_total', start_frame, engine=engine)
+
+    # Physics and sensor time are summed over frames (excluding time spent by consumers of the
+    # yielded frames) and recorded once at the end
+    physics_seconds = 0.0
+    sensor_seconds = 0.0
+
     # Simulate for the given number of frames
-    for frame in tqdm(range(numFrames)):
-        if frame != 0:
-            for _ in range(FRAME_INTERVAL):
-                space.step(TIMESTEP)
+    for frame in range(start_frame, numFrames):
+        check_cancelled()
+        if frame != start_frame:
+            start = time.perf_counter()
+            if analytic_ball is not None:
+                analytic_ball.advance(FRAME_INTERVAL * TIMESTEP)
+                target_body.position = (analytic_ball.x, analytic_ball.y)
+                target_body.velocity = (analytic_ball.vx, analytic_ball.vy)
+                if analytic_ball.sensor_hit is not None:
+                    hit_time, color = analytic_ball.sensor_hit
+                    sensor_hit = (color, hit_time / (FRAME_INTERVAL * TIMESTEP))
+            elif track_sensors:
+                # Within a step pymunk moves bodies in a straight line, so sweeping each step is exact.
+                # The sweep cost is counted as physics time.
+                x0, y0 = target_body.position
+                for substep in range(FRAME_INTERVAL):
+                    space.step(TIMESTEP)
+                    x1, y1 = target_body.position
+                    contact = sensor_contact(x0, y0, x1 - x0, y1 - y0, target_radius, sensors)
+                    if contact is not None:
+                        # Stop stepping, with the target at the point of contact
+                        fraction, color = contact
+                        target_body.position = (x0 + fraction * (x1 - x0), y0 + fraction * (y1 - y0))
+                        sensor_hit = (color, frame - 1 + (substep + fraction) / FRAME_INTERVAL)
+                        break
+                    x0, y0 = x1, y1
+            else:
+                for _ in range(FRAME_INTERVAL):
+                    space.step(TIMESTEP)
+            physics_seconds += time.perf_counter() - start
+        elif track_sensors:
+            # Target placed on a sensor
+            contact = sensor_contact(target_body.position.x, target_body.position.y, 0, 0, target_radius, sensors)
+            if contact is not None:
+                sensor_hit = (contact[1], 0.0)
 
         # frame_data = frame_data_template.copy()
         # Draw the entities in the frame
@@ -414,12 +1605,6 @@ def run_simulation_with_visualization(entities, simulationParams, distractorPara
                     vy_scaled = vy * ballSpeed
                     speed = np.sqrt(vx_scaled**2 + vy_scaled**2)
                     direction = np.atan2(vy_scaled, vx_scaled)
-                    # x_vals_discrete = np.arange(0, worldWidth, interval)
-                    # y_vals_discrete = np.arange(0, worldHeight, interval)
-                    
-                    # x = x_vals_discrete[np.argmin(np.abs(x_vals_discrete - body.position.x))]
-                    # y = y_vals_discrete[np.argmin(np.abs(y_vals_discrete - body.position.y))]
-                    target_mask = np.square(x_vals + interval/2 - (tx + r)) + np.square(y_vals + interval/2 - (ty + r)) <= np.square(r)
                     # save to metadata
                     sim_data['step_data'][frame] = { # overspecified
                         'x' : tx,
@@ -429,9 +1614,14 @@ def run_simulation_with_visualization(entities, simulationParams, distractorPara
                         'vx' : vx_scaled,
                         'vy' : vy_scaled
                     }
+                    yield 'frame', (frame, sim_data['step_data'][frame])
 
         # NOTE: NEED TO PROCESS THIS IN RED AND IN GREEN!!!!!
-        if 'red_sensor' in sim_data or 'green_sensor' in sim_data:
+        start = time.perf_counter()
+        if track_sensors:
+            in_red = sensor_hit is not None and sensor_hit[0] == 'red'
+            in_green = sensor_hit is not None and sensor_hit[0] == 'green'
+        elif 'red_sensor' in sim_data or 'green_sensor' in sim_data:
             if 'red_sensor' in sim_data:
                 radius = sim_data['target']['size'] / 2
                 center_x = tx + radius
@@ -469,218 +1659,1758 @@ def run_simulation_with_visualization(entities, simulationParams, distractorPara
                 sim_data['rg_outcome'] = 'green'
                 has_hit_red_green = True
                 sim_data['rg_hit_timestep'] = frame
+        sensor_seconds += time.perf_counter() - start
 
         if has_hit_red_green:
+            if track_sensors:
+                sim_data['rg_hit_frame_exact'] = sensor_hit[1]
             break
+        # Frames with a sensor hit are not checkpointed, resuming from them would miss the hit
+        if target_body is not None and (frame % CHECKPOINT_INTERVAL_FRAMES == 0 or frame == numFrames - 1):
+            checkpoint = _target_checkpoint(frame, target_body, target_radius, analytic_ball, sim_data['barriers'],
+                                            worldWidth, worldHeight, space, TIMESTEP)
+            if checkpoint is not None:
+                sim_data['checkpoints'].append(checkpoint)
 
+    record_stage('physics', physics_seconds)
+    record_stage('sensor_checks', sensor_seconds)
+    METRICS.inc('rg_simulation_frames_total', frame + 1 - start_frame, engine=engine)
     sim_data['num_frames'] = frame+1 # this cannot be frames, because ball may hit red or green before the 
     
     # Process distractors if provided
     if distractorParams:
-        print("Processing distractors...")
-        
-        # Process key distractors
+        # Key distractors are given explicitly
         keyDistractors = distractorParams.get('keyDistractors', [])
-        for i, keyDistractor in enumerate(keyDistractors):
-            print(f"Processing key distractor {i+1}/{len(keyDistractors)}")
-            distractor_data = simulate_key_distractor(
-                keyDistractor, 
-                sim_data, 
-                worldWidth, 
-                worldHeight,
-                TIMESTEP,
-                FRAME_INTERVAL,
-                FPS,
-                ballSpeed,
-                elasticity,
-                friction,
-                space  # Reuse the space for collision detection with barriers
-            )
-            sim_data['key_distractors'].append(distractor_data)
         
-        # Process random distractors
+        # Random distractors only need to be placed here, they are simulated together with the key ones
+        random_distractors = []
         randomParams = distractorParams.get('randomDistractorParams', {})
         if randomParams and randomParams.get('probability', 0) > 0:
-            print("Generating random distractors...")
-            random_distractors = generate_random_distractors(
-                randomParams,
-                sim_data,
-                worldWidth,
-                worldHeight,
-                TIMESTEP,
-                FRAME_INTERVAL,
-                FPS,
-                ballSpeed,
-                elasticity,
-                friction,
-                space
-            )
-            sim_data['random_distractors'] = random_distractors
+            with timed_stage('random_distractor_spawn'):
+                random_distractors = spawn_random_distractors(randomParams, sim_data, worldWidth, worldHeight, FPS, ballSpeed)
+        logger.debug("Simulating distractors", extra={'key_distractors': len(keyDistractors), 'random_distractors': len(random_distractors)})
+        
+        # Simulate every distractor in one shared static world. Key and random distractors are
+        # stepped together, so their physics time is one stage; counters split the work by kind
+        sim_data['key_distractors'] = [None] * len(keyDistractors)
+        sim_data['random_distractors'] = [None] * len(random_distractors)
+        distractor_seconds = 0.0
+        start = time.perf_counter()
+        for i, distractor_data in iter_simulate_distractors(
+            list(keyDistractors) + random_distractors,
+            sim_data,
+            worldWidth,
+            worldHeight,
+            TIMESTEP,
+            FRAME_INTERVAL,
+            FPS,
+            ballSpeed,
+            elasticity,
+            friction
+        ):
+            distractor_seconds += time.perf_counter() - start
+            kind = 'key' if i < len(keyDistractors) else 'random'
+            METRICS.inc('rg_distractors_total', kind=kind)
+            METRICS.inc('rg_distractor_frames_total', len(distractor_data['step_data']), kind=kind)
+            if kind == 'key':
+                sim_data['key_distractors'][i] = distractor_data
+                yield 'key_distractor', (i, distractor_data)
+            else:
+                i -= len(keyDistractors)
+                sim_data['random_distractors'][i] = distractor_data
+                yield 'random_distractor', (i, distractor_data)
+            start = time.perf_counter()
+        distractor_seconds += time.perf_counter() - start
+        record_stage('distractor_physics', distractor_seconds)
+
+    if occlusion:
+        with timed_stage('occlusion'):
+            sim_data['occlusion'] = occlusion_annotations(sim_data)
     
-    return sim_data
+    yield 'summary', sim_data
 
-def get_high_res_obs_array(sim_data):
+def sim_data_to_columns(sim_data, dtype=np.float64):
+    """
+    Split sim_data into a JSON-able header and flat typed arrays.
+    Target frames become step_data/frame (int32) plus one array per TARGET_COLUMNS field. Each
+    distractor group is concatenated into <group>/frame and DISTRACTOR_COLUMNS arrays, with
+    <group>/offsets (n+1) marking where each distractor's frames start and <group>/start_frame.
+    """
+    header = {k: v for k, v in sim_data.items() if k not in ('step_data',) + DISTRACTOR_GROUPS}
+    arrays = {}
 
-    # params
-    interval = 0.02
-    worldWidth = 20
-    worldHeight = 20
-    SPACE_SIZE_width = worldWidth * int(1/interval)
-    SPACE_SIZE_height = worldHeight * int(1/interval)
-    pix_x = np.arange(0, worldWidth, interval)
-    pix_y = np.arange(0, worldHeight, interval)
-    y_vals, x_vals = np.meshgrid(pix_x, pix_y, indexing='ij')
-    y_vals = np.flip(y_vals)
+    frames = list(sim_data['step_data'].keys())
+    arrays['step_data/frame'] = np.array(frames, dtype=np.int32)
+    for col in TARGET_COLUMNS:
+        arrays[f'step_data/{col}'] = np.array([sim_data['step_data'][f][col] for f in frames], dtype=dtype)
 
-    # Initialize the 3D NumPy array for visualization
-    high_res_obs_array = np.zeros((sim_data['num_frames'], SPACE_SIZE_height, SPACE_SIZE_width, 3), dtype=np.uint8)
+    header['distractor_durations'] = {}
+    for group in DISTRACTOR_GROUPS:
+        distractors = sim_data.get(group, [])
+        header['distractor_durations'][group] = [d['duration'] for d in distractors]
+        arrays[f'{group}/start_frame'] = np.array([d['startFrame'] for d in distractors], dtype=np.int32)
+        arrays[f'{group}/offsets'] = np.cumsum([0] + [len(d['step_data']) for d in distractors], dtype=np.int64)
+        steps = [(f, step) for d in distractors for f, step in d['step_data'].items()]
+        arrays[f'{group}/frame'] = np.array([f for f, _ in steps], dtype=np.int32)
+        for col in DISTRACTOR_COLUMNS:
+            arrays[f'{group}/{col}'] = np.array([step[col] for _, step in steps], dtype=dtype)
 
-    frame_data_template = np.ones((SPACE_SIZE_height, SPACE_SIZE_width, 3), dtype=np.uint8) * 255  # Add color channels
-    # add red, green, barriers then occs
+    return header, arrays
 
-    if 'green_sensor' in sim_data:
-        green_sensor = sim_data['green_sensor']
-        x, y, width, height = list(green_sensor.values())
-        mask = np.all(
-            np.array([
-                x_vals >= x,
-                y_vals >= y,
-                x_vals < x + width,
-                y_vals < y + height
-            ]), axis = 0
-        )
-        frame_data_template[mask] = [0, 255, 0]
+def columns_to_sim_data(header, arrays):
+    """Rebuild the nested sim_data dict produced by run_simulation_with_visualization from sim_data_to_columns output"""
+    sim_data = {k: v for k, v in header.items() if k != 'distractor_durations'}
 
-    if 'red_sensor' in sim_data:
-        red_sensor = sim_data['red_sensor']
-        x, y, width, height = list(red_sensor.values())
-        mask = np.all(
-            np.array([
-                x_vals >= x,
-                y_vals >= y,
-                x_vals < x + width,
-                y_vals < y + height
-            ]), axis = 0
-        )
-        frame_data_template[mask] = [255, 0, 0]
+    frames = arrays['step_data/frame'].tolist()
+    columns = [arrays[f'step_data/{col}'].tolist() for col in TARGET_COLUMNS]
+    sim_data['step_data'] = {f: dict(zip(TARGET_COLUMNS, values)) for f, *values in zip(frames, *columns)}
 
-    # get occ_masks
-    occ_masks = []
-    for occluder in sim_data['occluders']:
-        x, y, width, height = list(occluder.values())
-        mask = np.all(
-            np.array([
-                x_vals >= x,
-                y_vals >= y,
-                x_vals < x + width,
-                y_vals < y + height
-            ]), axis = 0
-        )
-        occ_masks.append(mask)
+    for group in DISTRACTOR_GROUPS:
+        offsets = arrays[f'{group}/offsets'].tolist()
+        frames = arrays[f'{group}/frame'].tolist()
+        columns = [arrays[f'{group}/{col}'].tolist() for col in DISTRACTOR_COLUMNS]
+        distractors = []
+        for i, (start_frame, duration) in enumerate(zip(arrays[f'{group}/start_frame'].tolist(), header['distractor_durations'][group])):
+            lo, hi = offsets[i], offsets[i + 1]
+            distractors.append({
+                'startFrame': start_frame,
+                'duration': duration,
+                'step_data': {f: dict(zip(DISTRACTOR_COLUMNS, values))
+                              for f, *values in zip(frames[lo:hi], *(c[lo:hi] for c in columns))},
+            })
+        sim_data[group] = distractors
 
-    for barrier in sim_data['barriers']:
-        x, y, width, height = list(barrier.values())
-        mask = np.all(
-            np.array([
-                x_vals >= x,
-                y_vals >= y,
-                x_vals < x + width,
-                y_vals < y + height
-            ]), axis = 0
-        )
-        frame_data_template[mask] = [0, 0, 0]
+    return sim_data
 
-    # Simulate for the given number of frames
-    for frame in tqdm(range(sim_data['num_frames'])):
+def encode_sim_data_binary(sim_data, dtype=np.float64, extra=None):
+    """
+    Encode sim_data as a compact binary container:
+    SIM_BINARY_MAGIC, a little-endian uint32 header length, a UTF-8 JSON header, then the raw
+    little-endian arrays, each 8-byte aligned. The header holds the non-trajectory sim_data fields,
+    any extra top-level fields, and an "arrays" list of {name, dtype, shape, offset, nbytes}
+    with offsets relative to the start of the array section.
+    """
+    header, arrays = sim_data_to_columns(sim_data, dtype)
+    descriptors = []
+    offset = 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder('<'))
+        arrays[name] = arr
+        descriptors.append({'name': name, 'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset, 'nbytes': arr.nbytes})
+        offset += (arr.nbytes + 7) // 8 * 8
+    container_header = {**(extra or {}), 'sim_data': header, 'arrays': descriptors}
+    header_bytes = json.dumps(container_header, separators=(',', ':')).encode('utf-8')
+    # Pad the header so the array section starts 8-byte aligned
+    header_bytes += b' ' * (-(len(SIM_BINARY_MAGIC) + 4 + len(header_bytes)) % 8)
 
-        frame_data = frame_data_template.copy()
+    parts = [SIM_BINARY_MAGIC, len(header_bytes).to_bytes(4, 'little'), header_bytes]
+    for arr in arrays.values():
+        parts.append(arr.tobytes())
+        parts.append(b'\x00' * (-arr.nbytes % 8))
+    return b''.join(parts)
+
+def decode_sim_data_binary(buf):
+    """Decode an encode_sim_data_binary container, returning (sim_data, container_header)"""
+    buf = memoryview(buf)
+    if bytes(buf[:len(SIM_BINARY_MAGIC)]) != SIM_BINARY_MAGIC:
+        raise ValueError("Not a simulation binary container")
+    start = len(SIM_BINARY_MAGIC)
+    header_len = int.from_bytes(buf[start:start + 4], 'little')
+    container_header = json.loads(bytes(buf[start + 4:start + 4 + header_len]))
+    data_start = start + 4 + header_len
+    arrays = {}
+    for desc in container_header['arrays']:
+        lo = data_start + desc['offset']
+        arrays[desc['name']] = np.frombuffer(buf[lo:lo + desc['nbytes']], dtype=desc['dtype']).reshape(desc['shape'])
+    return columns_to_sim_data(container_header['sim_data'], arrays), container_header
+
+def save_sim_data(sim_data, filename, dtype=np.float64):
+    """Save sim_data as a compressed .npz (by extension) or as an encode_sim_data_binary container"""
+    if filename.endswith('.npz'):
+        header, arrays = sim_data_to_columns(sim_data, dtype)
+        arrays['__header__'] = np.frombuffer(json.dumps(header).encode('utf-8'), dtype=np.uint8)
+        np.savez_compressed(filename, **arrays)
+    else:
+        with open(filename, 'wb') as f:
+            f.write(encode_sim_data_binary(sim_data, dtype))
+
+def load_sim_data(filename):
+    """Load sim_data written by save_sim_data"""
+    if filename.endswith('.npz'):
+        with np.load(filename) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+        header = json.loads(arrays.pop('__header__').tobytes())
+        return columns_to_sim_data(header, arrays)
+    with open(filename, 'rb') as f:
+        return decode_sim_data_binary(f.read())[0]
+
+def _wants_binary_response():
+    """True when the client asked for the binary container via ?format=binary or the Accept header"""
+    if request.args.get('format') == 'binary':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', SIM_BINARY_MIMETYPE]) == SIM_BINARY_MIMETYPE
+
+def _binary_response(sim_data, **extra):
+    dtype = np.float32 if request.args.get('dtype') == 'float32' else np.float64
+    return Response(encode_sim_data_binary(sim_data, dtype, extra={'status': 'success', **extra}), mimetype=SIM_BINARY_MIMETYPE)
+
+class SimulationCache:
+    """
+    Content-addressed cache of simulation results.
+    Entries live in a bounded in-memory LRU and, if disk_dir is set, also as one pickle per key on
+    disk so they survive restarts. Cached sim_data is shared between callers and must not be mutated.
+    """
+    def __init__(self, max_entries=128, disk_dir=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def get(self, key):
+        """Return the cached sim_data for key, or None"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    sim_data = pickle.load(f)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning("Error reading cached simulation", extra={'cache_key': key, 'error': str(e)})
+            else:
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(key, sim_data)
+                return sim_data
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, sim_data):
+        self._remember(key, sim_data)
+        if self.disk_dir:
+            # Write to a temp file first so readers never see a partial entry
+            try:
+                with tempfile.NamedTemporaryFile(dir=self.disk_dir, delete=False, suffix='.tmp') as f:
+                    pickle.dump(sim_data, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(f.name, self._disk_path(key))
+            except Exception as e:
+                logger.warning("Error writing cached simulation", extra={'cache_key': key, 'error': str(e)})
+
+    def _remember(self, key, sim_data):
+        with self._lock:
+            self._entries[key] = sim_data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drop one entry, or every entry when key is None, from both tiers. Returns the number of keys removed."""
+        with self._lock:
+            if key is None:
+                removed = set(self._entries)
+                self._entries.clear()
+            else:
+                removed = {key} if self._entries.pop(key, None) is not None else set()
+        if self.disk_dir:
+            keys = [name[:-len('.pkl')] for name in os.listdir(self.disk_dir) if name.endswith('.pkl')] if key is None else [key]
+            for k in keys:
+                try:
+                    os.unlink(self._disk_path(k))
+                    removed.add(k)
+                except FileNotFoundError:
+                    pass
+        return len(removed)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'disk_dir': self.disk_dir,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+SIM_CACHE = SimulationCache(SIM_CACHE_MAX_ENTRIES, SIM_CACHE_DIR)
+METRICS.callback('rg_simulation_cache_entries', 'gauge', "Simulations held in the in-memory cache",
+                 lambda: SIM_CACHE.stats()['entries'])
+METRICS.callback('rg_simulation_cache_lookups_total', 'counter', "Simulation cache lookups by result",
+                 lambda: {(('result', result),): SIM_CACHE.stats()[result] for result in ('hits', 'disk_hits', 'misses')})
+
+def estimate_sim_data_bytes(sim_data):
+    """Rough in-memory size of a sim_data dict, dominated by the per-frame dicts"""
+    target_frame_bytes = 650  # dict with six float fields
+    distractor_frame_bytes = 500  # dict with four float fields
+    total = 4096 + target_frame_bytes * len(sim_data.get('step_data', {}))
+    for group in DISTRACTOR_GROUPS:
+        for distractor in sim_data.get(group, []):
+            total += 256 + distractor_frame_bytes * len(distractor['step_data'])
+    return total
+
+class SimulationStore:
+    """
+    Thread-safe store of simulation results, keyed by simulation id, remembering the latest result
+    of each client session. Results are stored by reference and may be shared with the simulation
+    cache and other sessions, so stored sim_data must be treated as read-only.
+    Memory is bounded by max_bytes using estimate_sim_data_bytes (a result shared by several entries
+    is counted once), evicting the least recently used entries first.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # simulation_id -> entry
+        self._sessions = {}  # session_id -> simulation_id
+        self._objects = {}  # id(sim_data) -> [bytes, number of entries sharing it]
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, sim_data, session_id=None, scene=None):
+        """Store sim_data (and the scene that produced it) as the session's current result, returning its id"""
+        simulation_id = uuid.uuid4().hex
+        with self._lock:
+            shared = self._objects.get(id(sim_data))
+            if shared is None:
+                shared = self._objects[id(sim_data)] = [estimate_sim_data_bytes(sim_data), 0]
+                self._bytes += shared[0]
+            shared[1] += 1
+            self._entries[simulation_id] = {
+                'simulation_id': simulation_id,
+                'session_id': session_id,
+                'sim_data': sim_data,
+                'scene': scene,
+                'created': time.time(),
+            }
+            if session_id is not None:
+                previous = self._sessions.get(session_id)
+                self._sessions[session_id] = simulation_id
+                if previous is not None:
+                    # Only the latest result of a session is kept
+                    self._remove(previous)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+        return simulation_id
+
+    def get(self, simulation_id):
+        """The stored entry ({simulation_id, session_id, sim_data, scene, created}), or None"""
+        with self._lock:
+            entry = self._entries.get(simulation_id)
+            if entry is not None:
+                self._entries.move_to_end(simulation_id)
+            return entry
+
+    def current(self, session_id):
+        """The latest entry stored for a session, or None"""
+        with self._lock:
+            simulation_id = self._sessions.get(session_id)
+        return self.get(simulation_id) if simulation_id else None
+
+    def clear_session(self, session_id):
+        """Forget a session's current result. Returns True if there was one."""
+        with self._lock:
+            simulation_id = self._sessions.get(session_id)
+            if simulation_id is None:
+                return False
+            self._remove(simulation_id)
+            return True
+
+    def _remove(self, simulation_id):
+        entry = self._entries.pop(simulation_id, None)
+        if entry is None:
+            return
+        if self._sessions.get(entry['session_id']) == simulation_id:
+            del self._sessions[entry['session_id']]
+        shared = self._objects[id(entry['sim_data'])]
+        shared[1] -= 1
+        if shared[1] == 0:
+            del self._objects[id(entry['sim_data'])]
+            self._bytes -= shared[0]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'sessions': len(self._sessions),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+SIM_STORE = SimulationStore(SIM_STORE_MAX_BYTES)
+METRICS.callback('rg_simulation_store_bytes', 'gauge', "Estimated memory held by stored simulation results",
+                 lambda: SIM_STORE.stats()['bytes'])
+
+class SimulationCancelled(Exception):
+    """Raised inside a simulation whose job was cancelled or superseded"""
+
+_current_job = threading.local()
+
+def check_cancelled():
+    """Raise SimulationCancelled if the simulation job running on this thread has been cancelled"""
+    job = getattr(_current_job, 'job', None)
+    if job is not None and job['cancel'].is_set():
+        raise SimulationCancelled(job['reason'])
+
+class SimulationJobs:
+    """
+    Interactive simulations run as jobs on a pool of worker threads, with cooperative cancellation:
+    the simulation loops call check_cancelled() every frame, which raises SimulationCancelled once
+    the job is cancelled. A new job of a session supersedes (cancels) the session's older jobs.
+    """
+    def __init__(self, max_workers):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='simulate')
+        self._jobs = {}  # internal key -> job, while queued or running
+        self._lock = threading.Lock()
+
+    def start(self, session_id=None, supersede=True, job_id=None):
+        """Register a new job (cancelling the session's other jobs if supersede), and return it"""
+        job = {
+            'key': uuid.uuid4().hex,
+            'id': job_id or uuid.uuid4().hex,
+            'session_id': session_id,
+            'cancel': threading.Event(),
+            'reason': None,
+            'stages': {},
+            'created': time.time(),
+        }
+        with self._lock:
+            if supersede and session_id is not None:
+                self._cancel_matching(session_id, None, "Superseded by a newer simulation request")
+            self._jobs[job['key']] = job
+        return job
+
+    def submit(self, fn, session_id=None, supersede=True, job_id=None, inline=False):
+        """
+        Run fn() as a job on the worker pool and return the job; its result comes from job['future'],
+        which raises SimulationCancelled (or CancelledError if it never started) when cancelled. With inline=True the job runs on the calling thread instead
+        (e.g. so a request profiler sees it), but can still be cancelled from elsewhere.
+        """
+        job = self.start(session_id, supersede, job_id)
+        if inline:
+            job['future'] = Future()
+            try:
+                job['future'].set_result(self._run(job, fn))
+            except Exception as e:
+                job['future'].set_exception(e)
+        else:
+            job['future'] = self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job, fn):
+        # Stage timings are collected on the job, for the request to pick up
+        previous_stages = getattr(_request_timings, 'stages', None)
+        _request_timings.stages = job['stages']
+        try:
+            with self.activate(job):
+                return fn()
+        finally:
+            _request_timings.stages = previous_stages
+
+    @contextlib.contextmanager
+    def activate(self, job):
+        """Make job the current job of this thread (checked by check_cancelled) until the block ends"""
+        previous = getattr(_current_job, 'job', None)
+        _current_job.job = job
+        status = 'error'
+        try:
+            check_cancelled()  # cancelled while queued
+            yield job
+            status = 'completed'
+        except (SimulationCancelled, GeneratorExit):
+            # GeneratorExit: a streaming client went away
+            status = 'cancelled'
+            raise
+        finally:
+            _current_job.job = previous
+            with self._lock:
+                self._jobs.pop(job['key'], None)
+            METRICS.inc('rg_simulation_jobs_total', status=status)
+
+    def cancel(self, session_id, job_id=None, reason="Cancelled"):
+        """Cancel a session's jobs (only the one with job_id if given). Returns the number cancelled."""
+        with self._lock:
+            return self._cancel_matching(session_id, job_id, reason)
+
+    def _cancel_matching(self, session_id, job_id, reason):
+        cancelled = []
+        for job in self._jobs.values():
+            if job['session_id'] == session_id and job_id in (None, job['id']) and not job['cancel'].is_set():
+                job['reason'] = reason
+                job['cancel'].set()
+                cancelled.append(job)
+        for job in cancelled:
+            # Jobs still waiting for a worker are dropped right away instead of when a worker picks them up
+            future = job.get('future')
+            if future is not None and future.cancel():
+                del self._jobs[job['key']]
+                METRICS.inc('rg_simulation_jobs_total', status='cancelled')
+        return len(cancelled)
+
+    def running(self):
+        with self._lock:
+            return len(self._jobs)
+
+SIM_JOBS = SimulationJobs(SIM_JOB_WORKERS)
+METRICS.callback('rg_simulation_jobs', 'gauge', "Simulation jobs queued or running", SIM_JOBS.running)
+
+def _session_id():
+    """
+    The caller's session: the X-Session-Id header, else the session cookie.
+    Returns (session_id, is_new); new sessions get an id that should be set as the cookie.
+    """
+    session_id = request.headers.get('X-Session-Id') or request.cookies.get(SESSION_COOKIE)
+    if session_id:
+        return session_id, False
+    return uuid.uuid4().hex, True
+
+def _with_session(response, session_id, is_new):
+    if is_new:
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax')
+    return response
+
+def simulation_cache_key(entities, simulationParams, distractorParams=None, options=None):
+    """
+    Canonical hash of everything that determines a simulation result.
+    Returns None for scenes that are not reproducible (random distractors without a seed).
+    """
+    randomParams = (distractorParams or {}).get('randomDistractorParams') or {}
+    if randomParams.get('probability', 0) > 0 and randomParams.get('seed') is None:
+        return None
+    canonical = json.dumps({
+        'version': SIM_CACHE_VERSION,
+        'entities': entities,
+        'simulationParams': simulationParams,
+        'distractorParams': distractorParams,
+        'options': options or {},
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def _scene_cache_key(scene):
+    """simulation_cache_key for a /simulate-style payload, or None if it cannot be parsed"""
+    try:
+        return simulation_cache_key(*_parse_simulation_request(scene))
+    except Exception:
+        return None
+
+def _parse_simulation_request(data):
+    """Pull (entities, simulationParams, distractorParams) out of a /simulate-style payload"""
+    entities = data.get("entities", [])
+    simulationParams = data.get("simulationParams", [])
+    distractorParams = data.get("distractorParams", None)  # Optional distractor params
+    simulationParams = list(simulationParams.values())
+    options = {'engine': data.get("engine", "pymunk"), 'sensor_detection': data.get("sensorDetection", "frame")}
+    if data.get("occlusion"):
+        # Only present when requested, so cache keys of plain requests are unchanged
+        options['occlusion'] = True
+    return entities, simulationParams, distractorParams, options
+
+def plan_incremental_simulation(base, entities, simulationParams, options=None):
+    """
+    Where a simulation of an edited scene can resume from a stored result.
+    base is a SIM_STORE entry. The edit is found by comparing the entities (by id) that take part in
+    the target's physics; frames are reusable up to the first frame from which the ball could reach
+    a changed barrier or sensor (old or new geometry) within one frame of travel.
+    Returns (checkpoint, base sim_data) to pass as resume= to run_simulation_with_visualization,
+    or None when the scene has to be simulated from the start (e.g. the target or any parameter
+    other than videoLength changed).
+    """
+    scene = base.get('scene') or {}
+    previous = base['sim_data']
+    checkpoints = previous.get('checkpoints')
+    def physics_options(opts):
+        return {k: v for k, v in (opts or {}).items() if k != 'occlusion'}
+    if not checkpoints or not previous['step_data'] or physics_options(scene.get('options')) != physics_options(options):
+        return None
+    # videoLength (the first parameter) only decides how far to simulate
+    old_params, new_params = list(scene.get('simulationParams') or []), list(simulationParams)
+    if old_params[1:] != new_params[1:]:
+        return None
+    videoLength, ballSpeed, fps, physicsStepsPerFrame, res_multiplier, timestep, worldWidth, worldHeight = new_params
+
+    physics_types = ('target', 'barrier', 'red_sensor', 'green_sensor')
+    old = {e['id']: e for e in scene.get('entities', []) if e['type'] in physics_types}
+    new = {e['id']: e for e in entities if e['type'] in physics_types}
+    if [e for e in old.values() if e['type'] == 'target'] != [e for e in new.values() if e['type'] == 'target']:
+        return None
+    changed = [e for entity_id in old.keys() | new.keys() if old.get(entity_id) != new.get(entity_id)
+               for e in (old.get(entity_id), new.get(entity_id)) if e is not None]
+
+    frames = sorted(previous['step_data'])
+    last = min(frames[-1], int(videoLength * fps) - 1)
+    if changed:
+        steps = [previous['step_data'][f] for f in frames]
+        radius = previous['target']['size'] / 2
+        cx = np.array([step['x'] for step in steps]) + radius
+        cy = np.array([step['y'] for step in steps]) + radius
+        # The path from one frame to the next stays within one frame of travel of the first
+        speed = max(step['speed'] for step in steps) / ballSpeed if ballSpeed else 1.0
+        reach = radius + speed * physicsStepsPerFrame * timestep + 0.01
+        near = np.zeros(len(frames), dtype=bool)
+        for e in changed:
+            near |= _circle_rect_overlap_batch(cx, cy, reach, e['x'], e['y'], e['x'] + e['width'], e['y'] + e['height'])
+        if near.any():
+            last = min(last, frames[int(np.argmax(near))])
+    usable = [c for c in checkpoints if c['frame'] <= last]
+    return (usable[-1], previous) if usable else None
+
+# Worker processes for /simulate_batch and /search_stimuli, created on first use and shared by all
+# requests. Workers are started by a forkserver (spawn where unavailable) rather than forked from the
+# threaded server, which could copy locks held by other threads (logging, SIM_CACHE, transcode workers).
+_PROCESS_POOL = None
+_PROCESS_POOL_LOCK = threading.Lock()
+
+def _process_pool():
+    global _PROCESS_POOL
+    with _PROCESS_POOL_LOCK:
+        if _PROCESS_POOL is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _PROCESS_POOL = ProcessPoolExecutor(max_workers=SIM_BATCH_MAX_WORKERS,
+                                                mp_context=multiprocessing.get_context(method))
+        return _PROCESS_POOL
+
+def _discard_process_pool(pool):
+    """Drop a pool that lost a worker (BrokenProcessPool), so later work starts a fresh one"""
+    global _PROCESS_POOL
+    with _PROCESS_POOL_LOCK:
+        if _PROCESS_POOL is pool:
+            _PROCESS_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def iter_process_pool(fn, jobs, max_workers):
+    """
+    Run fn(*job) for each job tuple on the shared process pool, keeping at most max_workers of them
+    submitted at once, and yield (index, future) as each finishes. Closing the generator early
+    cancels the submitted jobs that have not started; the rest are never submitted.
+    """
+    pool = _process_pool()
+    remaining = iter(enumerate(jobs))
+    in_flight = {}
+
+    def submit(i, job):
+        nonlocal pool
+        try:
+            in_flight[pool.submit(fn, *job)] = i
+        except BrokenProcessPool:
+            _discard_process_pool(pool)
+            pool = _process_pool()
+            in_flight[pool.submit(fn, *job)] = i
+
+    try:
+        for i, job in itertools.islice(remaining, max_workers):
+            submit(i, job)
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = in_flight.pop(future)
+                if isinstance(future.exception(), BrokenProcessPool):
+                    _discard_process_pool(pool)
+                    pool = _process_pool()
+                yield i, future
+                for i, job in itertools.islice(remaining, 1):
+                    submit(i, job)
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+def _parse_max_workers(value):
+    """
+    Validate a client-supplied "maxWorkers": None for the default, else a positive integer, capped at
+    SIM_BATCH_MAX_WORKERS so a single request cannot start more processes than the server allows.
+    Raises ValueError for anything else.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError("maxWorkers must be a positive integer")
+    return min(value, SIM_BATCH_MAX_WORKERS)
+
+def _simulate_scene(scene):
+    """
+    Run a single batch scene. Errors are returned in the result instead of raised,
+    so one bad scene does not fail the rest of the batch.
+    """
+    try:
+        entities, simulationParams, distractorParams, options = _parse_simulation_request(scene)
+        sim_data = run_simulation_with_visualization(entities, simulationParams, distractorParams, **options)
+        return {"status": "success", "sim_data": sim_data}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+def iter_simulation_batch(scenes, max_workers=None):
+    """
+    Simulate a list of scenes over a process pool, yielding (index, result) as each scene finishes.
+    Scenes already in SIM_CACHE are yielded first without being simulated.
+
+    scenes: list of {entities, simulationParams, distractorParams, engine} dicts (same shape as a /simulate body)
+    max_workers: number of worker processes, defaults to and capped at SIM_BATCH_MAX_WORKERS
+    Each result is {"status": "success", "sim_data": ...} or {"status": "error", "message": ...}.
+    """
+    # Serve repeated scenes from the cache and only simulate the rest
+    pending = []
+    for i, scene in enumerate(scenes):
+        key = _scene_cache_key(scene)
+        sim_data = SIM_CACHE.get(key) if key else None
+        if sim_data is not None:
+            yield i, {"status": "success", "sim_data": sim_data}
+        else:
+            pending.append((i, scene, key))
+
+    for i, key, result in _iter_simulate_scenes(pending, max_workers):
+        if key and result["status"] == "success":
+            SIM_CACHE.put(key, result["sim_data"])
+        yield i, result
+
+def _iter_simulate_scenes(pending, max_workers):
+    """Run (index, scene, key) items over a process pool, yielding (index, key, result) as they finish"""
+    max_workers = max(1, min(max_workers or SIM_BATCH_MAX_WORKERS, SIM_BATCH_MAX_WORKERS, len(pending) or 1))
+    if max_workers == 1:
+        # Not worth paying for a pool, run inline
+        for i, scene, key in pending:
+            yield i, key, _simulate_scene(scene)
+        return
+
+    for n, future in iter_process_pool(_simulate_scene, [(scene,) for _, scene, _ in pending], max_workers):
+        try:
+            result = future.result()
+        except Exception as e:
+            # e.g. a worker process died
+            result = {"status": "error", "message": str(e)}
+        i, _, key = pending[n]
+        yield i, key, result
+
+def run_simulation_batch(scenes, max_workers=None):
+    """Simulate a list of scenes over a process pool and return the results in input order"""
+    results = [None] * len(scenes)
+    for i, result in iter_simulation_batch(scenes, max_workers):
+        results[i] = result
+    return results
+
+def _replay_simulation(sim_data):
+    """Yield the iter_simulation events for an already finished sim_data (e.g. from the cache)"""
+    yield 'scene', sim_data
+    for frame, step in sim_data['step_data'].items():
+        yield 'frame', (frame, step)
+    for i, distractor_data in enumerate(sim_data.get('key_distractors', [])):
+        yield 'key_distractor', (i, distractor_data)
+    for i, distractor_data in enumerate(sim_data.get('random_distractors', [])):
+        yield 'random_distractor', (i, distractor_data)
+    yield 'summary', sim_data
+
+def iter_simulation_records(entities, simulationParams, distractorParams=None, options=None, chunk_size=SIM_STREAM_CHUNK_FRAMES, session_id=None):
+    """
+    Turn a simulation into JSON-able stream records:
+      {"type": "scene", "sim_data": {...}}          static scene description (no trajectories)
+      {"type": "frames", "step_data": {...}}         up to chunk_size target frames
+      {"type": "key_distractor", "index": i, ...}    one per distractor track, as it completes
+      {"type": "random_distractor", "index": i, ...}
+      {"type": "summary", "rg_outcome", "rg_hit_timestep", "num_frames", ["occlusion"], "cache_key", "simulation_id"}
+    Cached scenes are replayed instead of simulated, finished scenes are added to the cache and
+    stored in SIM_STORE as the session's current result.
+    """
+    options = options or {}
+    cache_key = simulation_cache_key(entities, simulationParams, distractorParams, options)
+    cached = SIM_CACHE.get(cache_key) if cache_key else None
+    if cached is not None:
+        events = _replay_simulation(cached)
+    else:
+        events = iter_simulation(entities, simulationParams, distractorParams, **options)
+
+    chunk = {}
+    for kind, payload in events:
+        if kind == 'frame':
+            frame, step = payload
+            chunk[frame] = step
+            if len(chunk) >= chunk_size:
+                yield {"type": "frames", "step_data": chunk}
+                chunk = {}
+            continue
+        if chunk:
+            yield {"type": "frames", "step_data": chunk}
+            chunk = {}
+
+        if kind == 'scene':
+            yield {"type": "scene", "sim_data": {k: v for k, v in payload.items() if k not in ('step_data',) + DISTRACTOR_GROUPS}}
+        elif kind in ('key_distractor', 'random_distractor'):
+            i, distractor_data = payload
+            yield {"type": kind, "index": i, **distractor_data}
+        elif kind == 'summary':
+            if cached is None and cache_key:
+                SIM_CACHE.put(cache_key, payload)
+            scene = {'entities': entities, 'simulationParams': simulationParams, 'distractorParams': distractorParams, 'options': options}
+            simulation_id = SIM_STORE.put(payload, session_id, scene)
+            yield {
+                "type": "summary",
+                "rg_outcome": payload['rg_outcome'],
+                "rg_hit_timestep": payload['rg_hit_timestep'],
+                "num_frames": payload['num_frames'],
+                **({"occlusion": payload['occlusion']} if 'occlusion' in payload else {}),
+                "cache_key": cache_key,
+                "simulation_id": simulation_id,
+            }
+
+def _obs_pixel_grid(worldWidth, worldHeight, interval):
+    """Pixel left edges (per column) and bottom edges (per row, top row first) of the observation grid"""
+    width_px = int(round(worldWidth / interval))
+    height_px = int(round(worldHeight / interval))
+    xs = np.arange(width_px) * interval
+    ys = (height_px - 1 - np.arange(height_px)) * interval
+    return xs, ys
+
+def _obs_rect_index(xs, ys, rect):
+    """Index selecting the pixels whose lower-left corner lies inside rect"""
+    cols = (xs >= rect['x']) & (xs < rect['x'] + rect['width'])
+    rows = (ys >= rect['y']) & (ys < rect['y'] + rect['height'])
+    return np.ix_(rows, cols)
+
+def obs_static_layers(sim_data, interval=0.02, worldWidth=None, worldHeight=None):
+    """
+    Render the parts of an observation that do not change between frames, once per scene.
+    Returns (background, occluded): background is the H x W x 3 uint8 image with sensors, barriers
+    and occluders drawn, occluded is the H x W bool mask of occluder pixels (drawn over the target).
+    """
+    if worldWidth is None or worldHeight is None:
+        worldWidth, worldHeight = sim_data.get('scene_dims', (20, 20))
+    xs, ys = _obs_pixel_grid(worldWidth, worldHeight, interval)
+    background = np.full((len(ys), len(xs), 3), 255, dtype=np.uint8)
+    # add red, green, barriers then occs
+    if 'green_sensor' in sim_data:
+        background[_obs_rect_index(xs, ys, sim_data['green_sensor'])] = [0, 255, 0]
+    if 'red_sensor' in sim_data:
+        background[_obs_rect_index(xs, ys, sim_data['red_sensor'])] = [255, 0, 0]
+    for barrier in sim_data['barriers']:
+        background[_obs_rect_index(xs, ys, barrier)] = [0, 0, 0]
+    occluded = np.zeros((len(ys), len(xs)), dtype=bool)
+    for occluder in sim_data['occluders']:
+        occluded[_obs_rect_index(xs, ys, occluder)] = True
+    background[occluded] = [128, 128, 128]
+    return background, occluded
+
+def iter_obs_frames(sim_data, interval=0.02, worldWidth=None, worldHeight=None):
+    """
+    Yield observation frames (H x W x 3 uint8) one at a time, in constant memory.
+    interval is the pixel size in world units and the world size defaults to sim_data['scene_dims'].
+    The static layers are rendered once and only the bounding box around the target is
+    redrawn per frame, so the yielded array is reused: copy it if you need to keep it.
+    """
+    if worldWidth is None or worldHeight is None:
+        worldWidth, worldHeight = sim_data.get('scene_dims', (20, 20))
+    xs, ys = _obs_pixel_grid(worldWidth, worldHeight, interval)
+    background, occluded = obs_static_layers(sim_data, interval, worldWidth, worldHeight)
+    frame_data = background.copy()
+    height_px, width_px = occluded.shape
+    r = sim_data['target']['size'] / 2 if 'target' in sim_data else 0
+    dirty = None  # bounding box drawn into on the previous frame
+
+    for frame in range(sim_data['num_frames']):
+        if dirty is not None:
+            frame_data[dirty] = background[dirty]
+            dirty = None
         if frame in sim_data['step_data']:
             target_data = sim_data['step_data'][frame]
-            x, y  = target_data['x'], target_data['y']
-            r = sim_data['target']['size']/2
-            target_mask = np.square(x_vals + interval/2 - (x + r)) + np.square(y_vals + interval/2 - (y + r)) <= np.square(r)
-            frame_data[target_mask] = [0, 0, 255]
-
-        for occ_mask in occ_masks:
-            frame_data[occ_mask] = [128, 128, 128]
-        # Store the frame in the visualization data
-        high_res_obs_array[frame] = frame_data
+            cx, cy = target_data['x'] + r, target_data['y'] + r
+            # Pixel bounding box around the target, padded by one pixel for rounding
+            c0 = max(0, int(np.floor((cx - r) / interval)) - 1)
+            c1 = min(width_px, int(np.ceil((cx + r) / interval)) + 1)
+            r0 = max(0, int(np.floor(height_px - 1 - (cy + r) / interval)) - 1)
+            r1 = min(height_px, int(np.ceil(height_px - 1 - (cy - r) / interval)) + 2)
+            if c0 < c1 and r0 < r1:
+                dirty = np.s_[r0:r1, c0:c1]
+                target_mask = (np.square(xs[c0:c1] + interval/2 - cx)[None, :] +
+                               np.square(ys[r0:r1] + interval/2 - cy)[:, None] <= np.square(r))
+                frame_data[dirty][target_mask & ~occluded[dirty]] = [0, 0, 255]
+        yield frame_data
 
+def render_obs_to_memmap(sim_data, filename, interval=0.02, worldWidth=None, worldHeight=None):
+    """
+    Render all observation frames into a .npy file opened as a memory map, so long clips never
+    need to fit in RAM. Returns the (num_frames x H x W x 3) uint8 memmap.
+    """
+    if worldWidth is None or worldHeight is None:
+        worldWidth, worldHeight = sim_data.get('scene_dims', (20, 20))
+    xs, ys = _obs_pixel_grid(worldWidth, worldHeight, interval)
+    obs = np.lib.format.open_memmap(filename, mode='w+', dtype=np.uint8,
+                                    shape=(sim_data['num_frames'], len(ys), len(xs), 3))
+    for frame, frame_data in enumerate(iter_obs_frames(sim_data, interval, worldWidth, worldHeight)):
+        obs[frame] = frame_data
+    obs.flush()
+    return obs
+
+def get_high_res_obs_array(sim_data, interval=0.02, worldWidth=None, worldHeight=None):
+    """
+    Render every observation frame into one (num_frames x H x W x 3) uint8 array.
+    For long clips prefer iter_obs_frames or render_obs_to_memmap, which do not hold all frames in memory.
+    """
+    if worldWidth is None or worldHeight is None:
+        worldWidth, worldHeight = sim_data.get('scene_dims', (20, 20))
+    xs, ys = _obs_pixel_grid(worldWidth, worldHeight, interval)
+    high_res_obs_array = np.empty((sim_data['num_frames'], len(ys), len(xs), 3), dtype=np.uint8)
+    for frame, frame_data in enumerate(iter_obs_frames(sim_data, interval, worldWidth, worldHeight)):
+        high_res_obs_array[frame] = frame_data
     return high_res_obs_array
 
+def check_mp4_options(fps, codec, crf, preset, interval):
+    """Raise ValueError unless the encode_obs_mp4 settings are safe to hand to ffmpeg"""
+    if codec not in MP4_CODECS:
+        raise ValueError(f"codec must be one of {', '.join(MP4_CODECS)}")
+    if preset not in MP4_PRESETS:
+        raise ValueError(f"preset must be one of {', '.join(MP4_PRESETS)}")
+    low, high = MP4_CRF_RANGE
+    if isinstance(crf, bool) or not isinstance(crf, int) or not low <= crf <= high:
+        raise ValueError(f"crf must be an integer between {low} and {high}")
+    for name, value in (('fps', fps), ('interval', interval)):
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or not value > 0):
+            raise ValueError(f"{name} must be a positive number")
+
+def encode_obs_mp4(sim_data, filename, fps=None, codec='libx264', crf=23, preset='ultrafast', interval=0.02, worldWidth=None, worldHeight=None):
+    """
+    Encode the observation frames of sim_data into an MP4 without matplotlib.
+    Frames from iter_obs_frames are piped as raw RGB24 straight into an ffmpeg subprocess.
+    fps defaults to the simulation fps; codec, crf and preset are passed to ffmpeg after
+    check_mp4_options has validated them.
+    """
+    check_mp4_options(fps, codec, crf, preset, interval)
+    fps = fps or sim_data['fps']
+    if worldWidth is None or worldHeight is None:
+        worldWidth, worldHeight = sim_data.get('scene_dims', (20, 20))
+    xs, ys = _obs_pixel_grid(worldWidth, worldHeight, interval)
+    ffmpeg_cmd = [
+        FFMPEG_BINARY,
+        '-f', 'rawvideo',  # Raw frames on stdin
+        '-pix_fmt', 'rgb24',
+        '-s', f'{len(xs)}x{len(ys)}',
+        '-r', str(fps),
+        '-i', '-',
+        '-c:v', codec,
+        '-preset', preset,
+        '-crf', str(crf),
+        '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',  # yuv420p needs even dimensions
+        '-pix_fmt', 'yuv420p',  # Pixel format for compatibility
+        '-movflags', '+faststart',  # Optimize for web streaming
+        '-loglevel', 'error',
+        '-y',  # Overwrite output file
+        filename
+    ]
+    # stderr goes to a file so ffmpeg can never block on a full pipe while we are writing frames
+    with tempfile.TemporaryFile() as stderr_file, timed_stage('mp4_encode'):
+        try:
+            proc = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE, stderr=stderr_file)
+        except FileNotFoundError:
+            raise RuntimeError("FFmpeg is not installed or not available in PATH. Please install FFmpeg to use MP4 encoding.")
+        try:
+            for frame_data in iter_obs_frames(sim_data, interval, worldWidth, worldHeight):
+                proc.stdin.write(frame_data.data)
+        except BrokenPipeError:
+            pass  # ffmpeg exited early, its error is reported below
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            proc.wait()
+        if proc.returncode != 0:
+            stderr_file.seek(0)
+            raise RuntimeError(f"FFmpeg encoding failed: {stderr_file.read().decode(errors='replace')[:200]}")
+    return filename
+
+try:
+    import brotli  # Optional, enables on-the-fly brotli when no .br file was built
+except ImportError:
+    brotli = None
+
+class StaticFileIndex:
+    """
+    Index of the static trees (build/, then assets/), built once instead of touching the
+    filesystem on every request. Precompressed siblings (file.br, file.gz) are served when the
+    client accepts them; other compressible files are compressed on first request and kept in memory.
+    """
+    def __init__(self, roots, exclude=()):
+        self.roots = roots
+        self.exclude = set(exclude)
+        self.files = {}
+        self.refresh()
+
+    def refresh(self):
+        files = {}
+        # Later roots lose to earlier ones, so walk them in reverse
+        for root in reversed(self.roots):
+            if not os.path.isdir(root):
+                continue
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames if os.path.relpath(os.path.join(dirpath, d), root) not in self.exclude]
+                for filename in filenames:
+                    if filename.endswith(('.br', '.gz')):
+                        continue
+                    full_path = os.path.join(dirpath, filename)
+                    url_path = os.path.relpath(full_path, root).replace(os.sep, '/')
+                    stat = os.stat(full_path)
+                    files[url_path] = {
+                        'path': full_path,
+                        'mtime': stat.st_mtime,
+                        'etag': f"{int(stat.st_mtime)}-{stat.st_size}",
+                        'mimetype': mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                        'compressible': os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS and stat.st_size > 1024,
+                        'variants': {encoding: full_path + suffix for encoding, suffix in (('br', '.br'), ('gzip', '.gz'))
+                                     if os.path.exists(full_path + suffix)},
+                        'compressed': {},
+                    }
+        self.files = files
+        logger.info("Indexed static files", extra={'files': len(files)})
+
+    def lookup(self, url_path):
+        return self.files.get(url_path)
+
+    def _encoded_body(self, entry, encoding):
+        """File path or bytes of the entry in the given content encoding, or None if unavailable"""
+        if encoding in entry['variants']:
+            return entry['variants'][encoding]
+        if not entry['compressible'] or (encoding == 'br' and brotli is None):
+            return None
+        if encoding not in entry['compressed']:
+            with open(entry['path'], 'rb') as f:
+                raw = f.read()
+            entry['compressed'][encoding] = brotli.compress(raw) if encoding == 'br' else gzip.compress(raw, 9)
+        return entry['compressed'][encoding]
+
+    def response(self, url_path, entry, cache_control=None):
+        """Build a conditional (ETag/304) response for an indexed file, picking the best accepted encoding"""
+        body, encoding = entry['path'], None
+        for candidate in ('br', 'gzip'):
+            if request.accept_encodings[candidate]:
+                encoded = self._encoded_body(entry, candidate)
+                if encoded is not None:
+                    body, encoding = encoded, candidate
+                    break
+        etag = entry['etag'] + (f"-{encoding}" if encoding else "")
+        if isinstance(body, bytes):
+            body = io.BytesIO(body)
+        response = send_file(body, mimetype=entry['mimetype'], etag=etag, last_modified=entry['mtime'],
+                             conditional=True, max_age=STATIC_MAX_AGE)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if entry['compressible'] or entry['variants']:
+            response.vary.add('Accept-Encoding')
+        if cache_control:
+            response.headers['Cache-Control'] = cache_control
+        elif url_path.startswith('static/'):
+            # Create React App puts a content hash in every build/static filename
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+# Note: site_static_assets are served through the asset cache (/site_static_assets/...), not from disk here
+STATIC_INDEX = StaticFileIndex([build_path, assets_path], exclude=['site_static_assets'])
+
+def _serve_index_html():
+    entry = STATIC_INDEX.lookup('index.html')
+    if entry is None:
+        logger.error("Error serving index.html: not found in build")
+        return "React app not found", 500
+    # Always revalidate so new deploys are picked up
+    return STATIC_INDEX.response('index.html', entry, cache_control='no-cache')
+
 @app.route("/")
 def index():
     """
     Serve the React index.html file.
     """
-    try:
-        return send_from_directory(build_path, "index.html")
-    except Exception as e:
-        print(f"Error serving index.html: {e}")
-        return "React app not found", 500
+    return _serve_index_html()
 
 @app.route("/<path:path>")
 def serve_static_files(path):
     """
     Serve static files such as JS, CSS, and assets.
-    First checks build folder, then assets folder, then falls back to index.html for React Router.
+    Looks the path up in the build and assets index. Missing files under static/ or with a known
+    asset extension get a 404; any other path is a React Router route (dots included) and gets index.html.
     """
-    # First check build folder
-    build_file_path = os.path.join(build_path, path)
-    if os.path.exists(build_file_path):
-        return send_from_directory(build_path, path)
-    
-    # Note: site_static_assets are now served from AWS S3, not locally
-    # Only serve root assets folder (for favicon, robots.txt, etc.)
-    assets_file_path = os.path.join(assets_path, path)
-    if os.path.exists(assets_file_path):
-        return send_from_directory(assets_path, path)
-    
-    # Fall back to index.html for React Router paths
-    try:
-        return send_from_directory(build_path, "index.html")
-    except Exception as e:
-        print(f"Error serving static file {path}: {e}")
+    entry = STATIC_INDEX.lookup(path)
+    if entry is not None:
+        return STATIC_INDEX.response(path, entry)
+
+    if path.startswith('static/') or os.path.splitext(path)[1].lower() in STATIC_ASSET_EXTENSIONS:
         return "File not found", 404
+    # Fall back to index.html for React Router paths
+    return _serve_index_html()
 
 @app.route("/simulate", methods=["POST"])
+@profiled
 def simulate():
-    print("simulate activated")
+    """
+    Simulate a scene. With ?timings=1 the response includes a per-stage timing breakdown
+    ("timings" in seconds, and a Server-Timing header that also covers serialization).
+    With "baseSimulationId" (the simulation_id of an earlier result of this scene before an edit),
+    frames the edit cannot affect are reused and simulation resumes from the nearest checkpoint;
+    "incremental" in the response reports the frame it resumed from.
+    The simulation runs as a SIM_JOBS job: a newer request of the same session cancels it (unless
+    the newer one sends "supersede": false), as does /cancel_simulation; cancelled requests get a
+    409 with status "cancelled". "jobId" optionally names the job for /cancel_simulation.
+    """
     try:
-        print("Running physics")
-        data = request.json
-        entities = data.get("entities", [])
-        simulationParams = data.get("simulationParams", [])
-        distractorParams = data.get("distractorParams", None)  # Optional distractor params
-        simulationParams = list(simulationParams.values())
+        with timed_stage('request_parse'):
+            data = request.json
+            entities, simulationParams, distractorParams, options = _parse_simulation_request(data)
+        logger.info("Simulation requested", extra={'entities': len(entities), 'engine': options['engine']})
+        session_id, new_session = _session_id()
+        supersede = bool(data.get("supersede", True))
         
-        # Run the Pymunk simulation
-        sim_data = run_simulation_with_visualization(entities, simulationParams, distractorParams)
+        # Repeated scenes are served from the cache
+        cache_key = simulation_cache_key(entities, simulationParams, distractorParams, options)
+        sim_data = SIM_CACHE.get(cache_key) if cache_key else None
+        cache_result = 'hit' if sim_data is not None else 'miss'
+        incremental = {}
+        if sim_data is not None and supersede:
+            SIM_JOBS.cancel(session_id, reason="Superseded by a newer simulation request")
+        if sim_data is None:
+            # An edit of a previous result resumes from the last checkpoint the edit cannot affect
+            resume = None
+            base_id = data.get("baseSimulationId")
+            if base_id:
+                base = SIM_STORE.get(base_id)
+                resume = plan_incremental_simulation(base, entities, simulationParams, options) if base else None
+                incremental = {"incremental": {"base_simulation_id": base_id, "base_found": base is not None,
+                                               "resumed_from_frame": resume[0]['frame'] if resume else None}}
+            # Run the simulation (pymunk stepping unless "engine": "analytic" was requested) off the
+            # request thread; profiled requests run it inline so the profile includes it
+            job = SIM_JOBS.submit(
+                functools.partial(run_simulation_with_visualization, entities, simulationParams, distractorParams,
+                                  resume=resume, **options),
+                session_id, supersede, data.get("jobId"), inline=_profiling_requested())
+            try:
+                sim_data = job['future'].result()
+            except (SimulationCancelled, CancelledError):
+                logger.info("Simulation cancelled", extra={'job_id': job['id'], 'reason': job['reason']})
+                response = jsonify({"status": "cancelled", "message": job['reason'], "job_id": job['id']})
+                return _with_session(response, session_id, new_session), 409
+            finally:
+                for stage, seconds in job['stages'].items():
+                    _request_timings.stages[stage] = _request_timings.stages.get(stage, 0.0) + seconds
+            if cache_key:
+                SIM_CACHE.put(cache_key, sim_data)
+        METRICS.inc('rg_simulations_total', engine=options['engine'], cache=cache_result)
         
-        global GLOBAL_SIM_DATA
-        GLOBAL_SIM_DATA = copy.deepcopy(sim_data)
+        # Keep the result for this client without copying it
+        scene = {'entities': entities, 'simulationParams': simulationParams, 'distractorParams': distractorParams, 'options': options}
+        simulation_id = SIM_STORE.put(sim_data, session_id, scene)
 
-        print("physics done")
+        # Serialization is timed too, so it only shows up in the Server-Timing header
+        timings = dict(_request_timings.stages) if request.args.get('timings') else None
+        extra = {"timings": timings} if timings is not None else {}
+        extra.update(incremental)
+        with timed_stage('serialization'):
+            if _wants_binary_response():
+                response = _binary_response(sim_data, cache_key=cache_key, simulation_id=simulation_id, **extra)
+            else:
+                response = jsonify({"status": "success", "sim_data": sim_data, "cache_key": cache_key, "simulation_id": simulation_id, **extra})
+        if timings is not None:
+            response.headers['Server-Timing'] = _server_timing_header(_request_timings.stages)
+        logger.info("Simulation done", extra={'cache': cache_result, 'frames': sim_data['num_frames'], 'simulation_id': simulation_id})
+        return _with_session(response, session_id, new_session)
+    except Exception as e:
+        logger.exception("Error during simulation", extra={'error': str(e)})
+        return jsonify({"status": "error", "message": str(e)}), 500
 
-        return jsonify({"status": "success", "sim_data": sim_data})
+@app.route("/simulate_stream", methods=["POST"])
+def simulate_stream():
+    """
+    Streaming variant of /simulate. Takes the same JSON body (plus an optional "chunkSize" in frames)
+    and emits the records from iter_simulation_records as they are computed: NDJSON by default,
+    or Server-Sent Events with ?format=sse or Accept: text/event-stream.
+    Errors after streaming has started are sent as a final {"type": "error", "message": ...} record.
+    Like /simulate, a newer request of the session cancels the stream (unless "supersede": false),
+    which then ends with a {"type": "cancelled", "message": ...} record.
+    """
+    logger.info("Streamed simulation requested")
+    try:
+        data = request.json
+        entities, simulationParams, distractorParams, options = _parse_simulation_request(data)
+        chunk_size = max(1, int(data.get("chunkSize", SIM_STREAM_CHUNK_FRAMES)))
     except Exception as e:
-        print("Error during simulation:", e)
-        import traceback
-        traceback.print_exc()
+        logger.error("Error parsing simulation request", extra={'error': str(e)})
         return jsonify({"status": "error", "message": str(e)}), 500
 
+    session_id, new_session = _session_id()
+    sse = (request.args.get('format') == 'sse' or
+           request.accept_mimetypes.best_match(['application/x-ndjson', 'text/event-stream']) == 'text/event-stream')
+
+    def generate():
+        try:
+            job = SIM_JOBS.start(session_id, bool(data.get("supersede", True)), data.get("jobId"))
+            with SIM_JOBS.activate(job):
+                records = iter_simulation_records(entities, simulationParams, distractorParams, options, chunk_size, session_id)
+                for record in records:
+                    line = app.json.dumps(record)
+                    yield f"event: {record['type']}\ndata: {line}\n\n" if sse else line + "\n"
+        except SimulationCancelled as e:
+            logger.info("Streamed simulation cancelled", extra={'job_id': job['id'], 'reason': str(e)})
+            line = app.json.dumps({"type": "cancelled", "message": str(e)})
+            yield f"event: cancelled\ndata: {line}\n\n" if sse else line + "\n"
+        except Exception as e:
+            logger.exception("Error during streamed simulation", extra={'error': str(e)})
+            line = app.json.dumps({"type": "error", "message": str(e)})
+            yield f"event: error\ndata: {line}\n\n" if sse else line + "\n"
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream" if sse else "application/x-ndjson")
+    return _with_session(response, session_id, new_session)
+
+@app.route("/simulate_batch", methods=["POST"])
+@profiled
+def simulate_batch():
+    """
+    Simulate many scenes at once over a worker pool.
+
+    Expects JSON: {"scenes": [{entities, simulationParams, distractorParams}, ...],
+                   "maxWorkers": optional int (capped at SIM_BATCH_MAX_WORKERS), "stream": optional bool}
+    Returns all results in input order, or with "stream": true, one NDJSON line
+    {"index": i, "status": ..., ...} per scene as soon as it finishes.
+    Per-scene failures are reported as {"status": "error", "message": ...} entries.
+    """
+    try:
+        data = request.json
+        scenes = data.get("scenes", [])
+        if not isinstance(scenes, list):
+            return jsonify({"status": "error", "message": "scenes must be a list"}), 400
+        try:
+            max_workers = _parse_max_workers(data.get("maxWorkers"))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        logger.info("Batch simulation requested", extra={'scenes': len(scenes)})
+
+        if data.get("stream", False):
+            def generate():
+                for i, result in iter_simulation_batch(scenes, max_workers):
+                    yield app.json.dumps({"index": i, **result}) + "\n"
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+        results = run_simulation_batch(scenes, max_workers)
+        return jsonify({"status": "success", "results": results})
+    except Exception as e:
+        logger.exception("Error during batch simulation", extra={'error': str(e)})
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/simulate_monte_carlo', methods=['POST'])
+@profiled
+def simulate_monte_carlo():
+    """
+    Outcome probabilities and hit-time distribution of a scene under noise on the target's
+    initial direction (von Mises), position and speed.
+
+    Expects the /simulate JSON body plus
+    "monteCarlo": {"samples": int (default 1000), "seed": int (default 0),
+                   "directionKappa": float or null, "positionNoise": float, "speedNoise": float,
+                   "bins": int (default 30), "returnSamples": bool}
+    Distractors are ignored, they do not affect the target.
+    """
+    try:
+        data = request.json
+        entities, simulationParams, _, _ = _parse_simulation_request(data)
+        mc = data.get("monteCarlo", {})
+        samples = int(mc.get("samples", 1000))
+        if not 0 < samples <= MONTE_CARLO_MAX_SAMPLES:
+            return jsonify({"status": "error", "message": f"samples must be between 1 and {MONTE_CARLO_MAX_SAMPLES}"}), 400
+        kappa = mc.get("directionKappa")
+        with timed_stage('monte_carlo'):
+            result = monte_carlo_outcomes(
+                entities, simulationParams, samples=samples, seed=int(mc.get("seed", 0)),
+                direction_kappa=None if kappa is None else float(kappa),
+                position_noise=float(mc.get("positionNoise", 0.0)), speed_noise=float(mc.get("speedNoise", 0.0)),
+                bins=int(mc.get("bins", 30)), return_samples=bool(mc.get("returnSamples", False)))
+        logger.info("Monte Carlo simulation done", extra={'samples': samples, 'p_red': result['p_red'], 'p_green': result['p_green']})
+        return jsonify({"status": "success", "result": result})
+    except Exception as e:
+        logger.exception("Error during Monte Carlo simulation", extra={'error': str(e)})
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/search_stimuli', methods=['POST'])
+@profiled
+def search_stimuli_route():
+    """
+    Search for scenes with a given outcome profile around a base scene.
+    Expects the /simulate JSON body (the base scene) plus "search", "constraints" and optional
+    "maxWorkers" (capped at SIM_BATCH_MAX_WORKERS); see search_stimuli for their fields.
+    Returns the top-K accepted scenes, each with its entities and outcome metrics.
+    """
+    try:
+        data = request.json
+        entities, simulationParams, _, _ = _parse_simulation_request(data)
+        with timed_stage('stimulus_search'):
+            result = search_stimuli(entities, simulationParams, data.get("search", {}), data.get("constraints", {}),
+                                    _parse_max_workers(data.get("maxWorkers")))
+        logger.info("Stimulus search done", extra={k: result[k] for k in ('evaluated', 'valid', 'accepted')})
+        return jsonify({"status": "success", **result})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error during stimulus search", extra={'error': str(e)})
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/simulation_cache', methods=['GET'])
+def simulation_cache_stats():
+    """Report simulation cache size and hit/miss counters"""
+    return jsonify({"status": "success", "cache": SIM_CACHE.stats()})
+
+@app.route('/simulation_cache/invalidate', methods=['POST'])
+def invalidate_simulation_cache():
+    """
+    Drop cached simulation results.
+    Expects optional JSON {"key": cache_key}; without a key the whole cache is cleared.
+    """
+    data = request.get_json(silent=True) or {}
+    removed = SIM_CACHE.invalidate(data.get("key"))
+    logger.info("Invalidated cached simulations", extra={'removed': removed})
+    return jsonify({"status": "success", "removed": removed})
+
+@app.route('/render_mp4', methods=['POST'])
+@profiled
+def render_mp4():
+    """
+    Render a scene to MP4 on the server.
+    Expects the /simulate JSON body (or {"cacheKey": key} for an already simulated scene), plus optional
+    "fps", "codec" (MP4_CODECS), "crf" (integer in MP4_CRF_RANGE), "preset" (MP4_PRESETS) and
+    "interval" (pixel size in world units); invalid values get a 400.
+    Returns the MP4 as a download, or with "store": true saves it as RENDER_OUTPUT_DIR/<filename>
+    and returns its path.
+    """
+    try:
+        data = request.json
+        encode_kwargs = {
+            'fps': data.get("fps"),
+            'codec': data.get("codec", "libx264"),
+            'crf': data.get("crf", 23),
+            'preset': data.get("preset", "ultrafast"),
+            'interval': data.get("interval", 0.02),
+        }
+        # Checked before simulating, so a bad setting fails fast
+        check_mp4_options(**encode_kwargs)
+
+        cache_key = data.get("cacheKey")
+        if cache_key:
+            sim_data = SIM_CACHE.get(cache_key)
+            if sim_data is None:
+                return jsonify({"status": "error", "message": f"No cached simulation for key {cache_key}"}), 404
+        else:
+            entities, simulationParams, distractorParams, options = _parse_simulation_request(data)
+            cache_key = simulation_cache_key(entities, simulationParams, distractorParams, options)
+            sim_data = SIM_CACHE.get(cache_key) if cache_key else None
+            if sim_data is None:
+                sim_data = run_simulation_with_visualization(entities, simulationParams, distractorParams, **options)
+                if cache_key:
+                    SIM_CACHE.put(cache_key, sim_data)
+
+        download_name = secure_filename(data.get("filename") or f"{cache_key or 'stimulus'}.mp4")
+        if not download_name.endswith('.mp4'):
+            download_name += '.mp4'
+
+        if data.get("store", False):
+            if not RENDER_OUTPUT_DIR:
+                return jsonify({"status": "error", "message": "RENDER_OUTPUT_DIR is not configured"}), 400
+            os.makedirs(RENDER_OUTPUT_DIR, exist_ok=True)
+            mp4_path = encode_obs_mp4(sim_data, os.path.join(RENDER_OUTPUT_DIR, download_name), **encode_kwargs)
+            logger.info("Stored rendered video", extra={'path': mp4_path})
+            return jsonify({"status": "success", "path": mp4_path})
+
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_mp4:
+            mp4_path = temp_mp4.name
+        try:
+            encode_obs_mp4(sim_data, mp4_path, **encode_kwargs)
+            # The open handle keeps the data readable after the temp file is unlinked
+            mp4_file = open(mp4_path, 'rb')
+        finally:
+            os.unlink(mp4_path)
+        return send_file(mp4_file, mimetype='video/mp4', as_attachment=True, download_name=download_name)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error rendering video", extra={'error': str(e)})
+        return jsonify({"status": "error", "message": f"Rendering error: {str(e)}"}), 500
+
+@app.route('/simulation/<simulation_id>', methods=['GET'])
+def get_simulation(simulation_id):
+    """Return a stored simulation result by id (JSON, or the binary container like /simulate)"""
+    entry = SIM_STORE.get(simulation_id)
+    if entry is None:
+        return jsonify({"status": "error", "message": "Unknown or evicted simulation"}), 404
+    if _wants_binary_response():
+        return _binary_response(entry['sim_data'], simulation_id=simulation_id)
+    return jsonify({"status": "success", "sim_data": entry['sim_data'], "simulation_id": simulation_id})
+
+@app.route('/simulation/<simulation_id>/frames', methods=['GET'])
+def get_simulation_frames(simulation_id):
+    """
+    Random access to the target frames of a stored result, e.g. for scrubbing.
+    Query: start (default 0), stop (exclusive, default num_frames), step (default 1).
+    Returns step_data for those frames and the checkpoint at or before start.
+    """
+    entry = SIM_STORE.get(simulation_id)
+    if entry is None:
+        return jsonify({"status": "error", "message": "Unknown or evicted simulation"}), 404
+    sim_data = entry['sim_data']
+    try:
+        start = max(0, int(request.args.get('start', 0)))
+        stop = min(int(request.args.get('stop', sim_data['num_frames'])), sim_data['num_frames'])
+        step = max(1, int(request.args.get('step', 1)))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    step_data = {frame: sim_data['step_data'][frame] for frame in range(start, stop, step) if frame in sim_data['step_data']}
+    checkpoints = [c for c in sim_data.get('checkpoints', []) if c['frame'] <= start]
+    return jsonify({"status": "success", "simulation_id": simulation_id, "num_frames": sim_data['num_frames'],
+                    "step_data": step_data, "checkpoint": checkpoints[-1] if checkpoints else None})
+
+@app.route('/simulation_store', methods=['GET'])
+def simulation_store_stats():
+    """Report how many results are stored and their estimated memory use"""
+    return jsonify({"status": "success", "store": SIM_STORE.stats()})
+
+@app.route('/cancel_simulation', methods=['POST'])
+def cancel_simulation():
+    """
+    Cancel the calling session's running simulations, or only the one named by "jobId".
+    The cancelled requests answer with status "cancelled".
+    """
+    session_id, new_session = _session_id()
+    data = request.get_json(silent=True) or {}
+    cancelled = SIM_JOBS.cancel(session_id, data.get("jobId"))
+    logger.info("Simulation cancel requested", extra={'session': session_id, 'cancelled': cancelled})
+    return _with_session(jsonify({"status": "success", "cancelled": cancelled}), session_id, new_session)
+
 @app.route('/clear_simulation', methods=['POST'])
 def clear_simulation():
-    # Add logic here to clear the simulation state on the server
-    global GLOBAL_SIM_DATA
-    GLOBAL_SIM_DATA = None
-    print("Simulation cleared successfully.")
-    return jsonify({"status": "success", "message": "Simulation cleared."})
+    # Clear only the calling session's simulation state, stopping simulations still in flight
+    session_id, new_session = _session_id()
+    SIM_JOBS.cancel(session_id, reason="Simulation cleared")
+    SIM_STORE.clear_session(session_id)
+    logger.info("Simulation cleared", extra={'session': session_id})
+    return _with_session(jsonify({"status": "success", "message": "Simulation cleared."}), session_id, new_session)
+
+class AssetCache:
+    """
+    Read-through, on-disk LRU cache in front of the static asset bucket.
+    Upstream requests share a pooled requests.Session and are conditional (ETag / Last-Modified), so an
+    unchanged asset costs a 304 at most every max_age seconds. The cache is capped at max_bytes by
+    evicting the least recently used assets. If base_url is a local directory, files are served
+    from it directly and nothing is cached.
+    """
+    def __init__(self, base_url, cache_dir, max_bytes, max_age):
+        self.base_url = base_url.rstrip('/')
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.is_local = not self.base_url.startswith(('http://', 'https://'))
+        if self.base_url.startswith('file://'):
+            self.base_url = self.base_url[len('file://'):]
+        self._session = None
+        self._lock = threading.Lock()
+        # Striped per-asset locks: a fixed pool, so the number of locks doesn't grow with the assets seen
+        self._key_locks = [threading.Lock() for _ in range(ASSET_CACHE_LOCK_STRIPES)]
+        self._index = None  # key -> metadata, least recently used first
+
+    @property
+    def session(self):
+        if self._session is None:
+            from requests.adapters import HTTPAdapter
+            self._session = _requests().Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=2)
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+        return self._session
+
+    def _load_index(self):
+        """Rebuild the LRU index from the metadata files left by earlier runs"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.cache_dir, name)) as f:
+                        entries.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        entries.sort(key=lambda meta: meta['accessed'])
+        self._index = OrderedDict((meta['key'], meta) for meta in entries)
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, key), os.path.join(self.cache_dir, f"{key}.json")
+
+    def fetch(self, asset_path):
+        """
+        Return the local path of a fresh copy of asset_path (relative to base_url).
+        Raises FileNotFoundError if the asset does not exist and requests exceptions if upstream fails
+        and there is no cached copy to fall back on.
+        """
+        parts = asset_path.replace('\\', '/').split('/')
+        if not asset_path or any(part in ('', '.', '..') for part in parts):
+            raise FileNotFoundError(asset_path)
+        if self.is_local:
+            local_path = os.path.join(self.base_url, *parts)
+            if not os.path.isfile(local_path):
+                raise FileNotFoundError(asset_path)
+            return local_path
+
+        key = hashlib.sha256(asset_path.encode('utf-8')).hexdigest()
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+        key_lock = self._key_locks[int(key[:8], 16) % len(self._key_locks)]
+
+        # One upstream request per asset at a time, concurrent readers wait for it (assets sharing a stripe too)
+        with key_lock:
+            data_path, meta_path = self._paths(key)
+            with self._lock:
+                meta = self._index.get(key)
+            if meta is not None and not os.path.exists(data_path):
+                meta = None
+            if meta is None or time.time() - meta['validated'] > self.max_age:
+                try:
+                    meta = self._revalidate(asset_path, key, meta)
+                except _requests().exceptions.RequestException as e:
+                    if meta is None:
+                        raise
+                    logger.warning("Serving stale asset", extra={'asset': asset_path, 'error': str(e)})
+            meta['accessed'] = time.time()
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+            with self._lock:
+                self._index[key] = meta
+                self._index.move_to_end(key)
+            self._evict()
+            return data_path
+
+    def _revalidate(self, asset_path, key, meta):
+        headers = {}
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        response = self.session.get(f"{self.base_url}/{asset_path}", headers=headers, stream=True, timeout=10)
+        with response:
+            if response.status_code == 304 and meta is not None:
+                meta['validated'] = time.time()
+                return meta
+            if response.status_code in (403, 404):
+                # S3 answers 403 for missing keys on buckets without list permission
+                raise FileNotFoundError(asset_path)
+            response.raise_for_status()
+
+            data_path, _ = self._paths(key)
+            size = 0
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir, delete=False, suffix='.tmp') as temp_file:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    temp_file.write(chunk)
+                    size += len(chunk)
+            os.replace(temp_file.name, data_path)
+        return {
+            'key': key,
+            'path': asset_path,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_type': response.headers.get('Content-Type'),
+            'size': size,
+            'validated': time.time(),
+            'accessed': time.time(),
+        }
+
+    def _evict(self):
+        with self._lock:
+            total = sum(meta['size'] for meta in self._index.values())
+            while total > self.max_bytes and len(self._index) > 1:
+                key, meta = self._index.popitem(last=False)
+                total -= meta['size']
+                for path in self._paths(key):
+                    if os.path.exists(path):
+                        os.unlink(path)
+
+    def stats(self):
+        with self._lock:
+            if self._index is None and not self.is_local:
+                self._load_index()
+            entries = self._index or {}
+            return {
+                'base_url': self.base_url,
+                'local': self.is_local,
+                'entries': len(entries),
+                'bytes': sum(meta['size'] for meta in entries.values()),
+                'max_bytes': self.max_bytes,
+            }
+
+ASSET_CACHE = AssetCache(ASSET_BASE_URL, ASSET_CACHE_DIR, ASSET_CACHE_MAX_BYTES, ASSET_CACHE_MAX_AGE)
+
+@app.route('/site_static_assets/<path:asset_path>', methods=['GET'])
+def serve_cached_asset(asset_path):
+    """
+    Serve a static asset (stimulus videos, plots, CSVs) through the local asset cache.
+    Supports conditional requests and HTTP Range, so videos can be seeked.
+    """
+    try:
+        local_path = ASSET_CACHE.fetch(asset_path)
+    except FileNotFoundError:
+        return jsonify({"status": "error", "message": f"Asset not found: {asset_path}"}), 404
+    except _requests().exceptions.RequestException as e:
+        logger.error("Error fetching asset", extra={'asset': asset_path, 'error': str(e)})
+        return jsonify({"status": "error", "message": f"Failed to fetch asset: {str(e)}"}), 502
+    mimetype = mimetypes.guess_type(asset_path)[0] or 'application/octet-stream'
+    response = send_file(local_path, mimetype=mimetype, conditional=True, max_age=int(ASSET_CACHE_MAX_AGE))
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+def metrics_csv_path(diameter=None, asset_folder=None):
+    """Asset path of the per_trial_metrics.csv for a diameter, an asset folder, or the default trial set"""
+    if diameter:
+        # Diameter-specific folder (CSV is in cogsci_2025_trials subfolder)
+        return f'varying_diameters/diameter_{diameter}/cogsci_2025_trials/per_trial_metrics.csv'
+    if asset_folder:
+        return f'{asset_folder}/per_trial_metrics.csv'
+    # Default: cogsci_2025_trials_tuned_Jan102026
+    return 'cogsci_2025_trials_tuned_Jan102026/per_trial_metrics.csv'
+
+def parse_metrics_csv(path):
+    """
+    Read a per_trial_metrics.csv (trial name column, then one column per metric) into
+    (trial names, {metric: float64 array}). Empty, 'nan' and 'none' cells become NaN.
+    """
+    with open(path, encoding='utf-8', newline='') as f:
+        rows = [row for row in csv.reader(f) if row]
+    if not rows:
+        return [], {}
+    header = [h.strip() for h in rows[0]]
+    rows = [row for row in rows[1:] if len(row) == len(header)]
+
+    def number(cell):
+        try:
+            return float(cell)
+        except ValueError:
+            return math.nan
+    trials = [row[0].strip() for row in rows]
+    columns = {name: np.array([number(row[j]) for row in rows], dtype=np.float64) for j, name in enumerate(header) if j > 0}
+    return trials, columns
+
+class TrialMetricsTable:
+    """
+    Per-trial metrics of several sources (diameters or asset folders) as one columnar table:
+    for every metric a float64 matrix of shape (sources, trials), NaN where a source has no value.
+    """
+    def __init__(self, sources, parts):
+        self.sources = list(sources)
+        self.trials = sorted({trial for trials, _ in parts for trial in trials})
+        self.metrics = sorted({metric for _, columns in parts for metric in columns})
+        trial_index = {trial: i for i, trial in enumerate(self.trials)}
+        self.values = {metric: np.full((len(self.sources), len(self.trials)), np.nan) for metric in self.metrics}
+        for s, (trials, columns) in enumerate(parts):
+            cols = np.array([trial_index[t] for t in trials], dtype=np.int64)
+            for metric, column in columns.items():
+                self.values[metric][s, cols] = column
+
+    def summary(self, metric, quantiles=(0.25, 0.5, 0.75)):
+        """Count, mean, median, std, min, max and quantiles of a metric for every source"""
+        values = self.values[metric]
+        count = np.sum(~np.isnan(values), axis=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN sources give NaN stats
+            stats = {
+                'mean': np.nanmean(values, axis=1), 'median': np.nanmedian(values, axis=1),
+                'std': np.nanstd(values, axis=1), 'min': np.nanmin(values, axis=1), 'max': np.nanmax(values, axis=1),
+            }
+            qs = np.nanquantile(values, quantiles, axis=1) if quantiles else np.empty((0, len(self.sources)))
+        return {
+            source: {'count': int(count[s]), **{k: _finite_or_none(v[s]) for k, v in stats.items()},
+                     'quantiles': {str(q): _finite_or_none(qs[i, s]) for i, q in enumerate(quantiles)}}
+            for s, source in enumerate(self.sources)
+        }
+
+    def trial_ranking(self, metric, higher_better):
+        """Trials ranked best first by their mean over the sources"""
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            means = np.nanmean(self.values[metric], axis=0)
+        order = [i for i in np.argsort(-means if higher_better else means, kind='stable') if not np.isnan(means[i])]
+        return [{'trial': self.trials[i], 'mean': float(means[i]), 'sources': int(np.sum(~np.isnan(self.values[metric][:, i]))),
+                 'rank': rank + 1} for rank, i in enumerate(order)]
+
+    def extremes(self, metric, higher_better, n=5):
+        """The n best and worst (source, trial) values of a metric"""
+        values = self.values[metric].ravel()
+        finite = np.flatnonzero(~np.isnan(values))
+        order = finite[np.argsort(values[finite], kind='stable')]
+        if higher_better:
+            order = order[::-1]
+
+        def entry(flat):
+            s, t = divmod(int(flat), len(self.trials))
+            return {'source': self.sources[s], 'trial': self.trials[t], 'value': float(values[flat])}
+        return {'best': [entry(i) for i in order[:n]], 'worst': [entry(i) for i in order[::-1][:n]]}
+
+def _finite_or_none(value):
+    return float(value) if np.isfinite(value) else None
+
+class TrialMetricsStore:
+    """
+    Loads per_trial_metrics.csv files through the asset cache and keeps them parsed.
+    A file is re-parsed only when the asset cache's copy changed (it is re-downloaded only when
+    the upstream ETag changes); tables over a set of sources are memoized on those versions.
+    """
+    def __init__(self, asset_cache, max_workers=16, max_tables=32):
+        self.asset_cache = asset_cache
+        self.max_workers = max_workers
+        self.max_tables = max_tables
+        self._parsed = {}  # csv path -> (version, (trials, columns))
+        self._tables = OrderedDict()  # (sources, versions) -> TrialMetricsTable
+        self._lock = threading.Lock()
+
+    def _load(self, csv_path):
+        """(version, parsed) for one CSV, or None if it does not exist"""
+        try:
+            local_path = self.asset_cache.fetch(csv_path)
+        except FileNotFoundError:
+            return None
+        stat = os.stat(local_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._parsed.get(csv_path)
+        if cached is not None and cached[0] == version:
+            return cached
+        loaded = (version, parse_metrics_csv(local_path))
+        with self._lock:
+            self._parsed[csv_path] = loaded
+        return loaded
+
+    def table(self, sources):
+        """
+        Table over sources, a list of (label, csv path). Returns (table, labels of missing sources);
+        missing sources are left out of the table.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(sources)))) as executor:
+            loaded = list(executor.map(self._load, [path for _, path in sources]))
+        present = [(label, result) for (label, _), result in zip(sources, loaded) if result is not None]
+        missing = [label for (label, _), result in zip(sources, loaded) if result is None]
+        key = tuple((label, result[0]) for label, result in present)
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+                return table, missing
+        table = TrialMetricsTable([label for label, _ in present], [result[1] for _, result in present])
+        with self._lock:
+            self._tables[key] = table
+            while len(self._tables) > self.max_tables:
+                self._tables.popitem(last=False)
+        return table, missing
+
+TRIAL_METRICS = TrialMetricsStore(ASSET_CACHE, METRICS_FETCH_WORKERS)
 
 @app.route('/metrics_csv', methods=['GET'])
 def get_metrics_csv():
     """
-    Proxy endpoint to fetch metrics CSV from AWS S3.
+    Proxy endpoint to fetch metrics CSV from AWS S3 (through the local asset cache).
     This avoids CORS issues when fetching directly from the frontend.
     
     Query parameters:
@@ -689,127 +3419,360 @@ def get_metrics_csv():
     - Otherwise, fetches from cogsci_2025_trials_tuned_Jan102026/per_trial_metrics.csv
     """
     try:
-        diameter = request.args.get('diameter')
-        asset_folder = request.args.get('asset_folder')
+        csv_path = metrics_csv_path(request.args.get('diameter'), request.args.get('asset_folder'))
         
-        if diameter:
-            # Fetch from diameter-specific folder (CSV is in cogsci_2025_trials subfolder)
-            csv_url = f'https://redgreenplayground.s3.us-east-2.amazonaws.com/site_static_assets/varying_diameters/diameter_{diameter}/cogsci_2025_trials/per_trial_metrics.csv'
-        elif asset_folder:
-            csv_url = f'https://redgreenplayground.s3.us-east-2.amazonaws.com/site_static_assets/{asset_folder}/per_trial_metrics.csv'
-        else:
-            # Default: fetch from cogsci_2025_trials_tuned_Jan102026
-            csv_url = 'https://redgreenplayground.s3.us-east-2.amazonaws.com/site_static_assets/cogsci_2025_trials_tuned_Jan102026/per_trial_metrics.csv'
+        with open(ASSET_CACHE.fetch(csv_path), encoding='utf-8') as f:
+            csv_text = f.read()
         
-        response = requests.get(csv_url, timeout=10)
-        response.raise_for_status()
-        
-        return response.text, 200, {'Content-Type': 'text/csv; charset=utf-8'}
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching CSV from S3: {e}")
+        return csv_text, 200, {'Content-Type': 'text/csv; charset=utf-8'}
+    except FileNotFoundError:
+        logger.warning("Metrics CSV not found", extra={'asset': csv_path})
+        return jsonify({"error": f"Failed to fetch CSV: {csv_path} not found"}), 404
+    except _requests().exceptions.RequestException as e:
+        logger.error("Error fetching CSV from S3", extra={'asset': csv_path, 'error': str(e)})
         return jsonify({"error": f"Failed to fetch CSV: {str(e)}"}), 500
 
+@app.route('/metrics_aggregate', methods=['POST'])
+@profiled
+def aggregate_metrics():
+    """
+    Aggregate per_trial_metrics.csv files of many diameters and/or asset folders in one request.
+
+    Expects JSON:
+    - diameters: list of diameters, or "all" for every published diameter (10-100)
+    - assetFolders: list of asset folders
+    - metrics: optional list of metric columns (default: all)
+    - quantiles: optional list (default [0.25, 0.5, 0.75])
+    - top: number of best/worst trials per metric (default 5)
+    - rankings: include per-trial rankings (mean over the sources), default true
+    Returns per-metric statistics by source, per-trial rankings and best/worst trials.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        diameters = data.get("diameters") or []
+        if diameters == "all":
+            diameters = METRICS_DIAMETERS
+        sources = [(str(d), metrics_csv_path(diameter=d)) for d in diameters]
+        sources += [(folder, metrics_csv_path(asset_folder=folder)) for folder in data.get("assetFolders") or []]
+        if not sources:
+            return jsonify({"status": "error", "message": "Provide diameters and/or assetFolders"}), 400
+
+        with timed_stage('metrics_load'):
+            table, missing = TRIAL_METRICS.table(sources)
+        metrics = data.get("metrics") or table.metrics
+        unknown = [m for m in metrics if m not in table.values]
+        if unknown and table.sources:
+            return jsonify({"status": "error", "message": f"Unknown metrics: {unknown}"}), 400
+        metrics = [m for m in metrics if m in table.values]
+        quantiles = [float(q) for q in data.get("quantiles", [0.25, 0.5, 0.75])]
+        top = int(data.get("top", 5))
+
+        with timed_stage('metrics_aggregate'):
+            result = {}
+            for metric in metrics:
+                higher_better = metric in METRICS_HIGHER_BETTER
+                result[metric] = {
+                    'higher_better': higher_better,
+                    'by_source': table.summary(metric, quantiles),
+                    **table.extremes(metric, higher_better, top),
+                }
+                if data.get("rankings", True):
+                    result[metric]['trial_ranking'] = table.trial_ranking(metric, higher_better)
+        return jsonify({"status": "success", "sources": table.sources, "missing": missing,
+                        "trials": len(table.trials), "metrics": result})
+    except _requests().exceptions.RequestException as e:
+        logger.error("Error fetching metrics CSVs", extra={'error': str(e)})
+        return jsonify({"status": "error", "message": f"Failed to fetch CSV: {str(e)}"}), 502
+    except Exception as e:
+        logger.exception("Error aggregating metrics", extra={'error': str(e)})
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_available():
+    """Check once per process whether FFmpeg can be run"""
+    try:
+        subprocess.run([FFMPEG_BINARY, '-version'], capture_output=True, check=True)
+        return True
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return False
+
+FFMPEG_MISSING_MESSAGE = "FFmpeg is not installed or not available in PATH. Please install FFmpeg to use MP4 conversion."
+
+def _save_upload_to_temp(upload, suffix):
+    """Stream an uploaded file to a temporary file in chunks and return its path"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        # Stream in chunks to reduce memory usage
+        chunk_size = 8192  # 8KB chunks
+        while True:
+            chunk = upload.stream.read(chunk_size)
+            if not chunk:
+                break
+            temp_file.write(chunk)
+        return temp_file.name
+
+FFMPEG_BANNER_BYTES = 64 * 1024  # ffmpeg's input description is a few KB at most
+
+def _parse_ffmpeg_duration(text):
+    """Input duration in seconds from ffmpeg's banner ("Duration: 00:00:07.33"), or None"""
+    match = re.search(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', text)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+class TranscodeJobQueue:
+    """
+    WebM -> MP4 conversions run as jobs on a bounded pool of worker threads, each driving one ffmpeg.
+    At most max_concurrent ffmpeg processes run at once and at most max_pending jobs wait for one.
+    Progress is parsed from ffmpeg's -progress output. Finished jobs and their files are removed
+    ttl seconds after they finish.
+    """
+    def __init__(self, max_concurrent=1, max_pending=16, ttl=600):
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='transcode')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, webm_path, download_name):
+        """Queue a conversion of webm_path, returning the job id. Raises RuntimeError when the queue is full."""
+        self.reap_expired()
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'running'))
+            if pending >= self.max_pending:
+                raise RuntimeError("Too many conversions in progress, please try again shortly")
+            job_id = uuid.uuid4().hex
+            job = {
+                'id': job_id,
+                'status': 'queued',
+                'progress': None,
+                'processed_seconds': 0.0,
+                'duration': None,
+                'message': None,
+                'download_name': download_name,
+                'created': time.time(),
+                'finished': None,
+                'webm_path': webm_path,
+                'mp4_path': None,
+            }
+            self._jobs[job_id] = job
+            job['future'] = self._executor.submit(self._run, job)
+        return job_id
+
+    def status(self, job_id):
+        """Public view of a job, or None if it is unknown or expired"""
+        self.reap_expired()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {k: job[k] for k in ('id', 'status', 'progress', 'processed_seconds', 'duration', 'message', 'download_name', 'created', 'finished')}
+
+    def wait(self, job_id):
+        """Block until the job has finished"""
+        with self._lock:
+            future = self._jobs[job_id]['future']
+        future.result()
+
+    def open_result(self, job_id, remove=False):
+        """
+        Open the finished MP4 of a job for reading, or return None if it is not done.
+        With remove=True the job and its file are dropped right away; the returned handle stays readable.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != 'done':
+                return None
+            mp4_file = open(job['mp4_path'], 'rb')
+            if remove:
+                self._discard(self._jobs.pop(job_id))
+            return mp4_file
+
+    def counts_by_status(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[(('status', job['status']),)] = counts.get((('status', job['status']),), 0) + 1
+            return counts
+
+    def reap_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['finished'] is not None and now - job['finished'] > self.ttl]
+            for job_id in expired:
+                self._discard(self._jobs.pop(job_id))
+
+    @staticmethod
+    def _discard(job):
+        for path in (job['webm_path'], job['mp4_path']):
+            if path and os.path.exists(path):
+                os.unlink(path)
+
+    def _run(self, job):
+        with self._lock:
+            job['status'] = 'running'
+        try:
+            if not ffmpeg_available():
+                raise RuntimeError(FFMPEG_MISSING_MESSAGE)
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_mp4:
+                job['mp4_path'] = temp_mp4.name
+
+            # Convert WebM to MP4 using FFmpeg
+            # Using H.264 codec with memory-efficient settings for Heroku
+            ffmpeg_cmd = [
+                FFMPEG_BINARY,
+                '-hide_banner',  # Keep error messages to the point
+                '-i', job['webm_path'],  # Input file
+                '-c:v', 'libx264',  # Video codec (H.264)
+                '-preset', 'ultrafast',  # Fastest preset (uses less memory than medium)
+                '-crf', '23',  # Quality (18-28 range, lower = better quality)
+                '-pix_fmt', 'yuv420p',  # Pixel format for compatibility
+                '-movflags', '+faststart',  # Optimize for web streaming
+                '-threads', '1',  # Limit to single thread to reduce memory usage
+                '-max_muxing_queue_size', '1024',  # Limit muxing queue size
+                '-progress', 'pipe:1',  # Machine-readable progress on stdout
+                '-nostats',
+                '-y',  # Overwrite output file
+                job['mp4_path']  # Output file
+            ]
+            # stderr goes to a file so a chatty ffmpeg can never block on a full pipe
+            with tempfile.TemporaryFile() as stderr_file, timed_stage('ffmpeg_transcode'):
+                proc = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=stderr_file, text=True)
+                banner_read = False
+                for line in proc.stdout:
+                    key, _, value = line.strip().partition('=')
+                    if key == 'out_time_us' and value.isdigit():
+                        if not banner_read:
+                            # The input banner is complete before the first progress report. Read it once
+                            # with pread: ffmpeg shares this file's offset and keeps writing at it.
+                            banner_read = True
+                            banner = os.pread(stderr_file.fileno(), FFMPEG_BANNER_BYTES, 0)
+                            with self._lock:
+                                # Browser-recorded WebM often has no duration ("Duration: N/A"), then progress stays None
+                                job['duration'] = _parse_ffmpeg_duration(banner.decode(errors='replace'))
+                        self._update_progress(job, int(value) / 1e6)
+                proc.wait()
+                if proc.returncode != 0:
+                    stderr_file.seek(0)
+                    stderr = stderr_file.read().decode(errors='replace')
+                    logger.error("FFmpeg error", extra={'job': job['id'], 'stderr': stderr})
+                    raise RuntimeError(f"FFmpeg conversion failed: {stderr[:200]}")
+
+            with self._lock:
+                job['status'] = 'done'
+                job['progress'] = 1.0
+        except Exception as e:
+            logger.error("Error converting video", extra={'job': job['id'], 'error': str(e)})
+            with self._lock:
+                job['status'] = 'error'
+                job['message'] = str(e)
+            if job['mp4_path'] and os.path.exists(job['mp4_path']):
+                os.unlink(job['mp4_path'])
+                job['mp4_path'] = None
+        finally:
+            # The input is no longer needed once ffmpeg is done with it
+            if os.path.exists(job['webm_path']):
+                os.unlink(job['webm_path'])
+            with self._lock:
+                job['finished'] = time.time()
+            METRICS.inc('rg_transcode_jobs_total', status=job['status'])
+
+    def _update_progress(self, job, processed_seconds):
+        with self._lock:
+            job['processed_seconds'] = processed_seconds
+            if job['duration']:
+                job['progress'] = min(1.0, processed_seconds / job['duration'])
+
+TRANSCODE_JOBS = TranscodeJobQueue(TRANSCODE_MAX_CONCURRENT, TRANSCODE_MAX_PENDING, TRANSCODE_JOB_TTL)
+METRICS.callback('rg_transcode_jobs', 'gauge', "Conversion jobs currently known by status", TRANSCODE_JOBS.counts_by_status)
+
+def _submit_transcode_upload():
+    """Validate the 'video' upload of the current request and queue it, returning (job_id, None) or (None, error response)"""
+    if 'video' not in request.files:
+        return None, (jsonify({"status": "error", "message": "No video file provided"}), 400)
+    webm_file = request.files['video']
+    if webm_file.filename == '':
+        return None, (jsonify({"status": "error", "message": "No file selected"}), 400)
+    if not ffmpeg_available():
+        return None, (jsonify({"status": "error", "message": FFMPEG_MISSING_MESSAGE}), 500)
+
+    # Stream file to disk in chunks to avoid loading entire file into memory
+    webm_path = _save_upload_to_temp(webm_file, '.webm')
+    try:
+        job_id = TRANSCODE_JOBS.submit(webm_path, webm_file.filename.replace('.webm', '.mp4'))
+    except RuntimeError as e:
+        os.unlink(webm_path)
+        return None, (jsonify({"status": "error", "message": str(e)}), 503)
+    return job_id, None
+
 @app.route('/convert_to_mp4', methods=['POST'])
+@profiled
 def convert_to_mp4():
     """
     Convert WebM video to MP4 using FFmpeg.
     Expects a multipart/form-data request with a 'video' file field.
-    Returns the MP4 file as a download.
+    Returns the MP4 file as a download once the conversion job has run. This holds the request
+    open for the whole conversion and is kept for existing API clients; the frontend uses the
+    non-blocking /convert_to_mp4/jobs API.
     """
     try:
-        if 'video' not in request.files:
-            return jsonify({"status": "error", "message": "No video file provided"}), 400
-        
-        webm_file = request.files['video']
-        if webm_file.filename == '':
-            return jsonify({"status": "error", "message": "No file selected"}), 400
-        
-        # Create temporary files for input and output
-        # Stream file to disk in chunks to avoid loading entire file into memory
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_webm:
-            webm_path = temp_webm.name
-            # Stream in chunks to reduce memory usage
-            chunk_size = 8192  # 8KB chunks
-            while True:
-                chunk = webm_file.stream.read(chunk_size)
-                if not chunk:
-                    break
-                temp_webm.write(chunk)
-            temp_webm.flush()
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_mp4:
-            mp4_path = temp_mp4.name
-        
-        try:
-            # Check if FFmpeg is available
-            subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            # Clean up temp files
-            os.unlink(webm_path)
-            os.unlink(mp4_path)
-            return jsonify({
-                "status": "error", 
-                "message": "FFmpeg is not installed or not available in PATH. Please install FFmpeg to use MP4 conversion."
-            }), 500
-        
-        # Convert WebM to MP4 using FFmpeg
-        # Using H.264 codec with memory-efficient settings for Heroku
-        ffmpeg_cmd = [
-            'ffmpeg',
-            '-i', webm_path,  # Input file
-            '-c:v', 'libx264',  # Video codec (H.264)
-            '-preset', 'ultrafast',  # Fastest preset (uses less memory than medium)
-            '-crf', '23',  # Quality (18-28 range, lower = better quality)
-            '-pix_fmt', 'yuv420p',  # Pixel format for compatibility
-            '-movflags', '+faststart',  # Optimize for web streaming
-            '-threads', '1',  # Limit to single thread to reduce memory usage
-            '-max_muxing_queue_size', '1024',  # Limit muxing queue size
-            '-y',  # Overwrite output file
-            mp4_path  # Output file
-        ]
-        
-        result = subprocess.run(
-            ffmpeg_cmd,
-            capture_output=True,
-            text=True
-        )
-        
-        # Clean up input file
-        os.unlink(webm_path)
-        
-        if result.returncode != 0:
-            # Clean up output file on error
-            if os.path.exists(mp4_path):
-                os.unlink(mp4_path)
-            print(f"FFmpeg error: {result.stderr}")
-            return jsonify({
-                "status": "error",
-                "message": f"FFmpeg conversion failed: {result.stderr[:200]}"
-            }), 500
-        
+        job_id, error = _submit_transcode_upload()
+        if error:
+            return error
+        TRANSCODE_JOBS.wait(job_id)
+        job = TRANSCODE_JOBS.status(job_id)
+        if job['status'] != 'done':
+            return jsonify({"status": "error", "message": job['message']}), 500
+
         # Send the MP4 file
         return send_file(
-            mp4_path,
+            TRANSCODE_JOBS.open_result(job_id, remove=True),
             mimetype='video/mp4',
             as_attachment=True,
-            download_name=webm_file.filename.replace('.webm', '.mp4')
+            download_name=job['download_name']
         )
-        
     except Exception as e:
-        # Clean up temp files on error
-        if 'webm_path' in locals() and os.path.exists(webm_path):
-            os.unlink(webm_path)
-        if 'mp4_path' in locals() and os.path.exists(mp4_path):
-            os.unlink(mp4_path)
-        
-        print(f"Error converting video: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error converting video", extra={'error': str(e)})
         return jsonify({
             "status": "error",
             "message": f"Conversion error: {str(e)}"
         }), 500
 
+@app.route('/convert_to_mp4/jobs', methods=['POST'])
+@profiled
+def submit_convert_to_mp4_job():
+    """
+    Queue a WebM -> MP4 conversion.
+    Expects a multipart/form-data request with a 'video' file field and returns {"job_id": ...}
+    right away; poll /convert_to_mp4/jobs/<job_id> and fetch /convert_to_mp4/jobs/<job_id>/download.
+    """
+    job_id, error = _submit_transcode_upload()
+    if error:
+        return error
+    return jsonify({"status": "success", "job_id": job_id}), 202
+
+@app.route('/convert_to_mp4/jobs/<job_id>', methods=['GET'])
+def convert_to_mp4_job_status(job_id):
+    """Report a conversion job's status (queued, running, done or error) and progress (0-1, null if unknown)"""
+    job = TRANSCODE_JOBS.status(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown or expired job"}), 404
+    return jsonify({"status": "success", "job": job})
+
+@app.route('/convert_to_mp4/jobs/<job_id>/download', methods=['GET'])
+def download_convert_to_mp4_job(job_id):
+    """Download the MP4 of a finished conversion job"""
+    job = TRANSCODE_JOBS.status(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown or expired job"}), 404
+    mp4_file = TRANSCODE_JOBS.open_result(job_id)
+    if mp4_file is None:
+        return jsonify({"status": "error", "message": f"Job is {job['status']}", "job": job}), 409
+    return send_file(mp4_file, mimetype='video/mp4', as_attachment=True, download_name=job['download_name'])
+
 if __name__ == '__main__':
+    # Probe FFmpeg once at startup instead of on every conversion
+    logger.info("FFmpeg probe", extra={'ffmpeg_available': ffmpeg_available()})
     port = int(os.environ.get('PORT', 5001))
     app.run(host='0.0.0.0', port=port)
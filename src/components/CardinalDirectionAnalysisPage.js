@@ -1,5 +1,6 @@
 import React, { useEffect, useMemo, useState } from 'react';
 import { Link } from 'react-router-dom';
+import { ASSETS_BASE_PATH } from '../constants';
 import {
   metricNameMap,
   metricsEnabled,
@@ -88,7 +89,7 @@ function CardinalDirectionAnalysisPage() {
       : null;
   const selectedCardinalImageUrl =
     selectedIndex != null
-      ? `https://redgreenplayground.s3.us-east-2.amazonaws.com/site_static_assets/cardinal_direction_analyses/E${selectedIndex}_directional_analysis.png`
+      ? `${ASSETS_BASE_PATH}/cardinal_direction_analyses/E${selectedIndex}_directional_analysis.png`
       : null;
 
   return (
@@ -285,7 +286,7 @@ function CardinalDirectionAnalysisPage() {
             (typeof metricValue !== 'number' || Number.isNaN(metricValue));
 
           const index = parseInt(trialName.slice(1), 10);
-          const cardinalImageUrl = `https://redgreenplayground.s3.us-east-2.amazonaws.com/site_static_assets/cardinal_direction_analyses/E${index}_directional_analysis.png`;
+          const cardinalImageUrl = `${ASSETS_BASE_PATH}/cardinal_direction_analyses/E${index}_directional_analysis.png`;
 
           return (
             <div
@@ -585,7 +586,7 @@ function CardinalDirectionAnalysisPage() {
             </button>
             {showResultPlot ? (
               <img
-                src={`https://redgreenplayground.s3.us-east-2.amazonaws.com/site_static_assets/cogsci_2025_trials_tuned_Jan102026/${selectedTrial}_plot.png`}
+                src={`${ASSETS_BASE_PATH}/cogsci_2025_trials_tuned_Jan102026/${selectedTrial}_plot.png`}
                 alt={`${selectedTrial} plot`}
                 style={{
                   width: '100%',
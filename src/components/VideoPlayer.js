@@ -1,6 +1,44 @@
 import React, { useState, useEffect, useRef, forwardRef, useImperativeHandle, useCallback } from "react";
 import { Rnd } from "react-rnd";
 
+const MP4_POLL_INTERVAL_MS = 1000;
+
+// Throws with the server's message for a failed conversion request
+const checkConversionResponse = async (response) => {
+  if (!response.ok) {
+    const errorData = await response.json().catch(() => ({ message: 'Conversion failed' }));
+    throw new Error(errorData.message || 'MP4 conversion failed');
+  }
+  return response;
+};
+
+// Queue a WebM -> MP4 conversion job, poll it until it finishes and return the MP4 blob.
+// The job API answers right away, so long conversions don't run into request timeouts.
+const convertToMp4 = async (webmBlob, filename) => {
+  const formData = new FormData();
+  formData.append('video', webmBlob, filename);
+  const submitResponse = await checkConversionResponse(await fetch('/convert_to_mp4/jobs', {
+    method: 'POST',
+    body: formData
+  }));
+  const { job_id: jobId } = await submitResponse.json();
+
+  while (true) {
+    await new Promise(resolve => setTimeout(resolve, MP4_POLL_INTERVAL_MS));
+    const statusResponse = await checkConversionResponse(await fetch(`/convert_to_mp4/jobs/${jobId}`));
+    const { job } = await statusResponse.json();
+    if (job.status === 'done') {
+      break;
+    }
+    if (job.status === 'error') {
+      throw new Error(job.message || 'MP4 conversion failed');
+    }
+  }
+
+  const downloadResponse = await checkConversionResponse(await fetch(`/convert_to_mp4/jobs/${jobId}/download`));
+  return downloadResponse.blob();
+};
+
 const VideoPlayer = forwardRef(({ 
   simData, 
   fps, 
@@ -115,20 +153,7 @@ const VideoPlayer = forwardRef(({
               // Convert to MP4 if requested
               if (videoFormat === "mp4") {
                 try {
-                  const formData = new FormData();
-                  formData.append('video', webmBlob, filename);
-                  
-                  const response = await fetch('/convert_to_mp4', {
-                    method: 'POST',
-                    body: formData
-                  });
-                  
-                  if (!response.ok) {
-                    const errorData = await response.json().catch(() => ({ message: 'Conversion failed' }));
-                    throw new Error(errorData.message || 'MP4 conversion failed');
-                  }
-                  
-                  finalBlob = await response.blob();
+                  finalBlob = await convertToMp4(webmBlob, filename);
                   finalFilename = filename.replace('.webm', '.mp4');
                 } catch (conversionError) {
                   console.error("MP4 conversion error:", conversionError);
@@ -58,6 +58,6 @@ export const MODES = {
 // Default trial name
 export const DEFAULT_TRIAL_NAME = 'base';
 
-// Do not worry, this is a public URL that is used to serve the assets from AWS S3. It is not a secret, and can be seen by anyone.
+// Assets live in AWS S3 and are served through the backend's asset cache, which supports Range and ETag requests.
 // For detailed asset structure documentation, see ASSETS_STRUCTURE.md
-export const ASSETS_BASE_PATH = 'https://redgreenplayground.s3.us-east-2.amazonaws.com/site_static_assets';
+export const ASSETS_BASE_PATH = '/site_static_assets';
@@ -0,0 +1,76 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import red_green_playground as rg
+
+
+def _scene():
+    return {
+        "entities": [
+            {"id": "target", "type": "target", "x": 3, "y": 3, "width": 1, "height": 1, "direction": -1.2},
+            {"id": "barrier", "type": "barrier", "x": 8, "y": 6, "width": 2, "height": 1.5},
+            {"id": "occluder", "type": "occluder", "x": 8, "y": 8, "width": 4, "height": 3},
+            {"id": "red", "type": "red_sensor", "x": 0, "y": 17, "width": 5, "height": 3},
+            {"id": "green", "type": "green_sensor", "x": 15, "y": 0, "width": 5, "height": 2},
+        ],
+        "simulationParams": {"videoLength": 3, "ballSpeed": 3.6, "fps": 30, "physicsStepsPerFrame": 10,
+                             "res_multiplier": 4, "timestep": 0.012, "worldWidth": 20, "worldHeight": 20},
+        "distractorParams": {
+            "keyDistractors": [{"startFrame": 5, "x": 10, "y": 1, "direction": 1.2, "duration": 1, "speed": 3.6}],
+            "randomDistractorParams": {"probability": 0.5, "seed": 1, "duration": 1, "maxActive": 4, "startDelay": 0.3},
+        },
+    }
+
+
+def _as_json(sim_data):
+    # Compare what clients see: tuples become lists and frame keys strings either way
+    return json.loads(json.dumps(sim_data))
+
+
+@pytest.fixture(scope="module")
+def sim_data():
+    entities, simulationParams, distractorParams, options = rg._parse_simulation_request(_scene())
+    return rg.run_simulation_with_visualization(entities, simulationParams, distractorParams, **options)
+
+
+def test_float64_round_trip_is_exact(sim_data):
+    assert sim_data["random_distractors"], "scene should produce random distractors"
+    decoded, header = rg.decode_sim_data_binary(rg.encode_sim_data_binary(sim_data, extra={"cache_key": "abc"}))
+    assert _as_json(decoded) == _as_json(sim_data)
+    assert header["cache_key"] == "abc"
+
+
+def test_float32_round_trip_is_close(sim_data):
+    decoded, _ = rg.decode_sim_data_binary(rg.encode_sim_data_binary(sim_data, dtype=np.float32))
+    assert decoded["step_data"].keys() == sim_data["step_data"].keys()
+    for frame, step in sim_data["step_data"].items():
+        assert decoded["step_data"][frame]["x"] == pytest.approx(step["x"], abs=1e-5)
+        assert decoded["step_data"][frame]["y"] == pytest.approx(step["y"], abs=1e-5)
+
+
+@pytest.mark.parametrize("suffix", [".npz", ".rgsim"])
+def test_save_and_load_round_trip(sim_data, tmp_path, suffix):
+    path = str(tmp_path / f"sim{suffix}")
+    rg.save_sim_data(sim_data, path)
+    assert _as_json(rg.load_sim_data(path)) == _as_json(sim_data)
+
+
+def test_simulate_returns_the_binary_container_on_request():
+    client = rg.app.test_client()
+    body = json.dumps(_scene())
+    as_json = client.post("/simulate", data=body, content_type="application/json").get_json()
+    as_binary = client.post("/simulate?format=binary", data=body, content_type="application/json")
+    decoded, header = rg.decode_sim_data_binary(as_binary.data)
+    assert _as_json(decoded) == as_json["sim_data"]
+    assert header["cache_key"] == as_json["cache_key"]
+
+
+def test_decode_rejects_other_data():
+    with pytest.raises(ValueError):
+        rg.decode_sim_data_binary(b"not a simulation")
@@ -0,0 +1,38 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import red_green_playground as rg
+
+
+def _scene(key_distractors):
+    entities = [
+        {"id": "target", "type": "target", "x": 3, "y": 3, "width": 1, "height": 1, "direction": 0.7},
+        {"id": "red", "type": "red_sensor", "x": 0, "y": 17, "width": 5, "height": 3},
+        {"id": "green", "type": "green_sensor", "x": 15, "y": 0, "width": 5, "height": 2},
+    ]
+    simulationParams = [1, 3.6, 30, 10, 4, 0.012, 20, 20]
+    return entities, simulationParams, {"keyDistractors": key_distractors}
+
+
+def test_zero_duration_key_distractor_has_empty_track():
+    distractor = {"startFrame": 0, "x": 10, "y": 1, "direction": 1.2, "speed": 3.6}
+    entities, simulationParams, distractorParams = _scene([
+        {**distractor, "duration": 0.3},
+        # Zero-length track at the latest start frame
+        {**distractor, "startFrame": 20, "duration": 0},
+    ])
+    sim_data = rg.run_simulation_with_visualization(entities, simulationParams, distractorParams)
+    assert [len(d["step_data"]) for d in sim_data["key_distractors"]] == [9, 0]
+    # The binary container needs every track to be present
+    decoded, _ = rg.decode_sim_data_binary(rg.encode_sim_data_binary(sim_data))
+    assert [len(d["step_data"]) for d in decoded["key_distractors"]] == [9, 0]
+
+
+def test_lone_zero_duration_key_distractor():
+    entities, simulationParams, distractorParams = _scene([
+        {"startFrame": 5, "x": 10, "y": 1, "direction": 1.2, "duration": 0, "speed": 3.6},
+    ])
+    sim_data = rg.run_simulation_with_visualization(entities, simulationParams, distractorParams)
+    assert sim_data["key_distractors"] == [{"startFrame": 5, "duration": 0, "step_data": {}}]
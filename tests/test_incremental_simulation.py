@@ -0,0 +1,106 @@
+import copy
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import red_green_playground as rg
+
+ENTITIES = [
+    {"id": "target", "type": "target", "x": 3, "y": 3, "width": 1, "height": 1, "direction": 0.7},
+    {"id": "b1", "type": "barrier", "x": 8, "y": 6, "width": 2, "height": 1.5},
+    {"id": "b2", "type": "barrier", "x": 14, "y": 14, "width": 2, "height": 1.5},
+    {"id": "occluder", "type": "occluder", "x": 8, "y": 8, "width": 4, "height": 3},
+    {"id": "red", "type": "red_sensor", "x": 0, "y": 17, "width": 5, "height": 3},
+    {"id": "green", "type": "green_sensor", "x": 15, "y": 0, "width": 5, "height": 2},
+]
+SIM_PARAMS = [10, 3.6, 30, 10, 4, 0.012, 20, 20]
+
+
+def _as_json(sim_data):
+    return json.loads(json.dumps(sim_data))
+
+
+def _base(options):
+    sim_data = rg.run_simulation_with_visualization(ENTITIES, SIM_PARAMS, **options)
+    return {"scene": {"entities": ENTITIES, "simulationParams": SIM_PARAMS, "options": options}, "sim_data": sim_data}
+
+
+def _move(entity_id, **changes):
+    def edit(entities):
+        next(e for e in entities if e["id"] == entity_id).update(changes)
+    return edit
+
+
+def _add_barrier(entities):
+    entities.append({"id": "b3", "type": "barrier", "x": 1, "y": 14, "width": 2, "height": 1})
+
+
+EDITS = {
+    "late barrier moved": (_move("b2", x=13), SIM_PARAMS),
+    "early barrier moved": (_move("b1", x=8.5), SIM_PARAMS),
+    "barrier added": (_add_barrier, SIM_PARAMS),
+    "occluder moved": (_move("occluder", x=2), SIM_PARAMS),
+    "longer video": (lambda entities: None, [12] + SIM_PARAMS[1:]),
+    "shorter video": (lambda entities: None, [5] + SIM_PARAMS[1:]),
+}
+
+
+@pytest.mark.parametrize("engine", ["pymunk", "analytic"])
+@pytest.mark.parametrize("name", list(EDITS))
+def test_resumed_simulation_equals_a_full_simulation(engine, name):
+    options = {"engine": engine, "sensor_detection": "frame"}
+    base = _base(options)
+    edit, simulationParams = EDITS[name]
+    entities = copy.deepcopy(ENTITIES)
+    edit(entities)
+
+    resume = rg.plan_incremental_simulation(base, entities, simulationParams, options)
+    assert resume is not None
+    resumed = rg.run_simulation_with_visualization(entities, simulationParams, resume=resume, **options)
+    full = rg.run_simulation_with_visualization(entities, simulationParams, **options)
+    assert _as_json(resumed) == _as_json(full)
+
+
+def test_resume_starts_before_the_ball_reaches_the_edit():
+    options = {"engine": "pymunk", "sensor_detection": "frame"}
+    base = _base(options)
+    early, late = copy.deepcopy(ENTITIES), copy.deepcopy(ENTITIES)
+    _move("b1", x=8.5)(early)
+    _move("b2", x=13)(late)
+    early_frame = rg.plan_incremental_simulation(base, early, SIM_PARAMS, options)[0]["frame"]
+    late_frame = rg.plan_incremental_simulation(base, late, SIM_PARAMS, options)[0]["frame"]
+    assert early_frame < late_frame
+
+
+@pytest.mark.parametrize("change", ["target", "params", "options"])
+def test_other_changes_simulate_from_the_start(change):
+    options = {"engine": "pymunk", "sensor_detection": "frame"}
+    base = _base(options)
+    entities, simulationParams = copy.deepcopy(ENTITIES), list(SIM_PARAMS)
+    if change == "target":
+        _move("target", direction=0.8)(entities)
+    elif change == "params":
+        simulationParams[5] = 0.01
+    else:
+        options = dict(options, engine="analytic")
+    assert rg.plan_incremental_simulation(base, entities, simulationParams, options) is None
+
+
+def test_simulate_reports_where_an_edit_resumed(monkeypatch):
+    monkeypatch.setattr(rg, "SIM_CACHE", rg.SimulationCache())
+    client = rg.app.test_client()
+    scene = {"entities": copy.deepcopy(ENTITIES),
+             "simulationParams": {"videoLength": 10, "ballSpeed": 3.6, "fps": 30, "physicsStepsPerFrame": 10,
+                                  "res_multiplier": 4, "timestep": 0.012, "worldWidth": 20, "worldHeight": 20}}
+    first = client.post("/simulate", data=json.dumps(scene), content_type="application/json").get_json()
+    _move("b2", x=13)(scene["entities"])
+    scene["baseSimulationId"] = first["simulation_id"]
+    edited = client.post("/simulate", data=json.dumps(scene), content_type="application/json").get_json()
+    assert edited["incremental"]["base_found"]
+    assert edited["incremental"]["resumed_from_frame"] > 0
+    full = rg.run_simulation_with_visualization(scene["entities"], list(scene["simulationParams"].values()))
+    assert edited["sim_data"] == _as_json(full)
@@ -0,0 +1,62 @@
+import math
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import red_green_playground as rg
+
+
+def _entities(red_sensor):
+    # The target moves straight up from y=3; its top edge is at y + 1
+    return [
+        {"id": "target", "type": "target", "x": 3, "y": 3, "width": 1, "height": 1, "direction": math.pi / 2},
+        dict({"id": "red", "type": "red_sensor", "x": 0, "width": 10}, **red_sensor),
+        {"id": "green", "type": "green_sensor", "x": 15, "y": 0, "width": 5, "height": 2},
+    ]
+
+
+def _params(video_length, units_per_frame, steps):
+    # Velocities are normalized, so the timestep sets the distance moved per physics step
+    return [video_length, 3.6, 30, steps, 4, units_per_frame / steps, 20, 20]
+
+
+@pytest.mark.parametrize("engine", ["pymunk", "analytic"])
+@pytest.mark.parametrize("steps", [1, 2, 10, 100])
+def test_substep_hit_frame_is_exact_for_any_substep_count(engine, steps):
+    # The top edge reaches the sensor at y=7.01 after (6.01 - 3) * 30 = 90.3 frames
+    sim_data = rg.run_simulation_with_visualization(_entities({"y": 7.01, "height": 3}), _params(10, 1 / 30, steps),
+                                                    engine=engine, sensor_detection="substep")
+    assert sim_data["rg_outcome"] == "red"
+    assert sim_data["rg_hit_timestep"] == 91
+    assert sim_data["rg_hit_frame_exact"] == pytest.approx(90.3, abs=1e-6)
+    # The target is stopped at the contact, not at the next frame
+    assert sim_data["step_data"][90 + 1]["y"] == pytest.approx(6.01, abs=1e-6)
+
+
+@pytest.mark.parametrize("engine", ["pymunk", "analytic"])
+@pytest.mark.parametrize("steps", [1, 2, 10])
+def test_substep_detection_catches_a_sensor_crossed_between_frames(engine, steps):
+    # A thin sensor crossed within a frame: 3 units per frame, top edge reaches y=8.5 at frame 1.5
+    entities = _entities({"y": 8.5, "height": 0.05})
+    frame_data = rg.run_simulation_with_visualization(entities, _params(1, 3, steps), engine=engine)
+    substep_data = rg.run_simulation_with_visualization(entities, _params(1, 3, steps), engine=engine,
+                                                        sensor_detection="substep")
+    assert frame_data["rg_hit_timestep"] != 2
+    assert substep_data["rg_outcome"] == "red"
+    assert substep_data["rg_hit_timestep"] == 2
+    assert substep_data["rg_hit_frame_exact"] == pytest.approx(1.5, abs=1e-9)
+
+
+def test_frame_detection_does_not_report_an_exact_frame():
+    sim_data = rg.run_simulation_with_visualization(_entities({"y": 7.01, "height": 3}), _params(10, 1 / 30, 10))
+    assert sim_data["rg_hit_timestep"] == 91
+    assert "rg_hit_frame_exact" not in sim_data
+
+
+def test_unknown_sensor_detection_is_rejected():
+    with pytest.raises(ValueError):
+        rg.run_simulation_with_visualization(_entities({"y": 7.01, "height": 3}), _params(1, 1 / 30, 10),
+                                             sensor_detection="sometimes")
@@ -0,0 +1,70 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import red_green_playground as rg
+
+
+def _scene():
+    return {
+        "entities": [
+            {"id": "target", "type": "target", "x": 3, "y": 3, "width": 1, "height": 1, "direction": 0.7},
+            {"id": "barrier", "type": "barrier", "x": 8, "y": 6, "width": 2, "height": 1.5},
+            {"id": "red", "type": "red_sensor", "x": 0, "y": 17, "width": 5, "height": 3},
+            {"id": "green", "type": "green_sensor", "x": 15, "y": 0, "width": 5, "height": 2},
+        ],
+        "simulationParams": {"videoLength": 2, "ballSpeed": 3.6, "fps": 30, "physicsStepsPerFrame": 10,
+                             "res_multiplier": 4, "timestep": 0.012, "worldWidth": 20, "worldHeight": 20},
+        "distractorParams": {"keyDistractors": [], "randomDistractorParams": {"probability": 0.2, "seed": 3, "duration": 1,
+                                                                       "maxActive": 3, "startDelay": 0.3}},
+    }
+
+
+def _key(scene):
+    return rg.simulation_cache_key(*rg._parse_simulation_request(scene))
+
+
+def test_cache_key_is_stable_and_ignores_key_order():
+    scene = _scene()
+    reordered = _scene()
+    reordered["entities"] = [dict(reversed(list(e.items()))) for e in reordered["entities"]]
+    reordered["distractorParams"] = dict(reversed(list(reordered["distractorParams"].items())))
+    assert _key(scene) == _key(_scene()) == _key(reordered)
+
+
+def test_cache_key_changes_with_anything_that_changes_the_result():
+    key = _key(_scene())
+    moved = _scene()
+    moved["entities"][1]["x"] += 0.5
+    reseeded = _scene()
+    reseeded["distractorParams"]["randomDistractorParams"]["seed"] = 4
+    analytic = dict(_scene(), engine="analytic")
+    assert len({key, _key(moved), _key(reseeded), _key(analytic)}) == 4
+
+
+def test_unseeded_random_distractors_are_not_cached():
+    scene = _scene()
+    del scene["distractorParams"]["randomDistractorParams"]["seed"]
+    assert _key(scene) is None
+
+
+def test_repeated_simulate_is_served_from_the_cache(monkeypatch):
+    monkeypatch.setattr(rg, "SIM_CACHE", rg.SimulationCache())
+    client = rg.app.test_client()
+    # Not json=: the test client sorts keys, and simulationParams is read in order
+    body = json.dumps(_scene())
+    first = client.post("/simulate", data=body, content_type="application/json").get_json()
+    second = client.post("/simulate", data=body, content_type="application/json").get_json()
+    assert first["cache_key"] == second["cache_key"] == _key(_scene())
+    assert first["sim_data"] == second["sim_data"]
+    assert (rg.SIM_CACHE.hits, rg.SIM_CACHE.misses) == (1, 1)
+
+
+def test_disk_cache_survives_a_new_instance(tmp_path):
+    scene = _scene()
+    entities, simulationParams, distractorParams, options = rg._parse_simulation_request(scene)
+    sim_data = rg.run_simulation_with_visualization(entities, simulationParams, distractorParams, **options)
+    rg.SimulationCache(disk_dir=str(tmp_path)).put(_key(scene), sim_data)
+    assert rg.SimulationCache(disk_dir=str(tmp_path)).get(_key(scene)) == sim_data
@@ -0,0 +1,102 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import CancelledError
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import red_green_playground as rg
+
+TIMEOUT = 10
+
+
+def _blocking(started, release):
+    """A job that polls for cancellation like the simulation loops do, until released"""
+    def fn():
+        started.set()
+        while not release.is_set():
+            rg.check_cancelled()
+            time.sleep(0.001)
+        return "released"
+    return fn
+
+
+def _running_job(jobs, session_id, **kwargs):
+    started, release = threading.Event(), threading.Event()
+    job = jobs.submit(_blocking(started, release), session_id, **kwargs)
+    assert started.wait(TIMEOUT)
+    return job, release
+
+
+def test_newer_job_of_a_session_supersedes_the_older_one():
+    jobs = rg.SimulationJobs(1)
+    old, _ = _running_job(jobs, "s1")
+    new = jobs.submit(lambda: "new", "s1")
+    with pytest.raises(rg.SimulationCancelled, match="Superseded"):
+        old["future"].result(TIMEOUT)
+    assert old["reason"] == "Superseded by a newer simulation request"
+    assert new["future"].result(TIMEOUT) == "new"
+    assert jobs.running() == 0
+
+
+def test_jobs_of_other_sessions_are_not_superseded():
+    jobs = rg.SimulationJobs(2)
+    other, release = _running_job(jobs, "s1")
+    assert jobs.submit(lambda: "s2", "s2")["future"].result(TIMEOUT) == "s2"
+    assert not other["cancel"].is_set()
+    release.set()
+    assert other["future"].result(TIMEOUT) == "released"
+
+
+def test_supersede_false_keeps_the_older_job():
+    jobs = rg.SimulationJobs(2)
+    old, release = _running_job(jobs, "s1")
+    assert jobs.submit(lambda: "new", "s1", supersede=False)["future"].result(TIMEOUT) == "new"
+    assert not old["cancel"].is_set()
+    release.set()
+    assert old["future"].result(TIMEOUT) == "released"
+
+
+def test_cancelling_a_queued_job_drops_it_before_it_starts():
+    jobs = rg.SimulationJobs(1)
+    running, release = _running_job(jobs, "s1")
+    ran = threading.Event()
+    queued = jobs.submit(ran.set, "s2")
+    assert jobs.running() == 2
+    assert jobs.cancel("s2", reason="Stopped") == 1
+    with pytest.raises(CancelledError):
+        queued["future"].result(TIMEOUT)
+    assert queued["reason"] == "Stopped"
+    assert jobs.running() == 1
+    release.set()
+    assert running["future"].result(TIMEOUT) == "released"
+    assert not ran.is_set()
+    assert jobs.running() == 0
+
+
+def test_cancel_by_job_id_only_cancels_that_job():
+    jobs = rg.SimulationJobs(2)
+    first, release_first = _running_job(jobs, "s1", job_id="a")
+    second, release_second = _running_job(jobs, "s1", supersede=False, job_id="b")
+    assert jobs.cancel("s1", job_id="b") == 1
+    with pytest.raises(rg.SimulationCancelled):
+        second["future"].result(TIMEOUT)
+    assert jobs.cancel("s1", job_id="missing") == 0
+    release_first.set()
+    assert first["future"].result(TIMEOUT) == "released"
+
+
+def test_cancel_stops_a_running_simulation():
+    jobs = rg.SimulationJobs(1)
+    # No sensors, so the target bounces for the whole (very long) video unless cancelled
+    entities = [{"id": "target", "type": "target", "x": 3, "y": 3, "width": 1, "height": 1, "direction": 0.7}]
+    job = jobs.submit(lambda: rg.run_simulation_with_visualization(entities, [10000, 3.6, 30, 10, 4, 0.012, 20, 20]),
+                      "s1")
+    time.sleep(0.05)
+    assert jobs.cancel("s1") == 1
+    with pytest.raises(rg.SimulationCancelled, match="Cancelled"):
+        job["future"].result(TIMEOUT)
+    assert jobs.running() == 0
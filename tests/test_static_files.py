@@ -0,0 +1,76 @@
+import gzip
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import red_green_playground as rg
+
+INDEX_HTML = b"<!doctype html><div id=root></div>"
+MAIN_JS = b"console.log('main');\n" * 100
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    build, assets = tmp_path / "build", tmp_path / "assets"
+    (build / "static" / "js").mkdir(parents=True)
+    (build / "index.html").write_bytes(INDEX_HTML)
+    (build / "static" / "js" / "main.js").write_bytes(MAIN_JS)
+    (assets / "site_static_assets").mkdir(parents=True)
+    (assets / "logo.svg").write_bytes(b"<svg/>")
+    (assets / "site_static_assets" / "hidden.png").write_bytes(b"png")
+    monkeypatch.setattr(rg, "STATIC_INDEX", rg.StaticFileIndex([str(build), str(assets)],
+                                                               exclude=["site_static_assets"]))
+    return rg.app.test_client()
+
+
+def test_serves_indexed_files_from_every_root(client):
+    assert client.get("/static/js/main.js").data == MAIN_JS
+    assert client.get("/logo.svg").data == b"<svg/>"
+    assert client.get("/").data == INDEX_HTML
+
+
+@pytest.mark.parametrize("route", ["/stimuli", "/scene/v1.2", "/user/jane.doe"])
+def test_router_paths_fall_back_to_index_html(client, route):
+    response = client.get(route)
+    assert response.status_code == 200
+    assert response.data == INDEX_HTML
+    assert response.headers["Cache-Control"] == "no-cache"
+
+
+@pytest.mark.parametrize("path", ["/static/js/missing.js", "/static/media/photo", "/missing.css", "/img/missing.PNG"])
+def test_missing_assets_are_404(client, path):
+    assert client.get(path).status_code == 404
+
+
+def test_excluded_directories_are_not_indexed(client):
+    # /site_static_assets/ is served by the asset cache route instead
+    assert rg.STATIC_INDEX.lookup("site_static_assets/hidden.png") is None
+    assert rg.STATIC_INDEX.lookup("logo.svg") is not None
+
+
+def test_etag_revalidation_returns_304(client):
+    first = client.get("/static/js/main.js")
+    assert first.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    second = client.get("/static/js/main.js", headers={"If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 304
+    assert second.data == b""
+
+
+def test_index_html_revalidates_with_its_etag(client):
+    etag = client.get("/").headers["ETag"]
+    assert client.get("/stimuli", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_compressed_responses_have_their_own_etag(client):
+    plain = client.get("/static/js/main.js")
+    compressed = client.get("/static/js/main.js", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(compressed.data) == MAIN_JS
+    assert compressed.headers["ETag"] != plain.headers["ETag"]
+    assert "Accept-Encoding" in compressed.headers["Vary"]
+    revalidated = client.get("/static/js/main.js", headers={"Accept-Encoding": "gzip",
+                                                            "If-None-Match": compressed.headers["ETag"]})
+    assert revalidated.status_code == 304
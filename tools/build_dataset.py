@@ -0,0 +1,374 @@
+"""
+Offline dataset builder: simulate many scenes of red_green_playground.py and write them to disk
+as a sharded dataset of arrays, for model training.
+
+The manifest is one of:
+- a directory of scene JSON files (each a /simulate request body), taken in file name order
+- a .jsonl file with one scene per line
+- a .json file with a scene, a list of scenes, or a parameter grid:
+    {
+      "base": {...scene...},
+      "grid": {"entities.<id>.<field>": [values...], "simulationParams.<field>": [values...]},
+      "random": {"<path>": {"uniform": [lo, hi]} | {"normal": [mean, std]} | {"choice": [values...]}},
+      "repeats": 1,
+      "seed": 0
+    }
+  Every combination of grid values is repeated `repeats` times with fresh "random" draws.
+  Paths address scene fields; "entities.<id>" picks the entity with that id.
+
+Output (OUT_DIR):
+    dataset.json              builder settings, fingerprint of the scenes and completion status
+    index.jsonl               one record per trial: shard, row, outcome, hit frames, frame counts
+    shards/shard-NNNNN.npz    trajectories: every sim_data_to_columns array concatenated over the
+                              shard's trials, with trial_offsets/<name> (n+1) giving each trial's slice
+    shards/shard-NNNNN.obs.npy  (--render) observation frames, (frames x H x W x 3) uint8, memory-mappable,
+                              with obs_offsets in the .npz
+    shards/shard-NNNNN.json   per-trial records and sim_data headers, written last (marks the shard done)
+
+Trials are deterministic given the manifest and --seed: random grid draws and the seeds of random
+distractors (when a scene does not set one) are derived from the seed and the trial index, never
+from worker scheduling. Shards that are already complete are skipped, so an interrupted build is
+resumed by running the same command again.
+
+Usage:
+    python tools/build_dataset.py scenes/ data/run1
+    python tools/build_dataset.py grid.json data/run2 --render --obs-interval 0.2 --workers 16
+    python tools/build_dataset.py grid.json data/run2 --overwrite    # rebuild after changing the manifest
+"""
+import argparse
+import contextlib
+import copy
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np
+
+# The app logs while setting up at import; keep stdout for progress
+with contextlib.redirect_stdout(sys.stderr):
+    import red_green_playground as rg
+
+DATASET_VERSION = 1
+
+
+def _set_path(scene, path, value):
+    """Set a dotted path in a scene; 'entities.<id>.<field>' addresses the entity with that id"""
+    keys = path.split('.')
+    node = scene
+    if keys[0] == 'entities' and len(keys) > 2:
+        matches = [e for e in scene['entities'] if str(e.get('id')) == keys[1]]
+        if not matches:
+            raise KeyError(f"No entity with id '{keys[1]}' for {path}")
+        node, keys = matches[0], keys[2:]
+    for key in keys[:-1]:
+        node = node.setdefault(key, {})
+    node[keys[-1]] = value
+
+
+def _draw(rng, spec):
+    if 'uniform' in spec:
+        return float(rng.uniform(*spec['uniform']))
+    if 'normal' in spec:
+        return float(rng.normal(*spec['normal']))
+    if 'choice' in spec:
+        return spec['choice'][int(rng.integers(len(spec['choice'])))]
+    raise ValueError(f"Unknown random spec {spec}")
+
+
+def _expand_grid(spec, seed):
+    grid = spec.get('grid', {})
+    random_specs = spec.get('random', {})
+    repeats = int(spec.get('repeats', 1))
+    index = 0
+    for values in itertools.product(*grid.values()):
+        for _ in range(repeats):
+            scene = copy.deepcopy(spec['base'])
+            params = dict(zip(grid, values))
+            # One generator per trial, so draws do not depend on which trials are built
+            rng = np.random.default_rng([seed, index])
+            params.update({path: _draw(rng, random_spec) for path, random_spec in random_specs.items()})
+            for path, value in params.items():
+                _set_path(scene, path, value)
+            yield f"trial-{index:06d}", 'grid', params, scene
+            index += 1
+
+
+def load_manifest(path, seed=None):
+    """
+    Expand a manifest into a list of trials {index, id, source, params, scene}.
+    Returns (trials, seed) where seed is --seed, else the grid's "seed", else 0.
+    """
+    entries = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.json'):
+                with open(os.path.join(path, name)) as f:
+                    entries.append((os.path.splitext(name)[0], name, None, json.load(f)))
+    elif path.endswith('.jsonl'):
+        with open(path) as f:
+            for line_number, line in enumerate(f, 1):
+                if line.strip():
+                    entries.append((f"line-{line_number:06d}", f"{os.path.basename(path)}:{line_number}", None, json.loads(line)))
+    else:
+        with open(path) as f:
+            spec = json.load(f)
+        if isinstance(spec, dict) and 'base' in spec:
+            seed = spec.get('seed', 0) if seed is None else seed
+            entries = list(_expand_grid(spec, seed))
+        else:
+            scenes = spec if isinstance(spec, list) else [spec]
+            entries = [(f"scene-{i:06d}", os.path.basename(path), None, scene) for i, scene in enumerate(scenes)]
+    seed = 0 if seed is None else seed
+
+    trials = []
+    for index, (trial_id, source, params, scene) in enumerate(entries):
+        # Random distractors without a seed get one derived from the trial, so every build is the same
+        randomParams = (scene.get('distractorParams') or {}).get('randomDistractorParams') or {}
+        if randomParams.get('probability', 0) > 0 and randomParams.get('seed') is None:
+            randomParams['seed'] = int(np.random.SeedSequence([seed, index]).generate_state(1)[0])
+        trials.append({'index': index, 'id': trial_id, 'source': source, 'params': params, 'scene': scene})
+    return trials, seed
+
+
+def dataset_fingerprint(trials, config):
+    """Hash of the expanded scenes and of every setting that changes the written arrays"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({'version': DATASET_VERSION, 'sim_cache_version': rg.SIM_CACHE_VERSION,
+                              'config': config}, sort_keys=True).encode('utf-8'))
+    for trial in trials:
+        digest.update(json.dumps(trial['scene'], sort_keys=True, separators=(',', ':')).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def shard_paths(out_dir, shard):
+    base = os.path.join(out_dir, 'shards', f'shard-{shard:05d}')
+    return {'arrays': base + '.npz', 'obs': base + '.obs.npy', 'meta': base + '.json'}
+
+
+def _trial_record(trial, shard, row, sim_data, error=None):
+    record = {'trial': trial['index'], 'id': trial['id'], 'source': trial['source'], 'shard': shard, 'row': row}
+    if trial['params'] is not None:
+        record['params'] = trial['params']
+    if error is not None:
+        record.update(status='error', message=error)
+        return record
+    record.update(
+        status='success',
+        rg_outcome=sim_data['rg_outcome'],
+        rg_hit_timestep=sim_data['rg_hit_timestep'],
+        num_frames=sim_data['num_frames'],
+        key_distractors=len(sim_data.get('key_distractors', [])),
+        random_distractors=len(sim_data.get('random_distractors', [])),
+    )
+    if 'rg_hit_frame_exact' in sim_data:
+        record['rg_hit_frame_exact'] = sim_data['rg_hit_frame_exact']
+    return record
+
+
+def build_shard(out_dir, shard, trials, config):
+    """Simulate one shard's trials and write its files; the .json is written last, atomically"""
+    paths = shard_paths(out_dir, shard)
+    dtype = np.dtype(config['dtype'])
+    start = time.perf_counter()
+
+    records, headers, columns, occlusion = [], [], [], []
+    for row, trial in enumerate(trials):
+        try:
+            entities, simulationParams, distractorParams, options = rg._parse_simulation_request(trial['scene'])
+            sim_data = rg.run_simulation_with_visualization(entities, simulationParams, distractorParams, **options)
+        except Exception as e:
+            records.append(_trial_record(trial, shard, row, None, str(e)))
+            headers.append(None)
+            columns.append(None)
+            occlusion.append(None)
+            continue
+        records.append(_trial_record(trial, shard, row, sim_data))
+        header, arrays = rg.sim_data_to_columns(sim_data, dtype)
+        headers.append(header)
+        columns.append((sim_data, arrays))
+        occlusion.append(rg.occlusion_annotations(sim_data) if config['occlusion'] else None)
+
+    # Concatenate each array over the shard's trials; failed trials get empty slices
+    names = sorted({name for c in columns if c is not None for name in c[1]})
+    out = {}
+    for name in names:
+        parts = [c[1][name] for c in columns if c is not None]
+        out[name] = np.concatenate(parts) if parts else np.empty(0)
+        lengths = [len(c[1][name]) if c is not None else 0 for c in columns]
+        out[f'trial_offsets/{name}'] = np.cumsum([0] + lengths, dtype=np.int64)
+    if config['occlusion']:
+        fractions = [np.asarray(o['occluded_fraction'], dtype=dtype) if o else np.empty(0, dtype) for o in occlusion]
+        out['occlusion/occluded_fraction'] = np.concatenate(fractions)
+        out['occlusion/fully_occluded'] = np.concatenate([np.asarray(o['fully_occluded'], dtype=bool) if o else np.empty(0, bool)
+                                                          for o in occlusion])
+        out['trial_offsets/occlusion'] = np.cumsum([0] + [len(f) for f in fractions], dtype=np.int64)
+
+    if config['render']:
+        frame_counts = [c[0]['num_frames'] if c is not None else 0 for c in columns]
+        out['obs_offsets'] = np.cumsum([0] + frame_counts, dtype=np.int64)
+        world = {tuple(c[0]['scene_dims']) for c in columns if c is not None}
+        # Checked before allocating the (possibly large) observation file
+        if len(world) > 1:
+            raise ValueError("All trials of a rendered dataset must have the same world size")
+        width, height = world.pop() if world else (20, 20)
+        xs, ys = rg._obs_pixel_grid(width, height, config['obs_interval'])
+        tmp_obs = paths['obs'] + '.tmp.npy'
+        try:
+            obs = np.lib.format.open_memmap(tmp_obs, mode='w+', dtype=np.uint8, shape=(int(out['obs_offsets'][-1]), len(ys), len(xs), 3))
+            for c, offset in zip(columns, out['obs_offsets']):
+                if c is None:
+                    continue
+                for frame, frame_data in enumerate(rg.iter_obs_frames(c[0], config['obs_interval'])):
+                    obs[offset + frame] = frame_data
+            obs.flush()
+            del obs
+            os.replace(tmp_obs, paths['obs'])
+        finally:
+            # Only left behind if rendering failed; a retry starts a new one
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_obs)
+
+    tmp_arrays = paths['arrays'] + '.tmp.npz'
+    np.savez(tmp_arrays, **out)
+    os.replace(tmp_arrays, paths['arrays'])
+
+    meta = {'shard': shard, 'trials': records, 'headers': headers}
+    tmp_meta = paths['meta'] + '.tmp'
+    with open(tmp_meta, 'w') as f:
+        json.dump(meta, f, default=float)
+    os.replace(tmp_meta, paths['meta'])
+    return shard, len(trials), sum(r['status'] == 'error' for r in records), time.perf_counter() - start
+
+
+def _init_worker():
+    rg.logger.setLevel(logging.WARNING)
+
+
+def build_dataset(manifest, out_dir, shard_size=256, workers=None, render=False, obs_interval=0.2,
+                  dtype='float32', occlusion=False, seed=None, overwrite=False):
+    """Build (or resume building) a dataset; returns the dataset.json contents"""
+    trials, seed = load_manifest(manifest, seed)
+    config = {'shard_size': shard_size, 'render': render, 'obs_interval': obs_interval if render else None,
+              'dtype': dtype, 'occlusion': occlusion, 'seed': seed}
+    fingerprint = dataset_fingerprint(trials, config)
+    dataset_path = os.path.join(out_dir, 'dataset.json')
+    if os.path.exists(dataset_path):
+        with open(dataset_path) as f:
+            existing = json.load(f)
+        if existing.get('fingerprint') != fingerprint:
+            if not overwrite:
+                previous = existing.get('config', {})
+                changed = [f"{key} {previous.get(key)!r} -> {value!r}" for key, value in config.items()
+                           if previous.get(key) != value]
+                reason = f"with different settings ({', '.join(changed)})" if changed else "from a different manifest"
+                raise SystemExit(f"{out_dir} holds a dataset built {reason}; rerun with the original settings "
+                                 "to resume, or use --overwrite to rebuild it")
+            shutil.rmtree(os.path.join(out_dir, 'shards'), ignore_errors=True)
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(os.path.join(out_dir, 'index.jsonl'))
+    os.makedirs(os.path.join(out_dir, 'shards'), exist_ok=True)
+
+    num_shards = (len(trials) + shard_size - 1) // shard_size
+    dataset = {'version': DATASET_VERSION, 'manifest': os.path.abspath(manifest), 'fingerprint': fingerprint,
+               'config': config, 'num_trials': len(trials), 'num_shards': num_shards, 'complete': False}
+    with open(dataset_path, 'w') as f:
+        json.dump(dataset, f, indent=2)
+
+    pending = [s for s in range(num_shards) if not os.path.exists(shard_paths(out_dir, s)['meta'])]
+    print(f"{len(trials)} trials in {num_shards} shards, {num_shards - len(pending)} already built")
+    failed = []
+    start = time.perf_counter()
+    workers = max(1, min(workers or os.cpu_count() or 1, len(pending) or 1))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {executor.submit(build_shard, out_dir, s, trials[s * shard_size:(s + 1) * shard_size], config): s
+                   for s in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                shard, count, errors, seconds = future.result()
+            except Exception as e:
+                failed.append(futures[future])
+                print(f"[{done}/{len(pending)}] shard {futures[future]:05d} failed: {e}", file=sys.stderr)
+                continue
+            print(f"[{done}/{len(pending)}] shard {shard:05d}: {count} trials ({errors} errors) in {seconds:.1f}s, "
+                  f"{time.perf_counter() - start:.1f}s elapsed")
+
+    if failed:
+        print(f"{len(failed)} shards failed; run the same command again to retry them", file=sys.stderr)
+        return dataset
+
+    # All shards are done: write the combined index
+    outcomes = {}
+    with open(os.path.join(out_dir, 'index.jsonl.tmp'), 'w') as f:
+        for s in range(num_shards):
+            with open(shard_paths(out_dir, s)['meta']) as shard_file:
+                for record in json.load(shard_file)['trials']:
+                    key = record.get('rg_outcome') if record['status'] == 'success' else 'error'
+                    outcomes[str(key)] = outcomes.get(str(key), 0) + 1
+                    f.write(json.dumps(record) + '\n')
+    os.replace(os.path.join(out_dir, 'index.jsonl.tmp'), os.path.join(out_dir, 'index.jsonl'))
+    dataset.update(complete=True, outcomes=outcomes)
+    with open(dataset_path, 'w') as f:
+        json.dump(dataset, f, indent=2)
+    return dataset
+
+
+def load_shard(out_dir, shard, mmap_obs=True):
+    """(arrays, metadata, observations or None) of a built shard; observations are memory-mapped"""
+    paths = shard_paths(out_dir, shard)
+    with np.load(paths['arrays']) as npz:
+        arrays = {name: npz[name] for name in npz.files}
+    with open(paths['meta']) as f:
+        meta = json.load(f)
+    obs = np.load(paths['obs'], mmap_mode='r' if mmap_obs else None) if os.path.exists(paths['obs']) else None
+    return arrays, meta, obs
+
+
+def load_trial(out_dir, shard, row):
+    """Rebuild one trial's sim_data (and its observation frames, if rendered) from a shard"""
+    arrays, meta, obs = load_shard(out_dir, shard)
+    header = meta['headers'][row]
+    if header is None:
+        raise ValueError(f"Trial {meta['trials'][row]['id']} failed: {meta['trials'][row].get('message')}")
+    columns = {}
+    for name, offsets in arrays.items():
+        if name.startswith('trial_offsets/') and not name.startswith('trial_offsets/occlusion'):
+            column = name[len('trial_offsets/'):]
+            columns[column] = arrays[column][offsets[row]:offsets[row + 1]]
+    sim_data = rg.columns_to_sim_data(header, columns)
+    frames = obs[arrays['obs_offsets'][row]:arrays['obs_offsets'][row + 1]] if obs is not None else None
+    return sim_data, frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a manifest of scenes into a sharded array dataset")
+    parser.add_argument("manifest", help="Directory of scene JSONs, a .jsonl of scenes, or a .json scene list or parameter grid")
+    parser.add_argument("out_dir", help="Output directory (resumed if it already holds a build of the same manifest)")
+    parser.add_argument("--shard-size", type=int, default=256, help="Trials per shard")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all CPUs)")
+    parser.add_argument("--render", action="store_true", help="Also render observation frames")
+    parser.add_argument("--obs-interval", type=float, default=0.2, help="Observation pixel size in world units (0.2 = 100x100 for a 20x20 world)")
+    parser.add_argument("--dtype", choices=("float32", "float64"), default="float32", help="Trajectory array dtype")
+    parser.add_argument("--occlusion", action="store_true", help="Also store per-frame occluded fraction and fully-occluded flags")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for grid draws and unseeded random distractors (default: the grid's seed, else 0)")
+    parser.add_argument("--overwrite", action="store_true", help="Rebuild if out_dir holds a dataset of a different manifest or settings")
+    args = parser.parse_args()
+
+    rg.logger.setLevel(logging.WARNING)
+    dataset = build_dataset(args.manifest, args.out_dir, args.shard_size, args.workers, args.render, args.obs_interval,
+                            args.dtype, args.occlusion, args.seed, args.overwrite)
+    if not dataset['complete']:
+        sys.exit(1)
+    print(f"Done: {dataset['num_trials']} trials, outcomes {dataset['outcomes']}")
+
+
+if __name__ == "__main__":
+    main()